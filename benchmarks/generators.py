@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import random
+
+from typing import Callable
+
+
+##################################
+#                                #
+#   --- Synthetic documents ---  #
+#                                #
+##################################
+
+# Each generator returns a deterministic HTML document of roughly
+# size_bytes bytes (within one repeated unit).
+
+WORDS: list[str] = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do "
+    "eiusmod tempor incididunt ut labore et dolore magna aliqua enim ad "
+    "minim veniam quis nostrud exercitation ullamco laboris nisi aliquip "
+    "ex ea commodo consequat duis aute irure in reprehenderit voluptate"
+).split()
+
+
+def make_sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def wrap_document(body: str, title: str) -> str:
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+        f"<title>{title}</title></head><body>{body}</body></html>"
+    )
+
+
+def fill(
+    size_bytes: int,
+    make_unit: Callable[[int], str]
+        ) -> list[str]:
+    units: list[str] = []
+    total: int = 0
+    while total < size_bytes:
+        unit: str = make_unit(len(units))
+        units.append(unit)
+        total += len(unit.encode("utf-8"))
+    return units
+
+
+def generate_deep_nesting(size_bytes: int, seed: int = 0) -> str:
+    # Long chains of nested blocks, 200 levels deep.
+    rng = random.Random(seed)
+    depth: int = 200
+
+    def make_unit(i: int) -> str:
+        opening: str = "".join(
+            f"<div class='level-{level}'>" for level in range(depth)
+        )
+        closing: str = "</div>" * depth
+        return f"{opening}<p>{make_sentence(rng, 12)}</p>{closing}"
+
+    return wrap_document("".join(fill(size_bytes, make_unit)), "deep")
+
+
+def generate_wide_siblings(size_bytes: int, seed: int = 0) -> str:
+    # A single parent with a very long list of small children.
+    rng = random.Random(seed)
+
+    def make_unit(i: int) -> str:
+        return f"<li id='item-{i}'>{make_sentence(rng, 6)}</li>"
+
+    return wrap_document(
+        "<ul>" + "".join(fill(size_bytes, make_unit)) + "</ul>", "wide"
+    )
+
+
+def generate_inline_scripts(size_bytes: int, seed: int = 0) -> str:
+    # Content interleaved with large inline scripts, styles and svgs.
+    rng = random.Random(seed)
+    script_body: str = "var data = [" + ",".join(
+        str(i) for i in range(4000)
+    ) + "];"
+
+    def make_unit(i: int) -> str:
+        return (
+            f"<section><h2>{make_sentence(rng, 4)}</h2>"
+            f"<p>{make_sentence(rng, 30)}</p>"
+            f"<script>{script_body}</script>"
+            "<style>.c{color:red}</style>"
+            "<svg><g><path d='M0 0L10 10'/></g></svg></section>"
+        )
+
+    return wrap_document("".join(fill(size_bytes, make_unit)), "scripts")
+
+
+def generate_tables(size_bytes: int, seed: int = 0) -> str:
+    # Big data tables, 20 rows of 8 cells each.
+    rng = random.Random(seed)
+
+    def make_unit(i: int) -> str:
+        rows: str = "".join(
+            "<tr>" + "".join(
+                f"<td>{rng.randint(0, 10 ** 6)}</td>" for _ in range(8)
+            ) + "</tr>"
+            for _ in range(20)
+        )
+        header: str = "".join(f"<th>col {n}</th>" for n in range(8))
+        return (
+            f"<table><caption>{make_sentence(rng, 5)}</caption>"
+            f"<thead><tr>{header}</tr></thead><tbody>{rows}</tbody></table>"
+        )
+
+    return wrap_document("".join(fill(size_bytes, make_unit)), "tables")
+
+
+def generate_articles(size_bytes: int, seed: int = 0) -> str:
+    # Typical article markup: headings, paragraphs, lists and links.
+    rng = random.Random(seed)
+
+    def make_unit(i: int) -> str:
+        paragraphs: str = "".join(
+            f"<p>{make_sentence(rng, rng.randint(10, 60))} "
+            f"<a href='/page/{i}'>{make_sentence(rng, 2)}</a> "
+            f"<b>{make_sentence(rng, 3)}</b>.</p>"
+            for _ in range(rng.randint(2, 6))
+        )
+        items: str = "".join(
+            f"<li>{make_sentence(rng, 5)}</li>"
+            for _ in range(rng.randint(0, 5))
+        )
+        return (
+            f"<article><h2>{make_sentence(rng, 6)}</h2>{paragraphs}"
+            f"<ul>{items}</ul></article>"
+        )
+
+    return wrap_document(
+        "<main>" + "".join(fill(size_bytes, make_unit)) + "</main>",
+        "articles"
+    )
+
+
+GENERATORS: dict[str, Callable[[int, int], str]] = {
+    "deep_nesting": generate_deep_nesting,
+    "wide_siblings": generate_wide_siblings,
+    "inline_scripts": generate_inline_scripts,
+    "tables": generate_tables,
+    "articles": generate_articles,
+}
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from importlib import metadata
+
+from pathlib import Path
+
+from typing import Any
+from typing import Iterator
+from typing import Optional
+
+import typer
+
+from betterhtmlchunking.main import DomRepresentation
+from betterhtmlchunking.main import ReprLengthComparisionBy
+
+from benchmarks.generators import GENERATORS
+
+
+###############################
+#                             #
+#   --- Benchmark suite ---   #
+#                             #
+###############################
+
+# Run from the repository root:
+#   python -m benchmarks.run_benchmarks run --output before.json
+#   python -m benchmarks.run_benchmarks compare before.json after.json
+
+app = typer.Typer(help="Benchmark the chunking pipeline")
+
+FIXTURES_DIR: Path = Path(__file__).parent / "fixtures"
+SIZE_UNITS: dict[str, int] = {"KB": 1024, "MB": 1024 ** 2, "B": 1}
+MB: float = 1024.0 ** 2
+
+# Import time budgets (seconds) of the entry points. None of them may
+# load the deferred dependencies: the code paths using those import them.
+IMPORT_BUDGETS: dict[str, float] = {
+    "betterhtmlchunking": 0.03,
+    "betterhtmlchunking.main": 0.15,
+    "betterhtmlchunking.cli": 0.15,
+}
+DEFERRED_MODULES: tuple[str, ...] = (
+    "bs4",
+    "parsel_text",
+    "ftfy",
+    "treelib",
+    "numpy",
+    "concurrent.futures.process",
+)
+# The package itself does not load the parser either.
+PACKAGE_DEFERRED_MODULES: tuple[str, ...] = DEFERRED_MODULES + ("lxml",)
+
+
+def parse_size(size: str) -> int:
+    size = size.strip().upper()
+    for unit, factor in SIZE_UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * factor)
+    return int(size)
+
+
+def iter_cases(
+    generators: list[str],
+    sizes: list[int],
+    fixtures: bool
+        ) -> Iterator[tuple[str, str]]:
+    # (case name, HTML) pairs.
+    for name in generators:
+        for size in sizes:
+            yield f"{name}/{size}", GENERATORS[name](size)
+    if fixtures:
+        for path in sorted(FIXTURES_DIR.glob("*.html")):
+            yield f"fixture/{path.stem}", path.read_text(encoding="utf-8")
+
+
+def run_pipeline(
+    website_code: str,
+    max_length: int,
+    compared_by: ReprLengthComparisionBy,
+    trace_memory: bool
+        ) -> dict[str, Any]:
+    dom_representation = DomRepresentation(
+        MAX_NODE_REPR_LENGTH=max_length,
+        website_code=website_code,
+        repr_length_compared_by=compared_by,
+        trace_memory=trace_memory,
+        # Whitespace tokens: local and deterministic.
+        tokenizer=str.split
+        if compared_by == ReprLengthComparisionBy.TOKEN_LENGTH else None
+    )
+    dom_representation.start(verbose=False)
+    return dom_representation.stats.as_dict()
+
+
+def add_throughput(entry: dict[str, Any], size_mb: float) -> None:
+    wall_time: float = entry["wall_time"]
+    entry["docs_per_s"] = 1.0 / wall_time if wall_time else None
+    entry["mb_per_s"] = size_mb / wall_time if wall_time else None
+
+
+def measure_case(
+    website_code: str,
+    max_length: int,
+    compared_by: ReprLengthComparisionBy,
+    repeat: int,
+    memory: bool
+        ) -> dict[str, Any]:
+    # Timings are the best of the repeats; memory comes from an extra
+    # run, since tracing slows every allocation down.
+    runs: list[dict[str, Any]] = [
+        run_pipeline(
+            website_code=website_code,
+            max_length=max_length,
+            compared_by=compared_by,
+            trace_memory=False
+        )
+        for _ in range(repeat)
+    ]
+    best: dict[str, Any] = min(runs, key=lambda run: run["wall_time"])
+    for name, stage in best["stages"].items():
+        stage["wall_time"] = min(run["stages"][name]["wall_time"]
+                                 for run in runs)
+        stage["cpu_time"] = min(run["stages"][name]["cpu_time"]
+                                for run in runs)
+
+    if memory:
+        traced: dict[str, Any] = run_pipeline(
+            website_code=website_code,
+            max_length=max_length,
+            compared_by=compared_by,
+            trace_memory=True
+        )
+        for name, stage in best["stages"].items():
+            stage["peak_memory"] = traced["stages"][name]["peak_memory"]
+        best["peak_memory"] = traced["peak_memory"]
+
+    size_mb: float = len(website_code.encode("utf-8")) / MB
+    add_throughput(entry=best, size_mb=size_mb)
+    for stage in best["stages"].values():
+        add_throughput(entry=stage, size_mb=size_mb)
+    return best
+
+
+def get_git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_environment() -> dict[str, Any]:
+    try:
+        version: Optional[str] = metadata.version("betterhtmlchunking")
+    except metadata.PackageNotFoundError:
+        version = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "version": version,
+        "git_revision": get_git_revision(),
+        "python": sys.version,
+        "platform": platform.platform(),
+    }
+
+
+def run_importtime(module: Optional[str]) -> tuple[dict[str, float], set]:
+    """Cumulative time (seconds) of each top-level import, with
+    -X importtime in a fresh interpreter, and the modules loaded."""
+    statement: str = "import sys" if module is None else\
+        f"import sys, {module}"
+    completed = subprocess.run(
+        [
+            sys.executable, "-X", "importtime", "-c",
+            f"{statement}; print(' '.join(sys.modules))"
+        ],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    # "import time: <self us> | <cumulative us> | <indent><name>"
+    timings: dict[str, float] = {}
+    for line in completed.stderr.splitlines():
+        fields: list[str] = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name: str = fields[2][1:]
+        if not name.startswith(" "):
+            timings[name] = int(fields[1]) / 1e6
+    return timings, set(completed.stdout.split())
+
+
+def measure_import(module: str, repeat: int) -> tuple[float, list[str]]:
+    # Imports done by the interpreter itself (site...) are not counted.
+    startup: set = set(run_importtime(module=None)[0])
+    best: Optional[float] = None
+    for _ in range(repeat):
+        timings, modules = run_importtime(module=module)
+        total: float = sum(
+            seconds for name, seconds in timings.items()
+            if name not in startup
+        )
+        best = total if best is None else min(best, total)
+    deferred_modules: tuple[str, ...] = PACKAGE_DEFERRED_MODULES\
+        if module == "betterhtmlchunking" else DEFERRED_MODULES
+    deferred: list[str] = [name for name in deferred_modules
+                           if name in modules]
+    return best, deferred
+
+
+def get_result_key(result: dict[str, Any]) -> tuple:
+    return (result["case"], result["max_length"], result["compared_by"])
+
+
+def format_seconds(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.1f} ms"
+
+
+@app.command()
+def run(
+    output: Path = typer.Option(
+        Path("benchmark-results.json"),
+        "--output",
+        "-o",
+        help="JSON file to write the results to",
+    ),
+    generators: list[str] = typer.Option(
+        list(GENERATORS),
+        "--generator",
+        "-g",
+        help="Synthetic generator to run. Can be repeated.",
+    ),
+    sizes: list[str] = typer.Option(
+        ["10KB", "100KB", "1MB"],
+        "--size",
+        "-s",
+        help="Synthetic document size, e.g. 10KB or 50MB. Can be repeated.",
+    ),
+    max_lengths: list[int] = typer.Option(
+        [256, 4096, 32768],
+        "--max-length",
+        "-l",
+        help="MAX_NODE_REPR_LENGTH to run with. Can be repeated.",
+    ),
+    fixtures: bool = typer.Option(
+        True,
+        "--fixtures/--no-fixtures",
+        help="Also run the bundled real-page fixtures",
+    ),
+    repeat: int = typer.Option(
+        3,
+        "--repeat",
+        "-r",
+        help="Timed runs per case, the best one is kept",
+    ),
+    memory: bool = typer.Option(
+        True,
+        "--memory/--no-memory",
+        help="Measure the peak memory of every stage (one extra run)",
+    )
+        ):
+    """Run the benchmarks and write the results to a JSON file."""
+    unknown: list[str] = [name for name in generators
+                          if name not in GENERATORS]
+    if unknown:
+        raise typer.BadParameter(
+            f"must be one of {', '.join(GENERATORS)}",
+            param_hint="--generator"
+        )
+
+    results: list[dict[str, Any]] = []
+    for case, website_code in iter_cases(
+            generators=generators,
+            sizes=[parse_size(size) for size in sizes],
+            fixtures=fixtures):
+        for max_length in max_lengths:
+            for compared_by in ReprLengthComparisionBy:
+                result: dict[str, Any] = {
+                    "case": case,
+                    "size_bytes": len(website_code.encode("utf-8")),
+                    "max_length": max_length,
+                    "compared_by": compared_by.value,
+                    **measure_case(
+                        website_code=website_code,
+                        max_length=max_length,
+                        compared_by=compared_by,
+                        repeat=repeat,
+                        memory=memory
+                    )
+                }
+                results.append(result)
+                peak_memory: Optional[int] = result["peak_memory"]
+                typer.echo(
+                    f"{case:<28} {max_length:>6} {compared_by.value:<12}"
+                    f" {format_seconds(result['wall_time']):>12}"
+                    f" {result['mb_per_s'] or 0:>8.2f} MB/s"
+                    + ("" if peak_memory is None
+                       else f" {peak_memory / MB:>8.1f} MB peak")
+                )
+
+    output.write_text(
+        json.dumps(
+            {"environment": get_environment(), "results": results},
+            indent=2
+        ),
+        encoding="utf-8"
+    )
+    typer.echo(f"Wrote {len(results)} results to {output}")
+
+
+@app.command()
+def compare(
+    baseline: Path = typer.Argument(..., help="Results of the old run"),
+    candidate: Path = typer.Argument(..., help="Results of the new run"),
+    threshold: float = typer.Option(
+        0.1,
+        "--threshold",
+        "-t",
+        help="Relative slowdown reported as a regression",
+    ),
+    min_time: float = typer.Option(
+        0.001,
+        "--min-time",
+        help="Stages faster than this (seconds) in both runs are noise, "
+        "never regressions",
+    )
+        ):
+    """Compare two result files stage by stage.
+
+    Exits with status 1 when a stage got slower than the threshold.
+    """
+    baseline_results: dict[tuple, dict[str, Any]] = {
+        get_result_key(result): result
+        for result in json.loads(baseline.read_text())["results"]
+    }
+    regressions: int = 0
+    for result in json.loads(candidate.read_text())["results"]:
+        key: tuple = get_result_key(result)
+        old: Optional[dict[str, Any]] = baseline_results.get(key)
+        if old is None:
+            continue
+        timings: dict[str, tuple[float, float]] = {
+            name: (old["stages"][name]["wall_time"], stage["wall_time"])
+            for name, stage in result["stages"].items()
+            if name in old["stages"]
+        }
+        timings["total"] = (old["wall_time"], result["wall_time"])
+        for name, (old_time, new_time) in timings.items():
+            change: float = (new_time - old_time) / old_time if old_time\
+                else 0.0
+            regressed: bool = change > threshold\
+                and max(old_time, new_time) >= min_time
+            regressions += regressed
+            typer.echo(
+                f"{'REGRESSION' if regressed else '':<10} "
+                f"{key[0]:<28} {key[1]:>6} {key[2]:<12} {name:<8}"
+                f" {format_seconds(old_time):>12}"
+                f" {format_seconds(new_time):>12} {change:>+8.1%}"
+            )
+
+    typer.echo(f"{regressions} regression(s) above {threshold:.0%}")
+    if regressions:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def imports(
+    repeat: int = typer.Option(
+        5,
+        "--repeat",
+        "-r",
+        help="Fresh interpreters per module, the fastest one is kept",
+    ),
+    scale: float = typer.Option(
+        1.0,
+        "--scale",
+        help="Multiply the budgets by this, for slower machines",
+    )
+        ):
+    """Check the import time of the entry points against their budgets.
+
+    Exits with status 1 when one is over budget or loads a dependency
+    that should only be imported when used.
+    """
+    failures: int = 0
+    for module, budget in IMPORT_BUDGETS.items():
+        seconds, deferred = measure_import(module=module, repeat=repeat)
+        failed: bool = seconds > budget * scale or bool(deferred)
+        failures += failed
+        typer.echo(
+            f"{'FAIL' if failed else 'ok':<5} {module:<28}"
+            f" {format_seconds(seconds):>10}"
+            f" / {format_seconds(budget * scale):>10}"
+            + (f"  loads {', '.join(deferred)}" if deferred else "")
+        )
+    if failures:
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
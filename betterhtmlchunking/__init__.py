@@ -1,3 +1,31 @@
 #!/usr/bin/env python3
 
-from betterhtmlchunking.main import DomRepresentation
+import importlib
+
+
+# Public names and their modules, imported on first access: importing
+# the package loads no parser, no process pool, not even typing.
+LAZY_ATTRIBUTES: dict[str, str] = {
+    "DomRepresentation": "betterhtmlchunking.main",
+    "chunk_many": "betterhtmlchunking.batch",
+    "rechunk": "betterhtmlchunking.incremental",
+    "iter_stream_chunks": "betterhtmlchunking.streaming",
+}
+
+__all__: list[str] = list(LAZY_ATTRIBUTES)
+
+
+def __getattr__(name: str) -> object:
+    module_name: str | None = LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}"
+        )
+    value: object = getattr(importlib.import_module(module_name), name)
+    # Later accesses do not go through __getattr__.
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(LAZY_ATTRIBUTES))
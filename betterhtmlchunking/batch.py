@@ -0,0 +1,614 @@
+#!/usr/bin/env python3
+
+import attrs
+
+from attrs_strict import type_validator
+
+import os
+
+from collections import deque
+
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+
+from betterhtmlchunking.main import DomRepresentation
+
+from betterhtmlchunking.tree_regions_system import\
+    ReprLengthComparisionBy
+
+from betterhtmlchunking.render_system import ChunkKind
+from betterhtmlchunking.render_system import make_chunk_kinds
+from betterhtmlchunking.render_system import render_pos_xpath_list
+
+from betterhtmlchunking.node_metrics import MetricsMode
+from betterhtmlchunking.node_metrics import HtmlSerialization
+
+from betterhtmlchunking.lxml_backend import ParserBackend
+
+from betterhtmlchunking.token_length import TokenizerT
+
+from betterhtmlchunking.html_source import HtmlSourceT
+from betterhtmlchunking.html_source import open_html_source
+
+from betterhtmlchunking.layout_cache import get_shared_layout_cache
+
+from betterhtmlchunking.result_cache import ResultCache
+from betterhtmlchunking.result_cache import make_cache_key
+
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+
+
+##############################
+#                            #
+#   --- Batch chunking ---   #
+#                            #
+##############################
+
+# Documents are chunked in worker processes. Only plain records travel
+# back (xpaths and rendered strings), never the soup or the trees.
+
+
+@attrs.define()
+class ChunkingOptions:
+    max_length: int = attrs.field(
+        validator=type_validator()
+    )
+    compared_by: ReprLengthComparisionBy = attrs.field(
+        validator=type_validator(),
+        converter=ReprLengthComparisionBy,
+        default=ReprLengthComparisionBy.HTML_LENGTH
+    )
+    # Renders to send back for every chunk.
+    kinds: tuple[ChunkKind, ...] = attrs.field(
+        validator=type_validator(),
+        converter=make_chunk_kinds,
+        default=(ChunkKind.HTML, ChunkKind.TEXT)
+    )
+    tag_list_to_filter_out: Optional[list[str]] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+    html_unescape: bool = attrs.field(
+        validator=type_validator(),
+        default=True
+    )
+    metrics_mode: MetricsMode = attrs.field(
+        validator=type_validator(),
+        converter=MetricsMode,
+        default=MetricsMode.BOTTOM_UP
+    )
+    backend: ParserBackend = attrs.field(
+        validator=type_validator(),
+        converter=ParserBackend,
+        default=ParserBackend.BS4
+    )
+    html_serialization: HtmlSerialization = attrs.field(
+        validator=type_validator(),
+        converter=HtmlSerialization,
+        default=HtmlSerialization.PRETTIFIED
+    )
+    # Sent to the workers, so it has to be picklable.
+    tokenizer: Optional[TokenizerT] = attrs.field(
+        validator=attrs.validators.optional(attrs.validators.is_callable()),
+        default=None
+    )
+    # Stable name of the tokenizer (e.g. "tiktoken:cl100k_base"), for
+    # the cache keys: a callable has no identity that holds across
+    # processes and runs.
+    tokenizer_id: Optional[str] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+    # Reuse regions between pages with the same structure, each worker
+    # process keeps its own layout cache.
+    layout_cache: bool = attrs.field(
+        validator=type_validator(),
+        default=False
+    )
+
+    def make_dom_representation(
+        self,
+        website_code: HtmlSourceT
+            ) -> DomRepresentation:
+        return DomRepresentation(
+            MAX_NODE_REPR_LENGTH=self.max_length,
+            website_code=website_code,
+            repr_length_compared_by=self.compared_by,
+            tag_list_to_filter_out=self.tag_list_to_filter_out,
+            html_unescape=self.html_unescape,
+            metrics_mode=self.metrics_mode,
+            backend=self.backend,
+            html_serialization=self.html_serialization,
+            tokenizer=self.tokenizer,
+            layout_cache=get_shared_layout_cache()
+            if self.layout_cache else None
+        )
+
+    @property
+    def cacheable(self) -> bool:
+        # Token lengths depend on the tokenizer, only known by its id.
+        # Layout cached results are not stored: they would come from
+        # the state of one worker process.
+        if self.layout_cache:
+            return False
+        return self.compared_by != ReprLengthComparisionBy.TOKEN_LENGTH\
+            or self.tokenizer_id is not None
+
+    def make_cache_key(self, website_code: Any) -> str:
+        return make_cache_key(
+            website_code=website_code,
+            parameters=[
+                self.max_length,
+                self.compared_by.value,
+                [kind.value for kind in self.kinds],
+                self.tag_list_to_filter_out,
+                self.html_unescape,
+                self.metrics_mode.value,
+                self.backend.value,
+                self.html_serialization.value,
+                self.tokenizer_id,
+                self.layout_cache,
+            ]
+        )
+
+
+@attrs.define()
+class ChunkRecord:
+    roi_idx: int = attrs.field(
+        validator=type_validator()
+    )
+    pos_xpaths: list[str] = attrs.field(
+        validator=type_validator()
+    )
+    repr_length: int = attrs.field(
+        validator=type_validator()
+    )
+    # None when the kind was not asked for.
+    html: Optional[str] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+    text: Optional[str] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+    def as_dict(self) -> dict[str, Any]:
+        # JSON output record (command line, server): renders that were
+        # not asked for are left out.
+        record: dict[str, Any] = {
+            "roi_idx": self.roi_idx,
+            "xpaths": self.pos_xpaths,
+        }
+        if self.html is not None:
+            record["html"] = self.html
+        if self.text is not None:
+            record["text"] = self.text
+        record["length"] = self.repr_length
+        return record
+
+
+@attrs.define()
+class DocumentChunks:
+    # Position of the document in the input.
+    index: int = attrs.field(
+        validator=type_validator()
+    )
+    chunks: list[ChunkRecord] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+    # "ExceptionType: message" when the document could not be chunked.
+    error: Optional[str] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def format_error(error: BaseException) -> str:
+    return f"{type(error).__name__}: {error}"
+
+
+def chunk_document(
+    index: int,
+    website_code: HtmlSourceT,
+    options: ChunkingOptions
+        ) -> DocumentChunks:
+    try:
+        dom_representation: DomRepresentation =\
+            options.make_dom_representation(website_code=website_code)
+
+        chunks: list[ChunkRecord] = []
+        for roi_idx, roi in enumerate(
+                dom_representation.iter_regions_of_interest()):
+            renders: dict[str, str] = {
+                kind.value: render_pos_xpath_list(
+                    tree_representation=\
+                    dom_representation.tree_representation,
+                    pos_xpath_list=roi.pos_xpath_list,
+                    kind=kind
+                )
+                for kind in options.kinds
+            }
+            chunks.append(
+                ChunkRecord(
+                    roi_idx=roi_idx,
+                    pos_xpaths=list(roi.pos_xpath_list),
+                    repr_length=roi.repr_length,
+                    **renders
+                )
+            )
+    except Exception as error:
+        # One malformed page must not take the batch down.
+        return DocumentChunks(index=index, error=format_error(error=error))
+
+    return DocumentChunks(index=index, chunks=chunks)
+
+
+def chunk_batch(
+    batch: list[tuple[int, HtmlSourceT]],
+    options: ChunkingOptions
+        ) -> list[DocumentChunks]:
+    # Unit of work of a worker process.
+    return [
+        chunk_document(index=index, website_code=website_code,
+                       options=options)
+        for index, website_code in batch
+    ]
+
+
+# Documents already chunked, e.g. found in a result cache, come out of
+# iter_batches as they are.
+BatchOrResult = list[tuple[int, HtmlSourceT]] | DocumentChunks
+
+
+def iter_batches(
+    documents: Iterable[HtmlSourceT],
+    chunksize: int,
+    lookup: Optional[Callable[[int, Any], Optional[DocumentChunks]]] = None
+        ) -> Iterator[BatchOrResult]:
+    batch: list[tuple[int, HtmlSourceT]] = []
+    for index, website_code in enumerate(documents):
+        if lookup is not None:
+            result: Optional[DocumentChunks] = lookup(index, website_code)
+            if result is not None:
+                yield result
+                continue
+        batch.append((index, website_code))
+        if len(batch) >= chunksize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+@attrs.define()
+class PendingBatch:
+    # Documents are only checked by the worker, where a bad one fails
+    # alone.
+    batch: list[tuple[int, Any]] = attrs.field(
+        validator=type_validator()
+    )
+    # Documents lost with a crashed worker process are run again one at
+    # a time, with nothing else in flight, so that only the document
+    # that crashes the pool again is reported.
+    is_retry: bool = attrs.field(
+        validator=type_validator(),
+        default=False
+    )
+
+
+def split_for_retry(pending_batch: PendingBatch) -> list[PendingBatch]:
+    return [
+        PendingBatch(batch=[document], is_retry=True)
+        for document in pending_batch.batch
+    ]
+
+
+# Documents looked up in a result cache, by their content.
+CACHED_SOURCE_TYPES: tuple[type, ...] = (
+    str, bytes, bytearray, memoryview, os.PathLike,
+)
+
+
+@attrs.define()
+class ResultCacheLookup:
+    options: ChunkingOptions = attrs.field(
+        validator=type_validator()
+    )
+    result_cache: ResultCache = attrs.field(
+        validator=type_validator()
+    )
+    # Keys of the documents that missed, until their result comes back.
+    keys: dict[int, str] = attrs.field(
+        validator=type_validator(),
+        init=False,
+        factory=dict
+    )
+
+    def lookup(
+        self,
+        index: int,
+        website_code: Any
+            ) -> Optional[DocumentChunks]:
+        if not isinstance(website_code, CACHED_SOURCE_TYPES):
+            # Files are read by the workers, and anything else is left
+            # to fail in chunk_document.
+            return None
+        try:
+            # Paths are hashed through their memory map.
+            with open_html_source(source=website_code) as document:
+                key: str = self.options.make_cache_key(
+                    website_code=document
+                )
+        except OSError:
+            # Reported by the worker.
+            return None
+        records: Optional[list[dict]] = self.result_cache.get(key=key)
+        if records is None:
+            self.keys[index] = key
+            return None
+        return DocumentChunks(
+            index=index,
+            chunks=[ChunkRecord(**record) for record in records]
+        )
+
+    def store(self, result: DocumentChunks) -> None:
+        key: Optional[str] = self.keys.pop(result.index, None)
+        if key is not None and result.ok:
+            self.result_cache.put(
+                key=key,
+                value=[attrs.asdict(chunk) for chunk in result.chunks]
+            )
+
+    def iter_stored(
+        self,
+        results: Iterator[DocumentChunks]
+            ) -> Iterator[DocumentChunks]:
+        for result in results:
+            self.store(result=result)
+            yield result
+
+
+def iter_local_results(
+    batches: Iterator[BatchOrResult],
+    options: ChunkingOptions
+        ) -> Iterator[DocumentChunks]:
+    for batch in batches:
+        if isinstance(batch, DocumentChunks):
+            yield batch
+        else:
+            yield from chunk_batch(batch=batch, options=options)
+
+
+def get_first_index(batch: BatchOrResult) -> int:
+    if isinstance(batch, DocumentChunks):
+        return batch.index
+    return batch[0][0]
+
+
+def iter_pool_results(
+    batches: Iterator[BatchOrResult],
+    options: ChunkingOptions,
+    workers: int,
+    max_ahead: Optional[int] = None
+        ) -> Iterator[DocumentChunks]:
+    # Yields in completion order. At most 2 batches per worker are in
+    # flight, so the input is read lazily and memory stays bounded.
+    # With max_ahead, nothing is taken from batches max_ahead documents
+    # past the oldest one in flight: results waiting behind a slow
+    # document in iter_in_input_order stay bounded as well.
+    max_in_flight: int = 2 * workers
+    retries: deque[PendingBatch] = deque()
+    pending: dict[Future, PendingBatch] = {}
+    held: Optional[BatchOrResult] = None
+    executor = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(pending_batch: PendingBatch) -> None:
+        future: Future = executor.submit(
+            chunk_batch, pending_batch.batch, options
+        )
+        pending[future] = pending_batch
+
+    try:
+        while True:
+            if retries:
+                if not pending:
+                    submit(pending_batch=retries.popleft())
+            else:
+                while len(pending) < max_in_flight:
+                    batch: Optional[BatchOrResult] = held\
+                        if held is not None else next(batches, None)
+                    held = None
+                    if batch is None:
+                        break
+                    if max_ahead is not None and pending and\
+                            get_first_index(batch=batch) - min(
+                                get_first_index(batch=pending_batch.batch)
+                                for pending_batch in pending.values()
+                            ) >= max_ahead:
+                        held = batch
+                        break
+                    if isinstance(batch, DocumentChunks):
+                        yield batch
+                        continue
+                    submit(pending_batch=PendingBatch(batch=batch))
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            pool_broken: bool = False
+            for future in done:
+                pending_batch: PendingBatch = pending.pop(future)
+                try:
+                    yield from future.result()
+                except BrokenProcessPool as error:
+                    pool_broken = True
+                    if pending_batch.is_retry:
+                        for index, _ in pending_batch.batch:
+                            yield DocumentChunks(
+                                index=index, error=format_error(error=error)
+                            )
+                    else:
+                        retries.extend(split_for_retry(pending_batch))
+                except Exception as error:
+                    for index, _ in pending_batch.batch:
+                        yield DocumentChunks(
+                            index=index, error=format_error(error=error)
+                        )
+
+            if pool_broken:
+                # The other futures of the dead pool fail as well.
+                for pending_batch in pending.values():
+                    retries.extend(split_for_retry(pending_batch))
+                pending = {}
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = ProcessPoolExecutor(max_workers=workers)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+# Ordered results run at most this many batches per worker ahead of the
+# oldest unfinished document, however slow it is.
+ORDERED_BATCHES_AHEAD: int = 8
+
+
+def iter_in_input_order(
+    results: Iterator[DocumentChunks]
+        ) -> Iterator[DocumentChunks]:
+    ready: dict[int, DocumentChunks] = {}
+    next_index: int = 0
+    for result in results:
+        ready[result.index] = result
+        while next_index in ready:
+            yield ready.pop(next_index)
+            next_index += 1
+
+
+def chunk_many(
+    documents: Iterable[HtmlSourceT],
+    max_length: int,
+    compared_by: ReprLengthComparisionBy =\
+        ReprLengthComparisionBy.HTML_LENGTH,
+    workers: Optional[int] = None,
+    chunksize: int = 1,
+    ordered: bool = True,
+    kinds: Iterable[ChunkKind] = (ChunkKind.HTML, ChunkKind.TEXT),
+    tag_list_to_filter_out: Optional[list[str]] = None,
+    html_unescape: bool = True,
+    metrics_mode: MetricsMode = MetricsMode.BOTTOM_UP,
+    backend: ParserBackend = ParserBackend.BS4,
+    html_serialization: HtmlSerialization = HtmlSerialization.PRETTIFIED,
+    tokenizer: Optional[TokenizerT] = None,
+    tokenizer_id: Optional[str] = None,
+    result_cache: Optional[ResultCache] = None,
+    layout_cache: bool = False
+        ) -> Iterator[DocumentChunks]:
+    """Chunk many HTML documents on a process pool.
+
+    Parameters
+    ----------
+    documents:
+        HTML strings or bytes, or ``pathlib.Path`` of files, which are
+        then read by the workers. Consumed lazily. Files (objects with
+        ``read``) are not looked up in ``result_cache``.
+    max_length, compared_by:
+        ``MAX_NODE_REPR_LENGTH`` and ``repr_length_compared_by`` of
+        ``DomRepresentation``.
+    workers:
+        Worker processes, ``os.cpu_count()`` by default. With 1 the
+        documents are chunked in the calling process.
+    chunksize:
+        Documents sent to a worker at a time.
+    ordered:
+        Yield results in input order. Otherwise they are yielded as
+        they complete; use ``DocumentChunks.index`` to match them.
+    kinds:
+        Renders of every chunk to send back ("html", "text").
+    html_serialization:
+        "prettified" (bs4's prettify()) or "compact", for both the
+        HTML_LENGTH comparison and the html renders.
+    tokenizer:
+        For ``ReprLengthComparisionBy.TOKEN_LENGTH``. Must be picklable
+        (e.g. a module level function) when workers > 1; each worker
+        keeps its own token count cache.
+    tokenizer_id:
+        Stable name of ``tokenizer`` (e.g. "tiktoken:cl100k_base"), part
+        of the ``result_cache`` keys.
+    result_cache:
+        A ``MemoryResultCache`` or ``SQLiteResultCache``. Documents are
+        looked up before they are sent to a worker: a hit is not even
+        parsed. Results are stored as they come back. Not used with
+        ``layout_cache``, nor with ``TOKEN_LENGTH`` unless
+        ``tokenizer_id`` is given.
+    layout_cache:
+        Reuse the regions of pages with the same structure (see
+        ``layout_cache.py``), for batches of pages from the same sites.
+        Each worker keeps its own cache.
+
+    Returns an iterator of one ``DocumentChunks`` per document; the
+    arguments are checked at once, the documents as it is consumed. A
+    document that fails has ``error`` set and no chunks; the rest of
+    the batch goes on.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError(f"workers must be at least 1, got {workers}")
+    if chunksize < 1:
+        raise ValueError(f"chunksize must be at least 1, got {chunksize}")
+
+    options = ChunkingOptions(
+        max_length=max_length,
+        compared_by=compared_by,
+        kinds=kinds,
+        tag_list_to_filter_out=tag_list_to_filter_out,
+        html_unescape=html_unescape,
+        metrics_mode=metrics_mode,
+        backend=backend,
+        html_serialization=html_serialization,
+        tokenizer=tokenizer,
+        tokenizer_id=tokenizer_id,
+        layout_cache=layout_cache
+    )
+    cache_lookup: Optional[ResultCacheLookup] = None
+    if result_cache is not None and options.cacheable:
+        cache_lookup = ResultCacheLookup(
+            options=options, result_cache=result_cache
+        )
+    batches: Iterator[BatchOrResult] = iter_batches(
+        documents=documents,
+        chunksize=chunksize,
+        lookup=None if cache_lookup is None else cache_lookup.lookup
+    )
+
+    if workers == 1:
+        results: Iterator[DocumentChunks] = iter_local_results(
+            batches=batches,
+            options=options
+        )
+    else:
+        results = iter_pool_results(
+            batches=batches,
+            options=options,
+            workers=workers,
+            max_ahead=ORDERED_BATCHES_AHEAD * workers * chunksize
+            if ordered else None
+        )
+    if cache_lookup is not None:
+        results = cache_lookup.iter_stored(results=results)
+    if ordered and workers > 1:
+        results = iter_in_input_order(results=results)
+    return results
@@ -1,14 +1,201 @@
 #!/usr/bin/env python3
 
+import glob
+import json
 import sys
 
+from pathlib import Path
+
+from typing import Any
+from typing import Iterator
+from typing import Optional
+from typing import TYPE_CHECKING
+
 import typer
-from .main import DomRepresentation, ReprLengthComparisionBy
+
+# The chunker is imported by the mode that runs: --help and argument
+# errors do not pay for it, one document does not load the batch pool.
+if TYPE_CHECKING:
+    from .main import ReprLengthComparisionBy
+    from .node_metrics import HtmlSerialization
+    from .batch import ChunkRecord, DocumentChunks
 
 app = typer.Typer(help="Chunk HTML documents from the command line")
 
-@app.command()
+HTML_SUFFIXES: frozenset[str] = frozenset({".html", ".htm"})
+EMIT_CHOICES: dict[str, tuple[str, ...]] = {
+    "html": ("html",),
+    "text": ("text",),
+    "both": ("html", "text"),
+}
+
+
+def iter_input_paths(inputs: list[str]) -> Iterator[Path]:
+    # A directory stands for the HTML files under it, anything else is
+    # a glob pattern (a plain path matches itself).
+    for pattern in inputs:
+        path = Path(pattern)
+        if path.is_dir():
+            yield from sorted(
+                child for child in path.rglob("*")
+                if child.is_file() and child.suffix.lower() in HTML_SUFFIXES
+            )
+            continue
+        for match in sorted(glob.iglob(pattern, recursive=True)):
+            if Path(match).is_file():
+                yield Path(match)
+
+
+def iter_path_documents(
+    inputs: list[str],
+    ids: dict[int, Any]
+        ) -> Iterator[Path]:
+    # Read by the workers, which detect the encoding of each file.
+    for index, path in enumerate(iter_input_paths(inputs=inputs)):
+        ids[index] = str(path)
+        yield path
+
+
+def get_jsonl_record_error(record: Any) -> Optional[str]:
+    if not isinstance(record, dict):
+        return f"not a JSON object: {type(record).__name__}"
+    if "html" not in record:
+        return 'no "html" key'
+    return None
+
+
+def iter_jsonl_documents(
+    lines: Iterator[str],
+    ids: dict[int, Any],
+    errors: dict[int, str]
+        ) -> Iterator[str]:
+    # One {"id": ..., "html": ...} record per line. A line that is not a
+    # record is passed on as None, so that it fails alone, and why is
+    # left in errors.
+    index: int = 0
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        ids[index] = index
+        website_code = None
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            errors[index] = f"line {line_number}: invalid JSON: {error}"
+        else:
+            if isinstance(record, dict):
+                ids[index] = record.get("id", index)
+            error_message: Optional[str] = get_jsonl_record_error(
+                record=record
+            )
+            if error_message is None:
+                website_code = record["html"]
+            else:
+                errors[index] = f"line {line_number}: {error_message}"
+        index += 1
+        yield website_code
+
+
+def make_output_record(chunk: "ChunkRecord", document_id) -> dict:
+    return {"id": document_id, **chunk.as_dict()}
+
+
+def iter_output_records(
+    result: "DocumentChunks",
+    document_id
+        ) -> Iterator[dict]:
+    if not result.ok:
+        yield {"id": document_id, "error": result.error}
+        return
+    for chunk in result.chunks:
+        yield make_output_record(chunk=chunk, document_id=document_id)
+
+
+def run_batch(
+    inputs: list[str],
+    jsonl: bool,
+    max_length: int,
+    compare: "ReprLengthComparisionBy",
+    html_serialization: "HtmlSerialization",
+    workers: Optional[int],
+    chunksize: int,
+    emit: str,
+    ordered: bool,
+    cache: Optional[Path] = None,
+    cache_size: int = 1024,
+    layout_cache: bool = False
+        ) -> None:
+    from .batch import DocumentChunks
+    from .batch import chunk_many
+    from .result_cache import SQLiteResultCache
+
+    ids: dict[int, Any] = {}
+    errors: dict[int, str] = {}
+    result_cache: Optional[SQLiteResultCache] = None
+    if cache is not None:
+        result_cache = SQLiteResultCache(
+            path=cache, max_bytes=cache_size * 1024 ** 2
+        )
+    if jsonl:
+        documents = iter_jsonl_documents(
+            lines=sys.stdin, ids=ids, errors=errors
+        )
+    else:
+        documents = iter_path_documents(inputs=inputs, ids=ids)
+
+    for result in chunk_many(
+            documents,
+            max_length=max_length,
+            compared_by=compare,
+            workers=workers,
+            chunksize=chunksize,
+            ordered=ordered,
+            kinds=EMIT_CHOICES[emit],
+            result_cache=result_cache,
+            layout_cache=layout_cache,
+            html_serialization=html_serialization):
+        if result.index in errors:
+            result = DocumentChunks(
+                index=result.index, error=errors.pop(result.index)
+            )
+        for record in iter_output_records(
+                result=result, document_id=ids.pop(result.index)):
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # Each document is out as soon as it is done.
+        sys.stdout.flush()
+
+    if result_cache is not None:
+        typer.echo(
+            f"cache: {result_cache.hits} hits, {result_cache.misses} misses",
+            err=True
+        )
+        result_cache.close()
+
+
+def run_stream(
+    max_length: int,
+    compare: "ReprLengthComparisionBy",
+    html_serialization: "HtmlSerialization",
+    emit: str
+        ) -> None:
+    from .batch import ChunkingOptions
+    from .streaming import iter_stream_chunks
+
+    options = ChunkingOptions(
+        max_length=max_length,
+        compared_by=compare,
+        kinds=EMIT_CHOICES[emit],
+        html_serialization=html_serialization
+    )
+    for chunk in iter_stream_chunks(source=sys.stdin.buffer, options=options):
+        record: dict = make_output_record(chunk=chunk, document_id="-")
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+
+@app.callback(invoke_without_command=True)
 def chunk(
+    ctx: typer.Context,
     max_length: int = typer.Option(
         32768,
         "--max-length",
@@ -25,19 +212,206 @@ def chunk(
         False,
         "--text",
         help="Compare length using text instead of HTML",
+    ),
+    compact: bool = typer.Option(
+        False,
+        "--compact",
+        help="Serialize HTML as parsed instead of pretty printed, both "
+        "to measure and to output it (smaller chunks)",
+    ),
+    inputs: Optional[list[str]] = typer.Option(
+        None,
+        "--input",
+        "-i",
+        help="Batch mode: directory (its .html/.htm files) or glob. "
+        "Can be repeated.",
+    ),
+    jsonl: bool = typer.Option(
+        False,
+        "--jsonl",
+        help='Batch mode: read {"id", "html"} JSONL records from stdin',
+    ),
+    workers: Optional[int] = typer.Option(
+        None,
+        "--workers",
+        "-w",
+        help="Batch mode: worker processes (default: CPU count)",
+    ),
+    chunksize: int = typer.Option(
+        1,
+        "--chunksize",
+        help="Batch mode: documents sent to a worker at a time",
+    ),
+    emit: str = typer.Option(
+        "html",
+        "--emit",
+        help="Batch mode: render to output, html, text or both",
+    ),
+    ordered: bool = typer.Option(
+        False,
+        "--ordered",
+        help="Batch mode: output documents in input order instead of "
+        "as they complete",
+    ),
+    cache: Optional[Path] = typer.Option(
+        None,
+        "--cache",
+        help="Batch mode: SQLite file caching results by HTML content, "
+        "so repeated documents are not chunked again",
+    ),
+    cache_size: int = typer.Option(
+        1024,
+        "--cache-size",
+        help="Batch mode: cache size limit in MB",
+    ),
+    layout_cache: bool = typer.Option(
+        False,
+        "--layout-cache",
+        help="Batch mode: reuse the regions of pages with the same "
+        "structure (pages of the same site template)",
+    ),
+    stream: bool = typer.Option(
+        False,
+        "--stream",
+        help="Chunk a document too large to load from stdin as it is "
+        "read, writing JSONL records (id -) as chunks complete",
     )
         ):
-    """Read HTML from stdin and output the selected chunk as HTML."""
-    html_input = sys.stdin.read()
+    """Read HTML from stdin and output the selected chunk as HTML.
+
+    With --input or --jsonl, chunk many documents instead and write one
+    JSONL record per chunk (id, roi_idx, xpaths, html/text, length).
+    --stream writes the same records for stdin, in bounded memory.
+    """
+    if ctx.invoked_subcommand is not None:
+        return
+    if (inputs or jsonl or stream) and emit not in EMIT_CHOICES:
+        raise typer.BadParameter(
+            f"must be one of {', '.join(EMIT_CHOICES)}",
+            param_hint="--emit"
+        )
+
+    from .main import DomRepresentation, ReprLengthComparisionBy
+    from .node_metrics import HtmlSerialization
+    from .render_system import RenderMode
+
     compare = ReprLengthComparisionBy.TEXT_LENGTH if by_text else ReprLengthComparisionBy.HTML_LENGTH
+    html_serialization = HtmlSerialization.COMPACT if compact else\
+        HtmlSerialization.PRETTIFIED
+
+    if stream:
+        run_stream(
+            max_length=max_length,
+            compare=compare,
+            html_serialization=html_serialization,
+            emit=emit
+        )
+        return
+
+    if inputs or jsonl:
+        run_batch(
+            inputs=inputs or [],
+            jsonl=jsonl,
+            max_length=max_length,
+            compare=compare,
+            html_serialization=html_serialization,
+            workers=workers,
+            chunksize=chunksize,
+            emit=emit,
+            ordered=ordered,
+            cache=cache,
+            cache_size=cache_size,
+            layout_cache=layout_cache
+        )
+        return
+
+    html_input = sys.stdin.read()
     dom = DomRepresentation(
         MAX_NODE_REPR_LENGTH=max_length,
         website_code=html_input,
         repr_length_compared_by=compare,
+        html_serialization=html_serialization,
+        render_mode=RenderMode.LAZY,
     )
     dom.start(verbose=False)
     chunk_html = dom.render_system.html_render_roi.get(chunk_index, "")
     typer.echo(chunk_html)
 
+
+@app.command()
+def serve(
+    port: int = typer.Option(
+        8765,
+        "--port",
+        "-p",
+        help="Port to listen on, on 127.0.0.1 only (0: any free port)",
+    ),
+    socket_path: Optional[Path] = typer.Option(
+        None,
+        "--socket",
+        help="Listen on this Unix socket instead of a TCP port",
+    ),
+    workers: Optional[int] = typer.Option(
+        None,
+        "--workers",
+        "-w",
+        help="Worker processes (default: CPU count)",
+    ),
+    queue_size: int = typer.Option(
+        64,
+        "--queue-size",
+        help="Requests that can wait for a worker, more are rejected "
+        "with 503",
+    ),
+    timeout: float = typer.Option(
+        30.0,
+        "--timeout",
+        help="Seconds a request can take, unless it sets its own",
+    ),
+    max_length: int = typer.Option(
+        32768,
+        "--max-length",
+        "-l",
+        help="Default maximum length for a region of interest",
+    ),
+    by_text: bool = typer.Option(
+        False,
+        "--text",
+        help="Compare length using text instead of HTML by default",
+    ),
+    compact: bool = typer.Option(
+        False,
+        "--compact",
+        help="Serialize HTML as parsed instead of pretty printed by "
+        "default",
+    )
+        ):
+    """Serve chunking over local HTTP with a pool of warm workers.
+
+    POST {"html", "options"} to /chunk, GET /stats and /health.
+    """
+    import os
+
+    from .batch import ChunkingOptions
+    from .main import ReprLengthComparisionBy
+    from .node_metrics import HtmlSerialization
+    from .server import ChunkingService
+    from .server import serve as run_server
+
+    service = ChunkingService(
+        workers=workers or os.cpu_count() or 1,
+        queue_size=queue_size,
+        timeout=timeout,
+        default_options=ChunkingOptions(
+            max_length=max_length,
+            compared_by=ReprLengthComparisionBy.TEXT_LENGTH if by_text
+            else ReprLengthComparisionBy.HTML_LENGTH,
+            html_serialization=HtmlSerialization.COMPACT if compact
+            else HtmlSerialization.PRETTIFIED
+        )
+    )
+    run_server(service=service, port=port, socket_path=socket_path)
+
+
 if __name__ == "__main__":
     app()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import array
+
+import attrs
+
+from attrs_strict import type_validator
+
+from typing import Any
+from typing import Iterator
+from typing import Optional
+
+
+################################
+#                              #
+#   --- Compact DOM tree ---   #
+#                              #
+################################
+
+# Nodes are numbered 0..n-1 in document order. The structure lives in
+# parent / first child / next sibling arrays and the metrics in parallel
+# columns, so walking the tree needs neither string lookups nor an
+# object per node.
+
+NO_NODE: int = -1
+
+
+def make_id_array(length: int) -> array.array:
+    return array.array("q", [NO_NODE]) * length
+
+
+@attrs.define()
+class CompactTree:
+    # Aligned with the node ids. Only the container type of the columns
+    # is checked: validating every item costs as much as building them.
+    pos_xpaths: list[str] = attrs.field(
+        validator=attrs.validators.instance_of(list)
+    )
+    elements: list[Any] = attrs.field(
+        validator=attrs.validators.instance_of(list)
+    )
+    parents: array.array = attrs.field(
+        validator=type_validator()
+    )
+    text_lengths: array.array = attrs.field(
+        validator=type_validator()
+    )
+    html_lengths: array.array = attrs.field(
+        validator=type_validator()
+    )
+    # Only with a tokenizer (ReprLengthComparisionBy.TOKEN_LENGTH).
+    token_lengths: Optional[array.array] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+    # Only with record_source_spans, see source_spans.py.
+    source_starts: Optional[array.array] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+    source_ends: Optional[array.array] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+    # Span of each node in the document text, see node_metrics.py.
+    text_starts: Optional[array.array] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+    text_ends: Optional[array.array] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+    first_child: array.array = attrs.field(
+        validator=type_validator(),
+        init=False
+    )
+    next_sibling: array.array = attrs.field(
+        validator=type_validator(),
+        init=False
+    )
+    # Top-level nodes, the children of the implicit root:
+    roots: list[int] = attrs.field(
+        validator=type_validator(),
+        init=False
+    )
+    node_ids: dict[str, int] = attrs.field(
+        validator=attrs.validators.instance_of(dict),
+        init=False
+    )
+
+    def __attrs_post_init__(self):
+        length: int = len(self.pos_xpaths)
+        first_child: array.array = make_id_array(length=length)
+        next_sibling: array.array = make_id_array(length=length)
+        roots: list[int] = []
+
+        # Parents come before their children in document order, so the
+        # last child seen of every node is enough to chain siblings.
+        last_child: array.array = make_id_array(length=length)
+        last_root: int = NO_NODE
+        for node_id, parent_id in enumerate(self.parents):
+            if parent_id == NO_NODE:
+                if last_root != NO_NODE:
+                    next_sibling[last_root] = node_id
+                roots.append(node_id)
+                last_root = node_id
+                continue
+            previous_id: int = last_child[parent_id]
+            if previous_id == NO_NODE:
+                first_child[parent_id] = node_id
+            else:
+                next_sibling[previous_id] = node_id
+            last_child[parent_id] = node_id
+
+        self.first_child = first_child
+        self.next_sibling = next_sibling
+        self.roots = roots
+        self.node_ids = {
+            pos_xpath: node_id
+            for node_id, pos_xpath in enumerate(self.pos_xpaths)
+        }
+
+    def __len__(self) -> int:
+        return len(self.pos_xpaths)
+
+    def iter_children(self, node_id: int) -> Iterator[int]:
+        child_id: int = self.first_child[node_id]
+        while child_id != NO_NODE:
+            yield child_id
+            child_id = self.next_sibling[child_id]
+
+    def get_children(self, node_id: int) -> list[int]:
+        return list(self.iter_children(node_id=node_id))
+
+    def get_node_id(self, pos_xpath: str) -> int:
+        return self.node_ids[pos_xpath]
+
+    def get_subtree_end(self, node_id: int) -> int:
+        # A subtree is the range of ids from its root to the next node
+        # that is not a descendant.
+        while node_id != NO_NODE:
+            sibling_id: int = self.next_sibling[node_id]
+            if sibling_id != NO_NODE:
+                return sibling_id
+            node_id = self.parents[node_id]
+        return len(self)
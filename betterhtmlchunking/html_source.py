@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+import codecs
+
+import contextlib
+
+import html
+
+import mmap
+
+import os
+
+import re
+
+from typing import Any
+from typing import IO
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Union
+
+
+############################
+#                          #
+#   --- HTML sources ---   #
+#                          #
+############################
+
+# Documents can be given as text, bytes, a path (mapped in memory) or a
+# file. Parsers are fed block by block: bytes are decoded, and entities
+# unescaped (html_unescape), one block at a time, so that no full-size
+# copy of the document is made before parsing.
+
+HtmlSourceT = Union[str, bytes, bytearray, memoryview, os.PathLike, IO]
+
+BLOCK_SIZE: int = 1024 ** 2
+# Bytes looked at for a byte order mark or a declared charset.
+ENCODING_SNIFF_SIZE: int = 64 * 1024
+
+# Tail of a block that html.unescape could read as part of an entity
+# continuing in the next block.
+UNFINISHED_ENTITY_PATTERN: re.Pattern = re.compile(r"&[^\t\n\f <&;]*\Z")
+
+
+def validate_html_source(instance: Any, attribute: Any, value: Any) -> None:
+    # attrs validator, typing.IO can not be checked with isinstance.
+    if isinstance(value, (str, bytes, bytearray, memoryview, os.PathLike))\
+            or hasattr(value, "read"):
+        return None
+    raise TypeError(
+        f"{attribute.name} must be HTML (str or bytes), a path or a file, "
+        f"not {type(value).__name__}"
+    )
+
+
+@contextlib.contextmanager
+def open_html_source(source: HtmlSourceT) -> Iterator[Any]:
+    """The document, mapped in memory when source is a path.
+
+    A str is always HTML, never a path: pass a pathlib.Path. Files
+    are read whole, text or bytes.
+    """
+    if hasattr(source, "read"):
+        yield source.read()
+        return
+    if not isinstance(source, os.PathLike):
+        yield source
+        return
+    with open(source, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            # Empty files can not be mapped.
+            yield b""
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
+
+
+def detect_encoding(head: bytes) -> tuple[str, int]:
+    """Encoding of a document and the length of its byte order mark.
+
+    Same order as bs4: byte order mark, declared charset, then UTF-8.
+    """
+    from bs4.dammit import EncodingDetector
+
+    stripped, sniffed_encoding = EncodingDetector.strip_byte_order_mark(
+        head
+    )
+    if sniffed_encoding is not None:
+        return sniffed_encoding, len(head) - len(stripped)
+    for encoding in EncodingDetector(head, is_html=True).encodings:
+        try:
+            return codecs.lookup(encoding).name, 0
+        except LookupError:
+            continue
+    return "utf-8", 0
+
+
+def iter_source_blocks(
+    document: Any,
+    block_size: int = BLOCK_SIZE
+        ) -> Iterator[Any]:
+    # Raw blocks: str or bytes, as the document holds them.
+    for start in range(0, len(document), block_size):
+        yield document[start:start + block_size]
+
+
+def iter_file_blocks(
+    file: IO,
+    block_size: int = BLOCK_SIZE
+        ) -> Iterator[Any]:
+    # Raw blocks of a file open in text or binary mode, as they are read.
+    while True:
+        block = file.read(block_size)
+        if not block:
+            return
+        yield block
+
+
+def iter_decoded_blocks(
+    blocks: Iterable[Any],
+    encoding: Optional[str] = None
+        ) -> Iterator[str]:
+    """Text of str or bytes blocks.
+
+    Bytes are decoded with encoding, or the one detected in the first
+    block when it is None.
+    """
+    decoder = None
+    for block in blocks:
+        if isinstance(block, str):
+            yield block
+            continue
+        block = bytes(block)
+        if decoder is None:
+            bom_length: int = 0
+            if encoding is None:
+                encoding, bom_length = detect_encoding(
+                    head=block[:ENCODING_SNIFF_SIZE]
+                )
+            decoder = codecs.getincrementaldecoder(encoding)(
+                errors="replace"
+            )
+            block = block[bom_length:]
+        yield decoder.decode(block)
+    if decoder is not None:
+        tail: str = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+
+def iter_unescaped_blocks(blocks: Iterable[str]) -> Iterator[str]:
+    """html.unescape block by block, as on the whole text.
+
+    An "&" that may start an entity ending in the next block is kept
+    for it.
+    """
+    carry: str = ""
+    for block in blocks:
+        block = carry + block
+        unfinished = UNFINISHED_ENTITY_PATTERN.search(block)
+        if unfinished is None:
+            carry = ""
+        else:
+            carry = block[unfinished.start():]
+            block = block[:unfinished.start()]
+        yield html.unescape(block)
+    if carry:
+        yield html.unescape(carry)
+
+
+def iter_html_blocks(
+    document: Any,
+    html_unescape: bool,
+    block_size: int = BLOCK_SIZE
+        ) -> Iterator[str]:
+    """Text of an opened document, to feed a parser with."""
+    if isinstance(document, str) and not html_unescape:
+        yield document
+        return
+    blocks: Iterator[str] = iter_decoded_blocks(
+        blocks=iter_source_blocks(document=document, block_size=block_size)
+    )
+    if html_unescape:
+        blocks = iter_unescaped_blocks(blocks=blocks)
+    yield from blocks
+
+
+def get_soup_markup(document: Any, html_unescape: bool) -> Any:
+    # bs4 reads the whole markup at once. Bytes are left for it to
+    # decode, unless entities have to be unescaped first.
+    if not html_unescape:
+        if isinstance(document, (bytearray, memoryview)):
+            return bytes(document)
+        return document
+    return "".join(
+        iter_html_blocks(document=document, html_unescape=html_unescape)
+    )
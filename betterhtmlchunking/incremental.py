@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+
+import attrs
+
+from attrs_strict import type_validator
+
+import hashlib
+
+import json
+
+from collections import deque
+
+from betterhtmlchunking.main import DomRepresentation
+
+from betterhtmlchunking.tree_representation import DOMTreeRepresentation
+
+from betterhtmlchunking.tree_regions_system import RegionOfInterest
+from betterhtmlchunking.tree_regions_system import RegionPlanner
+
+from betterhtmlchunking.render_system import ChunkKind
+from betterhtmlchunking.render_system import RenderMode
+from betterhtmlchunking.render_system import render_pos_xpath_list
+
+from betterhtmlchunking.compact_tree import CompactTree
+
+from betterhtmlchunking.batch import ChunkingOptions
+
+from betterhtmlchunking.node_metrics import format_bs4_tags
+
+from betterhtmlchunking.lxml_backend import ParserBackend
+from betterhtmlchunking.lxml_backend import is_lxml_tag
+from betterhtmlchunking.lxml_backend import format_lxml_open_tag
+from betterhtmlchunking.lxml_backend import format_lxml_close_tag
+from betterhtmlchunking.lxml_backend import format_lxml_text
+from betterhtmlchunking.lxml_backend import format_lxml_special_node
+
+from betterhtmlchunking.stats import ROI_STAGE
+from betterhtmlchunking.stats import RENDER_STAGE
+from betterhtmlchunking.stats import ROIS_COUNTER
+from betterhtmlchunking.stats import RENDERED_CHUNKS_COUNTER
+from betterhtmlchunking.stats import REUSED_SUBTREES_COUNTER
+from betterhtmlchunking.stats import REUSED_RENDERS_COUNTER
+
+from typing import Any
+from typing import Optional
+
+
+#######################################
+#                                     #
+#   --- Incremental re-chunking ---   #
+#                                     #
+#######################################
+
+# A re-crawled page usually differs from the previous crawl in a few
+# subtrees. Every node gets a hash of its subtree content; the regions
+# of a node and its renders only depend on that content (and on the
+# options), so:
+#   * the regions found under a node the chunker went down into are
+#     kept per subtree hash, relative to the node, and reused wherever
+#     the same subtree shows up again;
+#   * renders are kept per chunk fingerprint (the hashes of its nodes).
+# Chunks are then matched against the previous ones to report which are
+# new, changed or removed. Parsing, measuring and hashing still run over
+# the whole document: only the region and render stages are incremental.
+
+HASH_DIGEST_SIZE: int = 16
+
+
+def make_hasher() -> Any:
+    return hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+
+
+def update_hash(hasher: Any, piece: str) -> None:
+    # Length prefixed: "a" + "b" must not hash as "ab", the two strings
+    # are measured and rendered apart.
+    data: bytes = piece.encode("utf-8", errors="surrogatepass")
+    hasher.update(len(data).to_bytes(8, "little"))
+    hasher.update(data)
+
+
+def compute_bs4_subtree_hashes(compact_tree: CompactTree) -> list[str]:
+    import bs4
+
+    formatter = bs4.BeautifulSoup().formatter_for_name("minimal")
+    hashes: list[str] = [""] * len(compact_tree)
+    node_ids: dict[int, int] = {
+        id(elem): node_id
+        for node_id, elem in enumerate(compact_tree.elements)
+    }
+    # Children have larger ids than their parents.
+    for node_id in range(len(compact_tree) - 1, -1, -1):
+        elem: bs4.Tag = compact_tree.elements[node_id]
+        hasher = make_hasher()
+        open_tag, close_tag = format_bs4_tags(elem=elem, formatter=formatter)
+        update_hash(hasher, open_tag)
+        for child in elem.contents:
+            if isinstance(child, bs4.Tag):
+                update_hash(hasher, "\0" + hashes[node_ids[id(child)]])
+            else:
+                update_hash(hasher, child.output_ready(formatter))
+        if close_tag:
+            update_hash(hasher, close_tag)
+        hashes[node_id] = hasher.hexdigest()
+    return hashes
+
+
+def compute_lxml_subtree_hashes(
+    compact_tree: CompactTree,
+    skipped: set[Any]
+        ) -> list[str]:
+    hashes: list[str] = [""] * len(compact_tree)
+    node_ids: dict[int, int] = {
+        id(elem): node_id
+        for node_id, elem in enumerate(compact_tree.elements)
+    }
+    for node_id in range(len(compact_tree) - 1, -1, -1):
+        elem = compact_tree.elements[node_id]
+        hasher = make_hasher()
+        update_hash(hasher, format_lxml_open_tag(elem=elem))
+        if elem.text:
+            update_hash(
+                hasher, format_lxml_text(text=elem.text, parent_tag=elem.tag)
+            )
+        for child in elem:
+            if child in skipped:
+                pass
+            elif is_lxml_tag(node=child):
+                update_hash(hasher, "\0" + hashes[node_ids[id(child)]])
+            else:
+                update_hash(hasher, format_lxml_special_node(node=child))
+            if child.tail:
+                update_hash(
+                    hasher,
+                    format_lxml_text(text=child.tail, parent_tag=elem.tag)
+                )
+        update_hash(hasher, format_lxml_close_tag(elem=elem))
+        hashes[node_id] = hasher.hexdigest()
+    return hashes
+
+
+def compute_subtree_hashes(
+    tree_representation: DOMTreeRepresentation
+        ) -> list[str]:
+    """Content hash of the subtree of every node, aligned with node ids."""
+    match tree_representation.backend:
+        case ParserBackend.BS4:
+            return compute_bs4_subtree_hashes(
+                compact_tree=tree_representation.compact_tree
+            )
+        case ParserBackend.LXML:
+            return compute_lxml_subtree_hashes(
+                compact_tree=tree_representation.compact_tree,
+                skipped=tree_representation.lxml_removed
+            )
+
+
+def get_chunk_fingerprint(
+    compact_tree: CompactTree,
+    subtree_hashes: list[str],
+    pos_xpaths: list[str]
+        ) -> str:
+    hasher = make_hasher()
+    for pos_xpath in pos_xpaths:
+        update_hash(
+            hasher,
+            subtree_hashes[compact_tree.get_node_id(pos_xpath=pos_xpath)]
+        )
+    return hasher.hexdigest()
+
+
+def get_options_key(options: ChunkingOptions) -> str:
+    # What the regions and renders of a subtree depend on, besides its
+    # content. Nothing is reused from a run with another key.
+    return json.dumps(
+        [
+            options.max_length,
+            options.compared_by.value,
+            [kind.value for kind in options.kinds],
+            options.metrics_mode.value,
+            options.backend.value,
+            options.html_serialization.value,
+            options.tokenizer_id,
+        ]
+    )
+
+
+@attrs.define()
+class ChunkState:
+    pos_xpaths: list[str] = attrs.field(
+        validator=type_validator()
+    )
+    repr_length: int = attrs.field(
+        validator=type_validator()
+    )
+    fingerprint: str = attrs.field(
+        validator=type_validator()
+    )
+    # None when not rendered.
+    html: Optional[str] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+    text: Optional[str] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+
+@attrs.define()
+class ChunkingState:
+    """What a chunking run leaves for the next one, JSON serializable."""
+    options_key: str = attrs.field(
+        validator=type_validator()
+    )
+    chunks: list[ChunkState] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+    # Subtree hash -> [REGION_ENTRY, relative xpaths, repr_length,
+    # node_is_roi] and [NODE_ENTRY, relative xpath] entries.
+    subtree_regions: dict[str, list[list]] = attrs.field(
+        validator=attrs.validators.instance_of(dict),
+        factory=dict,
+        repr=False
+    )
+
+    def as_dict(self) -> dict[str, Any]:
+        return attrs.asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "ChunkingState":
+        return cls(
+            options_key=data["options_key"],
+            chunks=[ChunkState(**chunk) for chunk in data["chunks"]],
+            subtree_regions=data["subtree_regions"]
+        )
+
+
+@attrs.define()
+class IncrementalResult:
+    dom_representation: DomRepresentation = attrs.field(
+        validator=type_validator(),
+        repr=False
+    )
+    # Pass it, or its as_dict(), as previous to the next rechunk().
+    state: ChunkingState = attrs.field(
+        validator=type_validator(),
+        repr=False
+    )
+    # Indices of the chunks of this run:
+    unchanged_chunks: list[int] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+    changed_chunks: list[int] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+    new_chunks: list[int] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+    # Indices of the chunks of the previous run with no counterpart.
+    removed_chunks: list[int] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+    # Chunk index -> index of the same (unchanged) or replaced (changed)
+    # chunk in the previous run.
+    previous_indices: dict[int, int] = attrs.field(
+        validator=type_validator(),
+        factory=dict
+    )
+
+    @property
+    def chunks(self) -> list[ChunkState]:
+        return self.state.chunks
+
+
+def match_chunks(
+    result: IncrementalResult,
+    previous_chunks: list[ChunkState]
+        ) -> None:
+    chunks: list[ChunkState] = result.state.chunks
+
+    # Same content, wherever it moved.
+    previous_by_fingerprint: dict[str, deque[int]] = {}
+    for previous_idx, chunk in enumerate(previous_chunks):
+        previous_by_fingerprint.setdefault(
+            chunk.fingerprint, deque()
+        ).append(previous_idx)
+    unmatched: list[int] = []
+    for chunk_idx, chunk in enumerate(chunks):
+        candidates: Optional[deque[int]] =\
+            previous_by_fingerprint.get(chunk.fingerprint)
+        if candidates:
+            result.previous_indices[chunk_idx] = candidates.popleft()
+            result.unchanged_chunks.append(chunk_idx)
+        else:
+            unmatched.append(chunk_idx)
+
+    # Other content at the same place: the chunk starting at the same
+    # node.
+    matched: set[int] = set(result.previous_indices.values())
+    previous_by_start: dict[str, deque[int]] = {}
+    for previous_idx, chunk in enumerate(previous_chunks):
+        if previous_idx not in matched:
+            previous_by_start.setdefault(
+                chunk.pos_xpaths[0], deque()
+            ).append(previous_idx)
+    for chunk_idx in unmatched:
+        candidates = previous_by_start.get(chunks[chunk_idx].pos_xpaths[0])
+        if candidates:
+            previous_idx: int = candidates.popleft()
+            result.previous_indices[chunk_idx] = previous_idx
+            matched.add(previous_idx)
+            result.changed_chunks.append(chunk_idx)
+        else:
+            result.new_chunks.append(chunk_idx)
+
+    result.removed_chunks = [
+        previous_idx for previous_idx in range(len(previous_chunks))
+        if previous_idx not in matched
+    ]
+
+
+def get_dom_representation_options(
+    dom_representation: DomRepresentation,
+    kinds: tuple[ChunkKind, ...],
+    tokenizer_id: Optional[str] = None
+        ) -> ChunkingOptions:
+    return ChunkingOptions(
+        max_length=dom_representation.MAX_NODE_REPR_LENGTH,
+        compared_by=dom_representation.repr_length_compared_by,
+        kinds=kinds,
+        tag_list_to_filter_out=dom_representation.tag_list_to_filter_out,
+        html_unescape=dom_representation.html_unescape,
+        metrics_mode=dom_representation.metrics_mode,
+        backend=dom_representation.backend,
+        html_serialization=dom_representation.html_serialization,
+        tokenizer=dom_representation.tokenizer,
+        tokenizer_id=tokenizer_id
+    )
+
+
+def make_chunking_state(
+    dom_representation: DomRepresentation,
+    kinds: tuple[ChunkKind, ...] = (ChunkKind.HTML, ChunkKind.TEXT),
+    tokenizer_id: Optional[str] = None
+        ) -> ChunkingState:
+    """State of a DomRepresentation that was not chunked by rechunk().
+
+    Renders are taken over when it was started in RenderMode.EAGER,
+    otherwise the next rechunk() renders every chunk again. With
+    TOKEN_LENGTH, its regions are only reused when tokenizer_id names
+    the tokenizer it was measured with.
+    """
+    options: ChunkingOptions = get_dom_representation_options(
+        dom_representation=dom_representation,
+        kinds=kinds,
+        tokenizer_id=tokenizer_id
+    )
+    if not hasattr(dom_representation, "tree_representation"):
+        dom_representation.compute_tree_representation()
+    state, _ = plan_chunks(
+        dom_representation=dom_representation,
+        options=options,
+        previous=None,
+        render=False
+    )
+
+    if hasattr(dom_representation, "render_system") and\
+            dom_representation.render_mode == RenderMode.EAGER:
+        render_system = dom_representation.render_system
+        for chunk_idx, chunk in enumerate(state.chunks):
+            if ChunkKind.HTML in kinds:
+                chunk.html = render_system.html_render_roi.get(chunk_idx)
+            if ChunkKind.TEXT in kinds:
+                chunk.text = render_system.text_render_roi.get(chunk_idx)
+    return state
+
+
+def plan_chunks(
+    dom_representation: DomRepresentation,
+    options: ChunkingOptions,
+    previous: Optional[ChunkingState],
+    render: bool = True
+        ) -> tuple[ChunkingState, RegionPlanner]:
+    tree_representation: DOMTreeRepresentation =\
+        dom_representation.tree_representation
+    compact_tree: CompactTree = tree_representation.compact_tree
+    stats_recorder = dom_representation.stats_recorder
+    options_key: str = get_options_key(options=options)
+    if previous is not None and previous.options_key != options_key:
+        previous = None
+
+    with stats_recorder.stage(name=ROI_STAGE):
+        subtree_hashes: list[str] = compute_subtree_hashes(
+            tree_representation=tree_representation
+        )
+        planner = RegionPlanner(
+            compact_tree=compact_tree,
+            subtree_hashes=subtree_hashes,
+            max_node_repr_length=options.max_length,
+            repr_length_compared_by=options.compared_by,
+            previous_regions=previous.subtree_regions
+            if previous is not None and options.cacheable else {}
+        )
+        regions: list[RegionOfInterest] = planner.plan()
+    stats_recorder.count(name=ROIS_COUNTER, value=len(regions))
+    stats_recorder.count(
+        name=REUSED_SUBTREES_COUNTER, value=planner.reused_subtrees
+    )
+
+    previous_renders: dict[str, ChunkState] = {}
+    if previous is not None:
+        for chunk in previous.chunks:
+            previous_renders[chunk.fingerprint] = chunk
+
+    state = ChunkingState(
+        options_key=options_key,
+        subtree_regions=planner.subtree_regions
+    )
+    with stats_recorder.stage(name=RENDER_STAGE):
+        for roi in regions:
+            chunk = ChunkState(
+                pos_xpaths=roi.pos_xpath_list,
+                repr_length=roi.repr_length,
+                fingerprint=get_chunk_fingerprint(
+                    compact_tree=compact_tree,
+                    subtree_hashes=subtree_hashes,
+                    pos_xpaths=roi.pos_xpath_list
+                )
+            )
+            state.chunks.append(chunk)
+            if render:
+                render_chunk(
+                    chunk=chunk,
+                    previous_chunk=previous_renders.get(chunk.fingerprint),
+                    dom_representation=dom_representation,
+                    kinds=options.kinds
+                )
+    return state, planner
+
+
+def render_chunk(
+    chunk: ChunkState,
+    previous_chunk: Optional[ChunkState],
+    dom_representation: DomRepresentation,
+    kinds: tuple[ChunkKind, ...]
+        ) -> None:
+    stats_recorder = dom_representation.stats_recorder
+    for kind in kinds:
+        content: Optional[str] = None
+        if previous_chunk is not None:
+            content = getattr(previous_chunk, kind.value)
+        if content is not None:
+            stats_recorder.count(name=REUSED_RENDERS_COUNTER)
+        else:
+            content = render_pos_xpath_list(
+                tree_representation=dom_representation.tree_representation,
+                pos_xpath_list=chunk.pos_xpaths,
+                kind=kind
+            )
+            stats_recorder.count(name=RENDERED_CHUNKS_COUNTER)
+        setattr(chunk, kind.value, content)
+
+
+def rechunk(
+    website_code: str,
+    options: ChunkingOptions,
+    previous: Optional[ChunkingState | DomRepresentation | dict] = None
+        ) -> IncrementalResult:
+    """Chunk website_code, reusing the work done on a previous version.
+
+    Parameters
+    ----------
+    website_code:
+        New HTML of the page.
+    options:
+        Same options as ``chunk_many``; ``options.kinds`` are rendered.
+        With ``TOKEN_LENGTH``, previous regions are only reused when
+        ``options.tokenizer_id`` is set (and the same as before).
+    previous:
+        The ``state`` of the previous result (or its ``as_dict()``, e.g.
+        loaded back from JSON), a ``DomRepresentation`` of the previous
+        version, or None for a first run.
+
+    The document is always parsed, measured and hashed in full: a
+    subtree hash costs about as much as measuring the subtree, so the
+    lengths of unchanged subtrees are computed again rather than looked
+    up. What is reused is the region discovery of subtrees seen in the
+    previous run, and the renders of chunks made of the same content.
+
+    The result tells which chunks are unchanged, changed (other content
+    starting at the same node), new or removed. A previous run with
+    other options (``get_options_key``: lengths, kinds, backend,
+    serialization...) is not reused, and all its chunks are reported
+    removed and all the new ones new.
+    """
+    if isinstance(previous, DomRepresentation):
+        previous = make_chunking_state(
+            dom_representation=previous,
+            kinds=options.kinds,
+            tokenizer_id=options.tokenizer_id
+            if previous.tokenizer is options.tokenizer else None
+        )
+    elif isinstance(previous, dict):
+        previous = ChunkingState.from_dict(data=previous)
+
+    dom_representation: DomRepresentation =\
+        options.make_dom_representation(website_code=website_code)
+    dom_representation.compute_tree_representation()
+    state, _ = plan_chunks(
+        dom_representation=dom_representation,
+        options=options,
+        previous=previous
+    )
+    dom_representation.stats = dom_representation.stats_recorder.finish()
+
+    result = IncrementalResult(
+        dom_representation=dom_representation,
+        state=state
+    )
+    if previous is not None and previous.options_key != state.options_key:
+        # Chunked with other options: no chunk compares.
+        result.new_chunks = list(range(len(state.chunks)))
+        result.removed_chunks = list(range(len(previous.chunks)))
+    else:
+        match_chunks(
+            result=result,
+            previous_chunks=[] if previous is None else previous.chunks
+        )
+    return result
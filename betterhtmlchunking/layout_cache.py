@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+import attrs
+
+from attrs_strict import type_validator
+
+import array
+
+import hashlib
+
+from collections import OrderedDict
+
+from betterhtmlchunking.compact_tree import CompactTree
+
+from betterhtmlchunking.packing import ChildrenPacking
+from betterhtmlchunking.packing import pack_children
+
+from betterhtmlchunking.tree_regions_system import NODE_ENTRY
+from betterhtmlchunking.tree_regions_system import REGION_ENTRY
+from betterhtmlchunking.tree_regions_system import RegionOfInterest
+from betterhtmlchunking.tree_regions_system import RegionPlanner
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+from betterhtmlchunking.tree_regions_system import get_repr_lengths
+
+from betterhtmlchunking.stats import StatsRecorder
+from betterhtmlchunking.stats import LAYOUT_CACHE_HITS_COUNTER
+from betterhtmlchunking.stats import LAYOUT_CACHE_MISSES_COUNTER
+from betterhtmlchunking.stats import LAYOUT_ADJUSTED_NODES_COUNTER
+
+from typing import Optional
+
+
+#####################################
+#                                   #
+#   --- Site-template layouts ---   #
+#                                   #
+#####################################
+
+# Pages rendered from the same template (product pages, articles of a
+# site) share their tag skeleton and, roughly, the sizes of their
+# subtrees. Their regions are found once and kept under a structural
+# fingerprint: the positional xpaths plus the length bucket of each node,
+# below or at least the maximum length (whether ROIMaker goes down into
+# it or not).
+#
+# A page with a known fingerprint reuses the entries of every explored
+# node once its children, packed again from their own lengths, split
+# into the same regions and the same children sent deeper. Only the
+# region lengths are updated, so the regions are those full discovery
+# finds. A node whose children pack differently is explored again with
+# ROIMaker, the rest of the layout is still reused under it.
+
+DEFAULT_MAX_LAYOUTS: int = 256
+
+# Shape of a node's entries, in child indices: ("node", child) and
+# ("region", children) items.
+PartitionT = list[tuple[str, tuple[int, ...]]]
+
+
+def get_layout_fingerprint(
+    compact_tree: CompactTree,
+    max_node_repr_length: int,
+    repr_length_compared_by: ReprLengthComparisionBy
+        ) -> str:
+    repr_lengths: array.array = get_repr_lengths(
+        compact_tree=compact_tree,
+        repr_length_compared_by=repr_length_compared_by
+    )
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(
+        f"{max_node_repr_length}\0{repr_length_compared_by.value}\0"
+        .encode("utf-8")
+    )
+    hasher.update(
+        "\0".join(compact_tree.pos_xpaths)
+        .encode("utf-8", errors="surrogatepass")
+    )
+    hasher.update(
+        bytes(length >= max_node_repr_length for length in repr_lengths)
+    )
+    return hasher.hexdigest()
+
+
+@attrs.define()
+class LayoutPlanner(RegionPlanner):
+    # Subtrees are keyed by their positional xpath: previous_regions is
+    # the layout of a page with the same fingerprint.
+    explored_nodes: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+
+    def reuse_entries(
+        self,
+        node_id: int,
+        entries: list[list]
+            ) -> Optional[list[list]]:
+        compact_tree: CompactTree = self.compact_tree
+        repr_lengths: array.array = get_repr_lengths(
+            compact_tree=compact_tree,
+            repr_length_compared_by=self.repr_length_compared_by
+        )
+        children_ids: list[int] = compact_tree.get_children(node_id=node_id)
+        packing: ChildrenPacking = pack_children(
+            repr_lengths=repr_lengths,
+            children_ids=children_ids,
+            max_node_repr_length=self.max_node_repr_length
+        )
+
+        # The node is its own region, as in ROIMaker.
+        if not children_ids or (
+                len(packing.regions) == 1 and
+                packing.get_span_count(region_idx=0) == len(children_ids)):
+            if len(entries) == 1 and entries[0][0] == REGION_ENTRY and\
+                    entries[0][3]:
+                return [[REGION_ENTRY, entries[0][1],
+                         repr_lengths[node_id], True]]
+            return None
+
+        items: list[tuple[int, str, tuple[int, ...], int]] = [
+            (child_idx, NODE_ENTRY, (child_idx,), 0)
+            for child_idx in packing.children_to_enqueue
+        ]
+        for spans, repr_length in zip(packing.regions, packing.repr_lengths):
+            region: tuple[int, ...] = tuple(
+                child_idx
+                for start, end in spans
+                for child_idx in range(start, end)
+            )
+            # Left empty by a child sent deeper.
+            if region:
+                items.append((region[0], REGION_ENTRY, region, repr_length))
+        items.sort()
+        partition: PartitionT = [(kind, region)
+                                 for _, kind, region, _ in items]
+        if self.get_cached_partition(
+                node_id=node_id,
+                children_ids=children_ids,
+                entries=entries) != partition:
+            return None
+
+        reused: list[list] = []
+        for entry, (_, _, _, repr_length) in zip(entries, items):
+            if entry[0] == NODE_ENTRY:
+                reused.append(entry)
+            else:
+                reused.append([REGION_ENTRY, entry[1], repr_length, False])
+        return reused
+
+    def get_cached_partition(
+        self,
+        node_id: int,
+        children_ids: list[int],
+        entries: list[list]
+            ) -> Optional[PartitionT]:
+        # None when the entries are not a split of the children (the
+        # node was its own region).
+        compact_tree: CompactTree = self.compact_tree
+        root_xpath: str = compact_tree.pos_xpaths[node_id]
+        child_indices: dict[int, int] = {
+            child_id: child_idx
+            for child_idx, child_id in enumerate(children_ids)
+        }
+        partition: PartitionT = []
+        for entry in entries:
+            if entry[0] == REGION_ENTRY and entry[3]:
+                return None
+            pos_xpaths: list[str] = [entry[1]] if entry[0] == NODE_ENTRY\
+                else entry[1]
+            partition.append((
+                entry[0],
+                tuple(
+                    child_indices.get(compact_tree.get_node_id(
+                        pos_xpath=root_xpath + pos_xpath
+                    ))
+                    for pos_xpath in pos_xpaths
+                )
+            ))
+        return partition
+
+    def explore(self, node_id: int) -> list[list]:
+        self.explored_nodes += 1
+        return super().explore(node_id=node_id)
+
+
+@attrs.define()
+class LayoutCache:
+    """Regions of the pages seen so far, by structural fingerprint.
+
+    Pass it to ``DomRepresentation(layout_cache=...)`` for every page
+    of a site, the layouts are kept least recently used first.
+    """
+    # Layouts kept, None for no bound.
+    max_layouts: Optional[int] = attrs.field(
+        validator=type_validator(),
+        default=DEFAULT_MAX_LAYOUTS
+    )
+    layouts: OrderedDict[str, dict[str, list[list]]] = attrs.field(
+        validator=attrs.validators.instance_of(OrderedDict),
+        init=False,
+        factory=OrderedDict,
+        repr=False
+    )
+    hits: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+    misses: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+    # Nodes of cached layouts explored again by ROIMaker.
+    adjusted_nodes: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+
+    def plan(
+        self,
+        compact_tree: CompactTree,
+        root_id: int,
+        max_node_repr_length: int,
+        repr_length_compared_by: ReprLengthComparisionBy,
+        stats_recorder: Optional[StatsRecorder] = None
+            ) -> list[RegionOfInterest]:
+        """Regions under root_id in document order."""
+        fingerprint: str = get_layout_fingerprint(
+            compact_tree=compact_tree,
+            max_node_repr_length=max_node_repr_length,
+            repr_length_compared_by=repr_length_compared_by
+        )
+        layout: Optional[dict[str, list[list]]] =\
+            self.layouts.get(fingerprint)
+
+        planner = LayoutPlanner(
+            compact_tree=compact_tree,
+            subtree_hashes=compact_tree.pos_xpaths,
+            max_node_repr_length=max_node_repr_length,
+            repr_length_compared_by=repr_length_compared_by,
+            previous_regions=layout or {}
+        )
+        regions: list[RegionOfInterest] = list(
+            planner.iter_regions(root_id=root_id)
+        )
+
+        if layout is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.adjusted_nodes += planner.explored_nodes
+        # The layout follows the last page seen with the fingerprint.
+        self.layouts.pop(fingerprint, None)
+        self.layouts[fingerprint] = planner.subtree_regions
+        if self.max_layouts is not None\
+                and len(self.layouts) > self.max_layouts:
+            self.layouts.popitem(last=False)
+
+        if stats_recorder is not None:
+            if layout is None:
+                stats_recorder.count(name=LAYOUT_CACHE_MISSES_COUNTER)
+            else:
+                stats_recorder.count(name=LAYOUT_CACHE_HITS_COUNTER)
+                stats_recorder.count(
+                    name=LAYOUT_ADJUSTED_NODES_COUNTER,
+                    value=planner.explored_nodes
+                )
+        return regions
+
+    def __len__(self) -> int:
+        return len(self.layouts)
+
+
+shared_layout_cache: Optional[LayoutCache] = None
+
+
+def get_shared_layout_cache() -> LayoutCache:
+    """Layout cache of the process, used by chunk_many's workers."""
+    global shared_layout_cache
+    if shared_layout_cache is None:
+        shared_layout_cache = LayoutCache()
+    return shared_layout_cache
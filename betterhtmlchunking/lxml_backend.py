@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+
+import re
+
+import lxml.etree
+import lxml.html
+
+from betterhtmlchunking.html_source import iter_html_blocks
+from betterhtmlchunking.source_spans import SourceSpanRecorder
+from betterhtmlchunking.source_spans import parse_with_source_spans
+
+from enum import StrEnum
+
+from typing import Any
+from typing import Collection
+from typing import Iterator
+from typing import Optional
+
+
+##################################
+#                                #
+#   --- lxml parser backend ---  #
+#                                #
+##################################
+
+# Builds the tree straight from lxml.html elements, without the
+# BeautifulSoup object on top of them. Serialization reproduces
+# bs4's prettify(formatter="minimal") output so that lengths, renders
+# and therefore chunk boundaries match the bs4 backend.
+
+
+class ParserBackend(StrEnum):
+    BS4: str = "bs4"
+    LXML: str = "lxml"
+
+
+# bs4 HTMLTreeBuilder settings:
+VOID_ELEMENT_TAGS: frozenset[str] = frozenset({
+    "area", "base", "basefont", "bgsound", "br", "col", "command",
+    "embed", "frame", "hr", "image", "img", "input", "isindex", "keygen",
+    "link", "menuitem", "meta", "nextid", "param", "source", "spacer",
+    "track", "wbr",
+})
+PRESERVE_WHITESPACE_TAGS: frozenset[str] = frozenset({"pre", "textarea"})
+# BeautifulSoup.ASCII_SPACES
+ASCII_SPACES: str = "\x20\x0a\x09\x0c\x0d"
+CDATA_CONTAINING_TAGS: frozenset[str] = frozenset({"script", "style"})
+CDATA_LIST_ATTRIBUTES: dict[str, frozenset[str]] = {
+    "*": frozenset({"class", "accesskey", "dropzone"}),
+    "a": frozenset({"rel", "rev"}),
+    "link": frozenset({"rel", "rev"}),
+    "td": frozenset({"headers"}),
+    "th": frozenset({"headers"}),
+    "form": frozenset({"accept-charset"}),
+    "object": frozenset({"archive"}),
+    "area": frozenset({"rel"}),
+    "icon": frozenset({"sizes"}),
+    "iframe": frozenset({"sandbox"}),
+    "output": frozenset({"for"}),
+}
+
+NONWHITESPACE_RE: re.Pattern = re.compile(r"\S+")
+CONTENT_CHARSET_RE: re.Pattern = re.compile(
+    r"((^|;)\s*charset=)([^;]*)", re.M
+)
+OUTPUT_ENCODING: str = "utf-8"
+
+
+def make_lxml_root(
+    website_code: Any,
+    html_unescape: bool = False,
+    span_recorder: Optional[SourceSpanRecorder] = None
+        ) -> Optional[lxml.html.HtmlElement]:
+    # website_code is an opened HTML source, see html_source.py.
+    root: Optional[lxml.html.HtmlElement] = parse_lxml_root(
+        website_code=website_code,
+        html_unescape=html_unescape,
+        span_recorder=span_recorder
+    )
+    if root is not None:
+        collapse_lxml_whitespace(root=root)
+    return root
+
+
+def parse_lxml_root(
+    website_code: Any,
+    html_unescape: bool = False,
+    span_recorder: Optional[SourceSpanRecorder] = None
+        ) -> Optional[lxml.html.HtmlElement]:
+    # Parse through the target interface, as bs4 does: libxml2's own
+    # tree builder would fill in valueless boolean attributes
+    # (<input checked> -> checked="checked").
+    tree_builder = lxml.etree.TreeBuilder(parser=lxml.html.HTMLParser())
+    try:
+        if span_recorder is not None:
+            span_recorder.target = tree_builder
+            return parse_with_source_spans(
+                document=website_code, recorder=span_recorder
+            )
+        parser = lxml.etree.HTMLParser(target=tree_builder)
+        for block in iter_html_blocks(
+                document=website_code, html_unescape=html_unescape):
+            parser.feed(block)
+        return parser.close()
+    except (ValueError, lxml.etree.LxmlError):
+        # Empty document, or names lxml refuses to create elements for.
+        ...
+
+    if span_recorder is not None:
+        # The elements parsed again below have no spans.
+        span_recorder.spans.clear()
+        span_recorder.elements.clear()
+
+    try:
+        return lxml.html.document_fromstring(
+            "".join(
+                iter_html_blocks(
+                    document=website_code, html_unescape=html_unescape
+                )
+            )
+        )
+    except lxml.etree.ParserError:
+        # Empty document.
+        return None
+
+
+def is_lxml_tag(node) -> bool:
+    # Comments and processing instructions have a callable as tag.
+    return isinstance(node.tag, str)
+
+
+def collapse_whitespace_string(text: str) -> str:
+    # What bs4 does with a string made of ASCII spaces only (outside of
+    # PRESERVE_WHITESPACE_TAGS), see BeautifulSoup.endData.
+    if not text or text.strip(ASCII_SPACES):
+        return text
+    return "\n" if "\n" in text else " "
+
+
+def collapse_lxml_whitespace(root: lxml.html.HtmlElement) -> None:
+    stack: list[lxml.html.HtmlElement] = [root]
+    while stack:
+        elem = stack.pop()
+        if elem.tag is lxml.etree.Comment:
+            # bs4 collapses comment contents too.
+            if elem.text:
+                elem.text = collapse_whitespace_string(text=elem.text)
+            continue
+        if not is_lxml_tag(node=elem) or\
+                elem.tag in PRESERVE_WHITESPACE_TAGS:
+            continue
+        if elem.text:
+            elem.text = collapse_whitespace_string(text=elem.text)
+        for child in elem:
+            if child.tail:
+                child.tail = collapse_whitespace_string(text=child.tail)
+            stack.append(child)
+    return None
+
+
+def is_void_lxml_elem(elem: lxml.html.HtmlElement) -> bool:
+    return elem.tag in VOID_ELEMENT_TAGS and len(elem) == 0 and\
+        not elem.text
+
+
+def substitute_xml(value: str) -> str:
+    return value.replace("&", "&amp;").replace(
+        "<", "&lt;").replace(">", "&gt;")
+
+
+def quoted_attribute_value(value: str) -> str:
+    quote_with: str = '"'
+    if '"' in value:
+        if "'" in value:
+            value = value.replace('"', "&quot;")
+        else:
+            quote_with = "'"
+    return quote_with + value + quote_with
+
+
+def get_attribute_value(elem: lxml.html.HtmlElement, key: str) -> str:
+    value: str = elem.attrib[key]
+    tag: str = elem.tag
+
+    if key in CDATA_LIST_ATTRIBUTES["*"] or\
+            key in CDATA_LIST_ATTRIBUTES.get(tag, ()):
+        return " ".join(NONWHITESPACE_RE.findall(value))
+
+    if tag == "meta":
+        # bs4 rewrites the declared encoding to the output encoding.
+        if key == "charset":
+            return OUTPUT_ENCODING
+        if key == "content" and "charset" not in elem.attrib:
+            http_equiv: str = elem.attrib.get("http-equiv")
+            if http_equiv is not None and\
+                    http_equiv.lower() == "content-type":
+                return CONTENT_CHARSET_RE.sub(
+                    lambda match: match.group(1) + OUTPUT_ENCODING,
+                    value
+                )
+    return value
+
+
+def format_lxml_open_tag(elem: lxml.html.HtmlElement) -> str:
+    attribute_string: str = "".join(
+        " " + key + "=" + quoted_attribute_value(
+            substitute_xml(get_attribute_value(elem=elem, key=key))
+        )
+        for key in sorted(elem.attrib.keys())
+    )
+    if is_void_lxml_elem(elem=elem):
+        return f"<{elem.tag}{attribute_string}/>"
+    return f"<{elem.tag}{attribute_string}>"
+
+
+def format_lxml_close_tag(elem: lxml.html.HtmlElement) -> str:
+    if is_void_lxml_elem(elem=elem):
+        return ""
+    return f"</{elem.tag}>"
+
+
+def format_lxml_text(text: str, parent_tag: str) -> str:
+    if parent_tag in CDATA_CONTAINING_TAGS:
+        return text
+    return substitute_xml(text)
+
+
+def format_lxml_special_node(node) -> str:
+    if node.tag is lxml.etree.Comment:
+        return f"<!--{node.text or ''}-->"
+    if node.tag is lxml.etree.ProcessingInstruction:
+        return f"<?{node.target} {node.text or ''}>"
+    return ""
+
+
+# Events, in the same shape as bs4's Tag._event_stream:
+START_ELEMENT_EVENT: str = "start"
+END_ELEMENT_EVENT: str = "end"
+EMPTY_ELEMENT_EVENT: str = "empty"
+STRING_ELEMENT_EVENT: str = "string"
+
+
+def iter_lxml_events(
+    elem: lxml.html.HtmlElement,
+    skipped: Collection = ()
+        ) -> Iterator[tuple[str, Any, str]]:
+    # Depth-first events where the tail of each child is emitted right
+    # after the child is closed, as a string of the parent.
+    # Elements in skipped are left out with their subtree, but not their
+    # tail, like a bs4 element after decompose().
+    stack: list[tuple[Any, Iterator]] = []
+
+    def enter(node) -> Iterator[tuple[str, Any, str]]:
+        if not is_lxml_tag(node=node):
+            yield STRING_ELEMENT_EVENT, node, format_lxml_special_node(
+                node=node
+            )
+            return
+        if is_void_lxml_elem(elem=node):
+            yield EMPTY_ELEMENT_EVENT, node, format_lxml_open_tag(elem=node)
+            return
+        yield START_ELEMENT_EVENT, node, format_lxml_open_tag(elem=node)
+        if node.text:
+            yield STRING_ELEMENT_EVENT, node, format_lxml_text(
+                text=node.text, parent_tag=node.tag
+            )
+        stack.append((node, iter(node)))
+
+    yield from enter(elem)
+    while stack:
+        node, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            yield END_ELEMENT_EVENT, node, format_lxml_close_tag(elem=node)
+            # The tail of the element we started from is not part of it.
+            if stack and node.tail:
+                parent = stack[-1][0]
+                yield STRING_ELEMENT_EVENT, parent, format_lxml_text(
+                    text=node.tail, parent_tag=parent.tag
+                )
+            continue
+
+        depth: int = len(stack)
+        if child not in skipped:
+            yield from enter(child)
+        if len(stack) == depth and child.tail:
+            # child was a leaf (void element, comment or skipped).
+            yield STRING_ELEMENT_EVENT, node, format_lxml_text(
+                text=child.tail, parent_tag=node.tag
+            )
+
+
+def prettify_lxml_element(
+    elem: lxml.html.HtmlElement,
+    skipped: Collection = (),
+    indent: str = " "
+        ) -> str:
+    """Pretty-print an lxml element like bs4's prettify().
+
+    Port of bs4's Tag.decode(indent_level=0, formatter="minimal").
+    """
+    pieces: list[str] = []
+    indent_level: int = 0
+    string_literal_tag = None
+
+    for event, node, piece in iter_lxml_events(elem=elem, skipped=skipped):
+        if event == END_ELEMENT_EVENT:
+            indent_level -= 1
+
+        if string_literal_tag is not None:
+            indent_before = indent_after = False
+        else:
+            indent_before = indent_after = True
+
+        if event == START_ELEMENT_EVENT and string_literal_tag is None and\
+                node.tag in PRESERVE_WHITESPACE_TAGS:
+            indent_before = True
+            indent_after = False
+            string_literal_tag = node
+        elif event == END_ELEMENT_EVENT and node is string_literal_tag:
+            indent_before = False
+            indent_after = True
+            string_literal_tag = None
+
+        if indent_before or indent_after:
+            if event == STRING_ELEMENT_EVENT:
+                piece = piece.strip()
+            if piece:
+                if indent_before and indent_level:
+                    piece = indent * indent_level + piece
+                if indent_after:
+                    piece = piece + "\n"
+
+        if event == START_ELEMENT_EVENT:
+            indent_level += 1
+        pieces.append(piece)
+
+    return "".join(pieces)
+
+
+def decode_lxml_element(
+    elem: lxml.html.HtmlElement,
+    skipped: Collection = ()
+        ) -> str:
+    # Like str() on a bs4 element: no pretty printing.
+    return "".join(
+        piece for _, _, piece in iter_lxml_events(elem=elem, skipped=skipped)
+    )
+
+
+def lxml_element_to_html(
+    elem: lxml.html.HtmlElement,
+    skipped: Collection = ()
+        ) -> str:
+    if not skipped:
+        return lxml.html.tostring(elem, encoding="unicode", with_tail=False)
+    return decode_lxml_element(elem=elem, skipped=skipped)
+
+
+def get_lxml_elem_text(
+    elem: lxml.html.HtmlElement,
+    skipped: Collection = ()
+        ) -> str:
+    # Same extraction as parsel_text.get_bs4_soup_text on a bs4 element:
+    # the subtree is serialized and extracted on its own.
+    import parsel_text
+
+    return parsel_text.get_bs4_soup_text(
+        bs4_soup=lxml_element_to_html(elem=elem, skipped=skipped)
+    )
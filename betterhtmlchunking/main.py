@@ -4,8 +4,6 @@ import attrs
 
 from attrs_strict import type_validator
 
-from betterhtmlchunking.utils import remove_unwanted_tags
-
 from betterhtmlchunking.tree_representation import\
     DOMTreeRepresentation
 
@@ -13,13 +11,49 @@ from betterhtmlchunking.tree_regions_system import\
     TreeRegionsSystem
 from betterhtmlchunking.tree_regions_system import\
     ReprLengthComparisionBy
+from betterhtmlchunking.tree_regions_system import\
+    iter_regions_of_interest
+from betterhtmlchunking.tree_regions_system import\
+    RegionOfInterest
 
 from betterhtmlchunking.render_system import\
     RenderSystem
+from betterhtmlchunking.render_system import\
+    RenderMode
+from betterhtmlchunking.render_system import\
+    ChunkKind
+from betterhtmlchunking.render_system import\
+    make_chunk_kinds
+from betterhtmlchunking.render_system import\
+    render_pos_xpath_list
+from betterhtmlchunking.render_system import\
+    NodeRenderCache
+from betterhtmlchunking.render_system import\
+    DEFAULT_NODE_RENDER_CACHE_SIZE
 
-from typing import Optional
+from betterhtmlchunking.node_metrics import MetricsMode
+from betterhtmlchunking.node_metrics import HtmlSerialization
+
+from betterhtmlchunking.stats import PipelineStats
+from betterhtmlchunking.stats import StageCallbackT
+from betterhtmlchunking.stats import StatsRecorder
+from betterhtmlchunking.stats import ROI_STAGE
+from betterhtmlchunking.stats import RENDER_STAGE
 
-import html
+from betterhtmlchunking.lxml_backend import ParserBackend
+
+from betterhtmlchunking.token_length import TokenizerT
+from betterhtmlchunking.token_length import get_token_counter
+
+from betterhtmlchunking.layout_cache import LayoutCache
+
+from betterhtmlchunking.html_source import HtmlSourceT
+from betterhtmlchunking.html_source import validate_html_source
+
+from typing import Any
+from typing import Callable
+from typing import Iterator
+from typing import Optional
 
 
 tag_list_to_filter_out: list[str] = [
@@ -42,8 +76,10 @@ class DomRepresentation:
     MAX_NODE_REPR_LENGTH: int = attrs.field(
         validator=type_validator()
     )
-    website_code: str = attrs.field(
-        validator=type_validator(),
+    # HTML as str or bytes (decoded by the parser), a pathlib.Path
+    # (mapped in memory) or a file.
+    website_code: HtmlSourceT = attrs.field(
+        validator=validate_html_source,
         repr=False
     )
     repr_length_compared_by: ReprLengthComparisionBy = attrs.field(
@@ -55,12 +91,92 @@ class DomRepresentation:
         validator=type_validator(),
         default=None
     )
+    # Done block by block while the parser is fed.
     html_unescape: bool = attrs.field(
         validator=type_validator(),
         default=True
     )
+    # Keep where each node is in the input (needs html_unescape=False),
+    # see source_spans.py.
+    record_source_spans: bool = attrs.field(
+        validator=type_validator(),
+        default=False
+    )
+    metrics_mode: MetricsMode = attrs.field(
+        validator=type_validator(),
+        default=MetricsMode.BOTTOM_UP
+    )
+    backend: ParserBackend = attrs.field(
+        validator=type_validator(),
+        default=ParserBackend.BS4
+    )
+    # Used both to measure HTML_LENGTH and to render HTML chunks.
+    html_serialization: HtmlSerialization = attrs.field(
+        validator=type_validator(),
+        default=HtmlSerialization.PRETTIFIED
+    )
+    render_mode: RenderMode = attrs.field(
+        validator=type_validator(),
+        default=RenderMode.EAGER
+    )
+    # Renders made by start() in RenderMode.EAGER.
+    render_kinds: tuple[ChunkKind, ...] = attrs.field(
+        validator=type_validator(),
+        converter=make_chunk_kinds,
+        default=(ChunkKind.HTML, ChunkKind.TEXT)
+    )
+    render_cache_size: Optional[int] = attrs.field(
+        validator=type_validator(),
+        default=128
+    )
+    # Required by ReprLengthComparisionBy.TOKEN_LENGTH, see
+    # token_length.py. A plain callable shares its token count cache
+    # with every document chunked with it.
+    tokenizer: Optional[TokenizerT] = attrs.field(
+        validator=attrs.validators.optional(attrs.validators.is_callable()),
+        default=None,
+        repr=False
+    )
+    # Shared by the pages of a site: regions are reused between pages
+    # with the same structure, see layout_cache.py.
+    layout_cache: Optional[LayoutCache] = attrs.field(
+        validator=type_validator(),
+        default=None,
+        repr=False
+    )
+    # Threads exploring the regions of large documents on free-threaded
+    # Python, see tree_regions_system.py. Warns with the GIL.
+    discovery_workers: int = attrs.field(
+        validator=type_validator(),
+        default=1
+    )
+    # Instrumentation, see stats.py:
+    trace_memory: bool = attrs.field(
+        validator=type_validator(),
+        default=False
+    )
+    stage_callback: Optional[StageCallbackT] = attrs.field(
+        validator=attrs.validators.optional(attrs.validators.is_callable()),
+        default=None,
+        repr=False
+    )
+    stats_callback: Optional[Callable[[PipelineStats], Any]] = attrs.field(
+        validator=attrs.validators.optional(attrs.validators.is_callable()),
+        default=None,
+        repr=False
+    )
 
     # Result:
+    stats: PipelineStats = attrs.field(
+        validator=type_validator(),
+        init=False,
+        repr=False
+    )
+    stats_recorder: StatsRecorder = attrs.field(
+        validator=type_validator(),
+        init=False,
+        repr=False
+    )
     tree_representation: DOMTreeRepresentation = attrs.field(
         validator=type_validator(),
         init=False,
@@ -76,35 +192,62 @@ class DomRepresentation:
         init=False,
         repr=False
     )
+    # Shared by the results of start_budgets().
+    node_render_cache: Optional[NodeRenderCache] = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=None,
+        repr=False
+    )
 
     def __attrs_post_init__(self):
+        self.stats_recorder = StatsRecorder(
+            trace_memory=self.trace_memory,
+            stage_callback=self.stage_callback
+        )
+        self.stats = self.stats_recorder.stats
+
+        if self.repr_length_compared_by ==\
+                ReprLengthComparisionBy.TOKEN_LENGTH\
+                and self.tokenizer is None:
+            raise ValueError("TOKEN_LENGTH needs a tokenizer")
+
         if self.tag_list_to_filter_out is None:
             self.tag_list_to_filter_out = tag_list_to_filter_out
 
-        if self.html_unescape is True:
-            self.website_code: str = html.unescape(self.website_code)
-
     def compute_tree_representation(self):
         self.tree_representation = DOMTreeRepresentation(
             website_code=self.website_code,
+            html_unescape=self.html_unescape,
+            record_source_spans=self.record_source_spans,
+            metrics_mode=self.metrics_mode,
+            backend=self.backend,
+            html_serialization=self.html_serialization,
+            tag_list_to_filter_out=self.tag_list_to_filter_out,
+            token_counter=None if self.tokenizer is None else
+            get_token_counter(tokenizer=self.tokenizer),
+            stats_recorder=self.stats_recorder
         )
-        self.tree_representation = remove_unwanted_tags(
-            tree_representation=self.tree_representation,
-            tag_list_to_filter_out=self.tag_list_to_filter_out
-        )
-        self.tree_representation.recompute_representation()
 
     def compute_tree_regions_system(self):
         self.tree_regions_system = TreeRegionsSystem(
             tree_representation=self.tree_representation,
             max_node_repr_length=self.MAX_NODE_REPR_LENGTH,
-            repr_length_compared_by=self.repr_length_compared_by
+            repr_length_compared_by=self.repr_length_compared_by,
+            stats_recorder=self.stats_recorder,
+            layout_cache=self.layout_cache,
+            discovery_workers=self.discovery_workers
         )
 
     def compute_render_system(self):
         self.render_system = RenderSystem(
             tree_regions_system=self.tree_regions_system,
-            tree_representation=self.tree_representation
+            tree_representation=self.tree_representation,
+            render_mode=self.render_mode,
+            kinds=self.render_kinds,
+            cache_size=self.render_cache_size,
+            stats_recorder=self.stats_recorder,
+            node_render_cache=self.node_render_cache
         )
 
     def start(self, verbose: bool = False):
@@ -116,14 +259,114 @@ class DomRepresentation:
             If ``True``, progress information is printed to stdout.
             When ``False`` (the default) the method runs silently so that
             callers such as the CLI can output only the chunk HTML.
+
+        Stage timings and counters are left in ``self.stats``, and
+        passed to ``stats_callback`` when it is set.
         """
         if verbose:
             print("--- DOM REPRESENTATION ---")
             print(" > Computing tree representation:")
         self.compute_tree_representation()
+        self.compute_chunks(verbose=verbose)
+
+    def compute_chunks(self, verbose: bool = False):
+        # Regions and renders, once the tree representation is built.
         if verbose:
             print(" > Computing tree regions system:")
-        self.compute_tree_regions_system()
+        with self.stats_recorder.stage(name=ROI_STAGE):
+            self.compute_tree_regions_system()
         if verbose:
             print(" > Computing render:")
-        self.compute_render_system()
+        with self.stats_recorder.stage(name=RENDER_STAGE):
+            self.compute_render_system()
+
+        self.stats = self.stats_recorder.finish()
+        if verbose:
+            for stage_stats in self.stats.stages.values():
+                print(
+                    f" > {stage_stats.name}: {stage_stats.wall_time:.4f}s "
+                    f"wall, {stage_stats.cpu_time:.4f}s CPU"
+                )
+            print(f" > {self.stats.counters}")
+        if self.stats_callback is not None:
+            self.stats_callback(self.stats)
+
+    def start_budgets(
+        self,
+        max_node_repr_lengths: list[int],
+        verbose: bool = False,
+        node_render_cache_size: Optional[int] =\
+            DEFAULT_NODE_RENDER_CACHE_SIZE
+            ) -> dict[int, "DomRepresentation"]:
+        """Chunk the document at several maximum lengths.
+
+        The document is parsed, measured and filtered once. Returns a
+        DomRepresentation per maximum length, sharing this one's
+        ``tree_representation``, each with its own
+        ``tree_regions_system``, ``render_system`` and ``stats``
+        (regions and renders only, the tree stages are in
+        ``self.stats``). ``MAX_NODE_REPR_LENGTH`` is not used.
+
+        A node found in the regions of several maximum lengths is
+        rendered once while it is in a cache shared by the results, of
+        at most ``node_render_cache_size`` node renders (None for no
+        bound, 0 for no cache), kept as long as the results are.
+        """
+        if verbose:
+            print("--- DOM REPRESENTATION ---")
+            print(" > Computing tree representation:")
+        if not hasattr(self, "tree_representation"):
+            self.compute_tree_representation()
+        self.stats = self.stats_recorder.finish()
+        node_render_cache: Optional[NodeRenderCache] = None
+        if node_render_cache_size != 0:
+            node_render_cache = NodeRenderCache(
+                tree_representation=self.tree_representation,
+                cache_size=node_render_cache_size
+            )
+
+        budgets: dict[int, DomRepresentation] = {}
+        for max_node_repr_length in max_node_repr_lengths:
+            if verbose:
+                print(f"--- MAX NODE REPR LENGTH: {max_node_repr_length} ---")
+            budget: DomRepresentation = attrs.evolve(
+                self, MAX_NODE_REPR_LENGTH=max_node_repr_length
+            )
+            budget.tree_representation = self.tree_representation
+            budget.node_render_cache = node_render_cache
+            budget.compute_chunks(verbose=verbose)
+            budgets[max_node_repr_length] = budget
+        return budgets
+
+    def iter_regions_of_interest(self) -> Iterator[RegionOfInterest]:
+        # Regions in document order, see iter_chunks.
+        if not hasattr(self, "tree_representation"):
+            self.compute_tree_representation()
+
+        yield from iter_regions_of_interest(
+            tree_representation=self.tree_representation,
+            max_node_repr_length=self.MAX_NODE_REPR_LENGTH,
+            repr_length_compared_by=self.repr_length_compared_by,
+            layout_cache=self.layout_cache,
+            stats_recorder=self.stats_recorder
+        )
+
+    def iter_chunks(
+        self,
+        kind: ChunkKind = ChunkKind.TEXT
+            ) -> Iterator[tuple[int, list[str], str]]:
+        """Yield ``(roi_idx, pos_xpaths, content)`` in document order.
+
+        Same chunks as ``render_system.text_render_roi`` (or
+        ``html_render_roi`` with ``kind="html"``), without running
+        ``start()``: each chunk is rendered when it is reached and is
+        not kept. The tree representation is built first if needed.
+        """
+        kind = ChunkKind(kind)
+        for roi_idx, roi in enumerate(self.iter_regions_of_interest()):
+            yield roi_idx, list(roi.pos_xpath_list), render_pos_xpath_list(
+                tree_representation=self.tree_representation,
+                pos_xpath_list=roi.pos_xpath_list,
+                kind=kind,
+                node_render_cache=self.node_render_cache
+            )
@@ -0,0 +1,846 @@
+#!/usr/bin/env python3
+
+import attrs
+
+from attrs_strict import type_validator
+
+import lxml.html
+
+from betterhtmlchunking.lxml_backend import is_lxml_tag
+from betterhtmlchunking.lxml_backend import is_void_lxml_elem
+from betterhtmlchunking.lxml_backend import format_lxml_open_tag
+from betterhtmlchunking.lxml_backend import format_lxml_close_tag
+from betterhtmlchunking.lxml_backend import format_lxml_text
+from betterhtmlchunking.lxml_backend import format_lxml_special_node
+
+from betterhtmlchunking.token_length import TokenCounter
+
+from enum import StrEnum
+
+from typing import Any
+from typing import Collection
+from typing import Iterator
+from typing import Optional
+from typing import TYPE_CHECKING
+
+# bs4 is only needed by the bs4 backend, ftfy by non-ASCII text: both
+# are imported where they are used.
+if TYPE_CHECKING:
+    import bs4
+
+
+#######################################
+#                                     #
+#   --- Bottom-up node metrics ---    #
+#                                     #
+#######################################
+
+# text_length and html_length of every element are computed in a single
+# post-order traversal: each element sums the contributions of its
+# children plus its own tag overhead, instead of serializing and
+# text-extracting every subtree again (quadratic in the tree depth).
+#
+# The numbers match the per-node values:
+#   * html_length == len(elem.prettify(formatter="minimal")), or
+#     len(elem.decode(formatter="minimal")) with HtmlSerialization.COMPACT
+#   * text_length == len(parsel_text.get_bs4_soup_text(bs4_soup=elem))
+# The only divergence is mojibake repair: parsel_text runs
+# ftfy.fix_encoding over the joined text of a subtree, here it is run
+# once per text segment.
+#
+# With a token counter, token_length is the sum of the token counts of
+# those same text segments, each tokenized once.
+#
+# The same pass builds the text of the whole document, its segments
+# joined by newlines as parsel_text joins them, with the span of every
+# element in it: the text render of an element is a slice. Elements
+# under <pre>, <textarea> or an excluded tag have no span, their text
+# differs once they are extracted on their own.
+
+
+class MetricsMode(StrEnum):
+    # Single post-order pass summing child contributions.
+    BOTTOM_UP: str = "bottom_up"
+    # Legacy: prettify() and get_bs4_soup_text() on every element.
+    PER_NODE: str = "per_node"
+
+
+class HtmlSerialization(StrEnum):
+    # bs4's prettify(): one tag or string per line, indented.
+    PRETTIFIED: str = "prettified"
+    # As parsed, without added whitespace: shorter chunks.
+    COMPACT: str = "compact"
+
+
+# Same rules as parsel_text: text under these tags is dropped,
+# and whitespace under preformatted tags is kept verbatim.
+EXCLUDE_TEXT_TAGS: frozenset[str] = frozenset(
+    {"script", "style", "noscript", "template"}
+)
+PREFORMATTED_TEXT_TAGS: frozenset[str] = frozenset({"pre", "textarea"})
+# bs4 does not pretty print the content of these tags.
+PRESERVE_WHITESPACE_TAGS: frozenset[str] = frozenset({"pre", "textarea"})
+
+
+# Span of an element in the document text, (start, end) offsets.
+TextSpanT = tuple[int, int]
+# Start of the elements without a span.
+NO_TEXT_SPAN: int = -1
+
+
+def get_text_segment(raw: str, preformatted: bool) -> str:
+    # One text node as parsel_text cleans it, before mojibake repair.
+    text: str = raw if preformatted else " ".join(raw.split())
+    if text.strip() == "":
+        return ""
+    return text
+
+
+def fix_text(text: str) -> str:
+    if not text.isascii():
+        import ftfy
+
+        text = ftfy.fix_encoding(text)
+    return text
+
+
+class _TextBuffer:
+    __slots__ = ("segments", "offsets", "length")
+
+    def __init__(self):
+        self.segments: list[str] = []
+        # Where each segment starts in the joined text.
+        self.offsets: list[int] = []
+        self.length: int = 0
+
+    def add_segment(self, segment: str) -> None:
+        if self.segments:
+            # The newline before it.
+            self.length += 1
+        self.offsets.append(self.length)
+        self.segments.append(segment)
+        self.length += len(segment)
+
+    def get_span(self, first_segment: int) -> TextSpanT:
+        # Segments from first_segment to the last one added.
+        if first_segment == len(self.segments):
+            return (self.length, self.length)
+        return (self.offsets[first_segment], self.length)
+
+    def getvalue(self) -> str:
+        return "\n".join(self.segments)
+
+
+class _TagFrame:
+    __slots__ = (
+        "elem",
+        "idx",
+        "open_tag",
+        "close_tag",
+        "is_void",
+        "literal",
+        "excluded",
+        "preformatted",
+        "in_pre",
+        "in_excluded",
+        "text_buffer",
+        "first_segment",
+        "has_text_span",
+        "pretty_length",
+        "indented_pieces",
+        "raw_length",
+        "text_length",
+        "text_count",
+        "pre_text_length",
+        "pre_text_count",
+        "token_counter",
+        "token_length",
+        "pre_token_length",
+        "pending_text",
+    )
+
+    def __init__(
+        self,
+        elem,
+        name: str,
+        idx: int,
+        in_pre: bool,
+        open_tag: str,
+        close_tag: str,
+        is_void: bool,
+        token_counter: Optional[TokenCounter] = None,
+        in_excluded: bool = False,
+        text_buffer: Optional[_TextBuffer] = None
+            ):
+        self.elem = elem
+        self.idx: int = idx
+        self.open_tag: str = open_tag
+        self.close_tag: str = close_tag
+        self.is_void: bool = is_void
+        self.literal: bool = name in PRESERVE_WHITESPACE_TAGS
+        self.excluded: bool = name in EXCLUDE_TEXT_TAGS
+        self.preformatted: bool = name in PREFORMATTED_TEXT_TAGS
+        self.in_pre: bool = in_pre or self.preformatted
+        self.in_excluded: bool = in_excluded or self.excluded
+
+        # Segments of the document text from first_segment on are this
+        # element's, until it closes. The parent's pending text has to
+        # be flushed before it opens.
+        self.text_buffer: Optional[_TextBuffer] = text_buffer
+        self.first_segment: int = 0 if text_buffer is None else\
+            len(text_buffer.segments)
+        self.has_text_span: bool = not (in_pre or in_excluded)
+
+        # Pretty-printed length at indent level 0 and the number of
+        # pieces that get an indent when the element is nested deeper.
+        self.pretty_length: int = 0
+        self.indented_pieces: int = 0
+        # Length without pretty printing (used inside <pre>/<textarea>).
+        self.raw_length: int = 0
+
+        # Text segments as seen from this element alone, and as seen
+        # under a preformatted ancestor (only needed when in_pre).
+        self.text_length: int = 0
+        self.text_count: int = 0
+        self.pre_text_length: int = 0
+        self.pre_text_count: int = 0
+        self.token_counter: Optional[TokenCounter] = token_counter
+        self.token_length: int = 0
+        self.pre_token_length: int = 0
+        # Adjacent strings (left behind by removed elements) form a
+        # single text node once the element is serialized again.
+        self.pending_text: list[str] = []
+
+    def add_string(
+        self,
+        output: str,
+        text: Optional[str],
+        indent_width: int
+            ) -> None:
+        # output is the serialized string, text its character data
+        # (None for comments, doctypes, processing instructions...).
+        self.raw_length += len(output)
+
+        stripped: str = output.strip()
+        if stripped:
+            self.pretty_length += len(stripped) + 1 + indent_width
+            self.indented_pieces += 1
+
+        if text is None:
+            self.flush_text()
+        elif not self.excluded:
+            self.pending_text.append(text)
+        return None
+
+    def flush_text(self) -> None:
+        if not self.pending_text:
+            return None
+        text: str = "".join(self.pending_text)
+        self.pending_text.clear()
+
+        segment: str = get_text_segment(
+            raw=text, preformatted=self.preformatted
+        )
+        pre_segment: str = get_text_segment(raw=text, preformatted=True)\
+            if self.in_pre else ""
+        if self.text_buffer is not None and not self.in_excluded:
+            # As seen from the root of the document.
+            document_segment: str = pre_segment if self.in_pre else segment
+            if document_segment:
+                self.text_buffer.add_segment(segment=document_segment)
+
+        if segment:
+            segment = fix_text(text=segment)
+            self.text_length += len(segment)
+            self.text_count += 1
+            if self.token_counter is not None:
+                self.token_length += self.token_counter.count(text=segment)
+        if pre_segment:
+            pre_segment = fix_text(text=pre_segment)
+            self.pre_text_length += len(pre_segment)
+            self.pre_text_count += 1
+            if self.token_counter is not None:
+                self.pre_token_length +=\
+                    self.token_counter.count(text=pre_segment)
+        return None
+
+    def add_child(self, child: "_TagFrame", indent_width: int) -> None:
+        self.flush_text()
+        self.raw_length += child.raw_length
+        self.pretty_length += child.pretty_length +\
+            child.indented_pieces * indent_width
+        self.indented_pieces += child.indented_pieces
+
+        if self.excluded:
+            return None
+
+        if self.preformatted:
+            self.text_length += child.pre_text_length
+            self.text_count += child.pre_text_count
+            self.token_length += child.pre_token_length
+        else:
+            self.text_length += child.text_length
+            self.text_count += child.text_count
+            self.token_length += child.token_length
+        if self.in_pre:
+            self.pre_text_length += child.pre_text_length
+            self.pre_text_count += child.pre_text_count
+            self.pre_token_length += child.pre_token_length
+        return None
+
+    def close(self) -> None:
+        self.flush_text()
+        open_length: int = len(self.open_tag)
+        close_length: int = len(self.close_tag)
+
+        if self.is_void:
+            self.pretty_length = open_length + 1
+            self.indented_pieces = 1
+        elif self.literal:
+            # Children are emitted verbatim: only the opening tag is
+            # indented, only the closing tag is followed by a newline.
+            self.pretty_length = open_length + self.raw_length +\
+                close_length + 1
+            self.indented_pieces = 1
+        else:
+            self.pretty_length += open_length + 1 + close_length + 1
+            self.indented_pieces += 2
+        self.raw_length += open_length + close_length
+
+        if self.preformatted:
+            self.pre_text_length = self.text_length
+            self.pre_text_count = self.text_count
+            self.pre_token_length = self.token_length
+        return None
+
+    def get_text_length(self) -> int:
+        return self.text_length + max(self.text_count - 1, 0)
+
+    def get_text_span(self) -> Optional[TextSpanT]:
+        if self.text_buffer is None or not self.has_text_span:
+            return None
+        return self.text_buffer.get_span(first_segment=self.first_segment)
+
+    def get_html_length(self, html_serialization: HtmlSerialization) -> int:
+        match html_serialization:
+            case HtmlSerialization.PRETTIFIED:
+                return self.pretty_length
+            case HtmlSerialization.COMPACT:
+                return self.raw_length
+
+
+def get_pos_xpath_components(names: list[str]) -> list[str]:
+    # Positional XPath step of each tag among its siblings: the bare
+    # name when it is the only sibling with that name, name[i] otherwise.
+    name_totals: dict[str, int] = {}
+    for name in names:
+        name_totals[name] = name_totals.get(name, 0) + 1
+
+    name_seen: dict[str, int] = {}
+    components: list[str] = []
+    for name in names:
+        if name_totals[name] == 1:
+            components.append(name)
+        else:
+            position: int = name_seen.get(name, 0) + 1
+            name_seen[name] = position
+            components.append(f"{name}[{position}]")
+    return components
+
+
+def wanted_xpath(
+    xpath: str,
+    tag_list_to_filter_out: Collection[str]
+        ) -> bool:
+    # Check if any of the unwanted tags are present in the given XPath
+    return not any(tag in xpath for tag in tag_list_to_filter_out)
+
+
+# Positional XPaths of a child element: (pos_xpath, source_pos_xpath).
+# The source one is its position in the tree as parsed, which is what
+# tag_list_to_filter_out is matched against; pos_xpath only counts the
+# siblings that were kept, as a recompute after deleting the filtered
+# ones would.
+ChildPosXPaths = tuple[str, str]
+
+
+def get_children_pos_xpaths(
+    names: list[str],
+    parent_xpaths: ChildPosXPaths,
+    tag_list_to_filter_out: Collection[str] = ()
+        ) -> list[Optional[ChildPosXPaths]]:
+    """XPaths of every child tag, or None for the filtered out ones."""
+    parent_xpath, parent_source_xpath = parent_xpaths
+    source_components: list[str] = get_pos_xpath_components(names=names)
+
+    if not tag_list_to_filter_out:
+        return [
+            (f"{parent_xpath}/{component}",
+             f"{parent_source_xpath}/{component}")
+            for component in source_components
+        ]
+
+    source_xpaths: list[str] = [
+        f"{parent_source_xpath}/{component}"
+        for component in source_components
+    ]
+    wanted: list[bool] = [
+        wanted_xpath(
+            xpath=source_xpath,
+            tag_list_to_filter_out=tag_list_to_filter_out
+        )
+        for source_xpath in source_xpaths
+    ]
+    components: Iterator[str] = iter(get_pos_xpath_components(
+        names=[name for name, is_wanted in zip(names, wanted) if is_wanted]
+    ))
+    return [
+        (f"{parent_xpath}/{next(components)}", source_xpath)
+        if is_wanted else None
+        for source_xpath, is_wanted in zip(source_xpaths, wanted)
+    ]
+
+
+def iter_child_pos_xpaths(
+    parent_xpaths: ChildPosXPaths,
+    parent,
+    tag_list_to_filter_out: Collection[str] = ()
+        ) -> Iterator[Optional[ChildPosXPaths]]:
+    import bs4
+
+    names: list[str] = [
+        child.name for child in parent.contents
+        if isinstance(child, bs4.Tag)
+    ]
+    yield from get_children_pos_xpaths(
+        names=names,
+        parent_xpaths=parent_xpaths,
+        tag_list_to_filter_out=tag_list_to_filter_out
+    )
+
+
+def iter_lxml_child_pos_xpaths(
+    parent_xpaths: ChildPosXPaths,
+    parent,
+    skipped: Collection = (),
+    tag_list_to_filter_out: Collection[str] = ()
+        ) -> Iterator[Optional[ChildPosXPaths]]:
+    names: list[str] = [
+        child.tag for child in parent
+        if is_lxml_tag(node=child) and child not in skipped
+    ]
+    yield from get_children_pos_xpaths(
+        names=names,
+        parent_xpaths=parent_xpaths,
+        tag_list_to_filter_out=tag_list_to_filter_out
+    )
+
+
+def iter_bs4_pos_xpaths(
+    soup: "bs4.BeautifulSoup",
+    tag_list_to_filter_out: Collection[str] = (),
+    filtered_out: Optional[list["bs4.Tag"]] = None
+        ) -> Iterator[tuple[str, "bs4.Tag"]]:
+    """Yield (pos_xpath, element) for every element in document order.
+
+    Equivalent to calling get_pos_xpath_from_bs4_elem on each element of
+    ``soup.find_all(name=True)``, in one depth-first walk. Elements whose
+    XPath matches tag_list_to_filter_out are not entered, and are
+    appended to filtered_out if given.
+    """
+    import bs4
+
+    stack: list[tuple[Iterator, Iterator[Optional[ChildPosXPaths]]]] = [
+        (
+            iter(soup.contents),
+            iter_child_pos_xpaths(("", ""), soup, tag_list_to_filter_out)
+        )
+    ]
+    while stack:
+        children, children_xpaths = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+        elif isinstance(child, bs4.Tag):
+            child_xpaths: Optional[ChildPosXPaths] = next(children_xpaths)
+            if child_xpaths is None:
+                if filtered_out is not None:
+                    filtered_out.append(child)
+                continue
+            yield child_xpaths[0], child
+            stack.append(
+                (
+                    iter(child.contents),
+                    iter_child_pos_xpaths(
+                        child_xpaths, child, tag_list_to_filter_out
+                    )
+                )
+            )
+
+
+def format_bs4_tags_with_decode(
+    elem: "bs4.Tag",
+    formatter: Any
+        ) -> tuple[str, str]:
+    # Same tags from public API only: a copy of the element without its
+    # children is serialized, and its closing tag cut off.
+    import bs4
+
+    shell = bs4.Tag(
+        name=elem.name,
+        prefix=elem.prefix,
+        attrs=dict(elem.attrs),
+        can_be_empty_element=elem.can_be_empty_element
+    )
+    decoded: str = shell.decode(formatter=formatter)
+    if shell.is_empty_element:
+        return decoded, ""
+    prefix: str = f"{elem.prefix}:" if elem.prefix else ""
+    close_tag: str = f"</{prefix}{elem.name}>"
+    return decoded[:-len(close_tag)], close_tag
+
+
+def format_bs4_tags(elem: "bs4.Tag", formatter: Any) -> tuple[str, str]:
+    """Opening and closing tags of elem as bs4 serializes them ("" for
+    the closing tag of a void element)."""
+    # Tag._format_tag is private: it is only used while it still has
+    # the signature it has had since bs4 4.0.
+    try:
+        open_tag: str = elem._format_tag("utf-8", formatter, opening=True)
+        if elem.is_empty_element:
+            return open_tag, ""
+        return (
+            open_tag,
+            elem._format_tag("utf-8", formatter, opening=False)
+        )
+    except (AttributeError, TypeError):
+        return format_bs4_tags_with_decode(elem=elem, formatter=formatter)
+
+
+@attrs.define()
+class MeasuredTree:
+    # Aligned lists, in document order:
+    pos_xpaths: list[str] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+    elements: list[Any] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+    # Index of the parent element, -1 for top-level elements.
+    parents: list[int] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+    text_lengths: list[int] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+    html_lengths: list[int] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+    # Only filled in when measured with a token counter.
+    token_lengths: list[int] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+    # Top-most elements left out by tag_list_to_filter_out. They are
+    # not part of any length and still have to be removed from the tree.
+    filtered_out: list[Any] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+    # Text of the document and the span of every element in it,
+    # NO_TEXT_SPAN for the elements without one.
+    text: Optional[str] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+    text_starts: list[int] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+    text_ends: list[int] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+
+    def add_element(self, pos_xpath: str, elem: Any, parent: int) -> int:
+        self.pos_xpaths.append(pos_xpath)
+        self.elements.append(elem)
+        self.parents.append(parent)
+        self.text_lengths.append(0)
+        self.html_lengths.append(0)
+        self.token_lengths.append(0)
+        self.text_starts.append(NO_TEXT_SPAN)
+        self.text_ends.append(NO_TEXT_SPAN)
+        return len(self.elements) - 1
+
+    def set_measures(
+        self,
+        frame: _TagFrame,
+        html_serialization: HtmlSerialization
+            ) -> None:
+        # Once the frame is closed.
+        self.text_lengths[frame.idx] = frame.get_text_length()
+        self.html_lengths[frame.idx] = frame.get_html_length(
+            html_serialization=html_serialization
+        )
+        self.token_lengths[frame.idx] = frame.token_length
+        text_span: Optional[TextSpanT] = frame.get_text_span()
+        if text_span is not None:
+            self.text_starts[frame.idx], self.text_ends[frame.idx] =\
+                text_span
+
+
+def measure_bs4_tree(
+    soup: "bs4.BeautifulSoup",
+    formatter: str = "minimal",
+    tag_list_to_filter_out: Collection[str] = (),
+    token_counter: Optional[TokenCounter] = None,
+    html_serialization: HtmlSerialization = HtmlSerialization.PRETTIFIED
+        ) -> MeasuredTree:
+    """Measure every element under soup in one depth-first traversal.
+
+    Positional XPaths are assigned on the way down, lengths are summed on
+    the way up. Returns the XPaths and elements in document order (the
+    order of ``soup.find_all(name=True, recursive=True)``) and, aligned
+    with them, their text lengths and html lengths (as serialized with
+    html_serialization).
+
+    Subtrees whose XPath matches tag_list_to_filter_out are neither
+    entered nor counted, as if they had been decomposed beforehand.
+
+    With token_counter, token lengths are measured as well.
+    """
+    import bs4
+
+    formatter = soup.formatter_for_name(formatter)
+    indent_width: int = len(formatter.indent)
+
+    measured = MeasuredTree()
+    text_buffer = _TextBuffer()
+
+    # Stack of (frame, children iterator, children xpaths iterator).
+    # The soup itself is not an element and only acts as the root of
+    # the traversal.
+    stack: list[
+        tuple[_TagFrame | None, Iterator, Iterator[Optional[ChildPosXPaths]]]
+    ] = [
+        (
+            None,
+            iter(soup.contents),
+            iter_child_pos_xpaths(("", ""), soup, tag_list_to_filter_out)
+        )
+    ]
+    while stack:
+        frame, children, children_xpaths = stack[-1]
+        child = next(children, None)
+
+        if child is None:
+            stack.pop()
+            if frame is None:
+                continue
+            frame.close()
+            measured.set_measures(
+                frame=frame, html_serialization=html_serialization
+            )
+            parent_frame = stack[-1][0]
+            if parent_frame is not None:
+                parent_frame.add_child(
+                    child=frame, indent_width=indent_width
+                )
+            # The frame is no longer needed.
+            frame.elem = None
+        elif isinstance(child, bs4.Tag):
+            child_xpaths: Optional[ChildPosXPaths] = next(children_xpaths)
+            if child_xpaths is None:
+                # The strings around it are left pending, so that they
+                # are joined as they would be once it is removed.
+                measured.filtered_out.append(child)
+                continue
+            in_pre: bool = False
+            in_excluded: bool = False
+            if frame is not None:
+                frame.flush_text()
+                in_pre, in_excluded = frame.in_pre, frame.in_excluded
+            open_tag, close_tag = format_bs4_tags(
+                elem=child, formatter=formatter
+            )
+            child_frame = _TagFrame(
+                elem=child,
+                name=child.name,
+                idx=measured.add_element(
+                    pos_xpath=child_xpaths[0],
+                    elem=child,
+                    parent=frame.idx if frame is not None else -1
+                ),
+                in_pre=in_pre,
+                open_tag=open_tag,
+                close_tag=close_tag,
+                is_void=child.is_empty_element,
+                token_counter=token_counter,
+                in_excluded=in_excluded,
+                text_buffer=text_buffer
+            )
+            stack.append(
+                (
+                    child_frame,
+                    iter(child.contents),
+                    iter_child_pos_xpaths(
+                        child_xpaths, child, tag_list_to_filter_out
+                    )
+                )
+            )
+        elif frame is not None:
+            frame.add_string(
+                output=child.output_ready(formatter),
+                text=None if isinstance(
+                    child, bs4.element.PreformattedString) else child,
+                indent_width=indent_width
+            )
+
+    measured.text = text_buffer.getvalue()
+    return measured
+
+
+def measure_lxml_tree(
+    root: Optional[lxml.html.HtmlElement],
+    skipped: Collection = (),
+    indent_width: int = 1,
+    tag_list_to_filter_out: Collection[str] = (),
+    token_counter: Optional[TokenCounter] = None,
+    html_serialization: HtmlSerialization = HtmlSerialization.PRETTIFIED
+        ) -> MeasuredTree:
+    """Same as measure_bs4_tree, for an lxml.html document root.
+
+    Elements in skipped are left out with their subtree (their tail is
+    kept), as if they had been removed from the tree. Filtered out
+    elements are handled the same way.
+    """
+    measured = MeasuredTree()
+
+    if root is None or root in skipped:
+        return measured
+    # A document holding only a comment has it for root: its text is
+    # left to parsel_text.
+    text_buffer: Optional[_TextBuffer] = _TextBuffer()\
+        if is_lxml_tag(node=root) else None
+
+    root_xpaths: ChildPosXPaths = (f"/{root.tag}", f"/{root.tag}")
+    if not wanted_xpath(
+            xpath=root_xpaths[1],
+            tag_list_to_filter_out=tag_list_to_filter_out):
+        measured.filtered_out.append(root)
+        return measured
+
+    def open_frame(
+        elem,
+        pos_xpath: str,
+        parent: int,
+        in_pre: bool,
+        in_excluded: bool
+            ) -> _TagFrame:
+        frame = _TagFrame(
+            elem=elem,
+            name=elem.tag,
+            idx=measured.add_element(
+                pos_xpath=pos_xpath, elem=elem, parent=parent
+            ),
+            in_pre=in_pre,
+            open_tag=format_lxml_open_tag(elem=elem),
+            close_tag=format_lxml_close_tag(elem=elem),
+            is_void=is_void_lxml_elem(elem=elem),
+            token_counter=token_counter,
+            in_excluded=in_excluded,
+            text_buffer=text_buffer
+        )
+        if elem.text:
+            frame.add_string(
+                output=format_lxml_text(text=elem.text, parent_tag=elem.tag),
+                text=elem.text,
+                indent_width=indent_width
+            )
+        return frame
+
+    def add_tail(frame: _TagFrame, node) -> None:
+        if node.tail:
+            frame.add_string(
+                output=format_lxml_text(
+                    text=node.tail, parent_tag=frame.elem.tag
+                ),
+                text=node.tail,
+                indent_width=indent_width
+            )
+
+    stack: list[
+        tuple[_TagFrame, Iterator, Iterator[Optional[ChildPosXPaths]]]
+    ] = [
+        (
+            open_frame(
+                elem=root,
+                pos_xpath=root_xpaths[0],
+                parent=-1,
+                in_pre=False,
+                in_excluded=False
+            ),
+            iter(root),
+            iter_lxml_child_pos_xpaths(
+                root_xpaths, root, skipped, tag_list_to_filter_out
+            )
+        )
+    ]
+    while stack:
+        frame, children, children_xpaths = stack[-1]
+        child = next(children, None)
+
+        if child is None:
+            stack.pop()
+            frame.close()
+            measured.set_measures(
+                frame=frame, html_serialization=html_serialization
+            )
+            if stack:
+                parent_frame: _TagFrame = stack[-1][0]
+                parent_frame.add_child(
+                    child=frame, indent_width=indent_width
+                )
+                add_tail(frame=parent_frame, node=frame.elem)
+            frame.elem = None
+        elif child in skipped:
+            add_tail(frame=frame, node=child)
+        elif is_lxml_tag(node=child):
+            child_xpaths: Optional[ChildPosXPaths] = next(children_xpaths)
+            if child_xpaths is None:
+                measured.filtered_out.append(child)
+                add_tail(frame=frame, node=child)
+                continue
+            frame.flush_text()
+            stack.append(
+                (
+                    open_frame(
+                        elem=child,
+                        pos_xpath=child_xpaths[0],
+                        parent=frame.idx,
+                        in_pre=frame.in_pre,
+                        in_excluded=frame.in_excluded
+                    ),
+                    iter(child),
+                    iter_lxml_child_pos_xpaths(
+                        child_xpaths, child, skipped, tag_list_to_filter_out
+                    )
+                )
+            )
+        else:
+            frame.add_string(
+                output=format_lxml_special_node(node=child),
+                text=None,
+                indent_width=indent_width
+            )
+            add_tail(frame=frame, node=child)
+
+    if text_buffer is not None:
+        measured.text = text_buffer.getvalue()
+    return measured
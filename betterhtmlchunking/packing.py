@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import array
+
+import attrs
+
+import bisect
+
+import functools
+
+import itertools
+
+from attrs_strict import type_validator
+
+from types import ModuleType
+
+from typing import Optional
+
+
+################################
+#                              #
+#   --- Children packing ---   #
+#                              #
+################################
+
+# How ROIMaker groups the children of a node, from their lengths alone.
+# Children at or above the maximum length are sent deeper and close the
+# region being filled. The others are packed, in order, into regions
+# that close as soon as they reach the maximum length. What is left at
+# the end of the children goes into the last region, if there is one.
+#
+# With the prefix sums of the lengths, each region ends at the first
+# sum reaching its start sum plus the maximum: one binary search per
+# region instead of one step per child. Lengths and sums are gathered
+# with NumPy when it is installed and the node has enough children.
+
+# Below this many children NumPy costs more than it saves.
+NUMPY_MIN_CHILDREN: int = 256
+
+
+@functools.cache
+def get_numpy() -> Optional[ModuleType]:
+    # Imported with the first node that has enough children.
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+# Children [start, end) of a region, in the order of the children.
+SpanT = tuple[int, int]
+
+
+@attrs.define()
+class ChildrenPacking:
+    # Region spans and lengths. A region closed by a child sent deeper
+    # can be empty, the last one can have two spans (hanging children).
+    regions: list[list[SpanT]] = attrs.field(
+        validator=attrs.validators.instance_of(list)
+    )
+    repr_lengths: list[int] = attrs.field(
+        validator=attrs.validators.instance_of(list)
+    )
+    # Indices of the children sent deeper.
+    children_to_enqueue: list[int] = attrs.field(
+        validator=attrs.validators.instance_of(list)
+    )
+    # Steps of the former per-child state machine (one per child, per
+    # region and at the end), kept for the stats.
+    steps: int = attrs.field(
+        validator=type_validator()
+    )
+
+    def get_span_count(self, region_idx: int) -> int:
+        return sum(end - start for start, end in self.regions[region_idx])
+
+
+def get_prefix_sums(
+    repr_lengths: array.array,
+    children_ids: list[int],
+    max_node_repr_length: int
+        ) -> tuple[list[int], list[int]]:
+    """Prefix sums of the children lengths and the children to enqueue."""
+    numpy: Optional[ModuleType] = None
+    if len(children_ids) >= NUMPY_MIN_CHILDREN:
+        numpy = get_numpy()
+    if numpy is not None:
+        children_lengths = numpy.frombuffer(
+            repr_lengths, dtype=repr_lengths.typecode
+        )[children_ids]
+        prefix_sums = numpy.zeros(
+            len(children_lengths) + 1, dtype=children_lengths.dtype
+        )
+        numpy.cumsum(children_lengths, out=prefix_sums[1:])
+        return (
+            prefix_sums.tolist(),
+            numpy.flatnonzero(
+                children_lengths >= max_node_repr_length
+            ).tolist()
+        )
+
+    lengths: list[int] = [repr_lengths[child_id] for child_id in children_ids]
+    return (
+        list(itertools.accumulate(lengths, initial=0)),
+        [
+            child_idx for child_idx, length in enumerate(lengths)
+            if length >= max_node_repr_length
+        ]
+    )
+
+
+def pack_children(
+    repr_lengths: array.array,
+    children_ids: list[int],
+    max_node_repr_length: int
+        ) -> ChildrenPacking:
+    prefix_sums, children_to_enqueue = get_prefix_sums(
+        repr_lengths=repr_lengths,
+        children_ids=children_ids,
+        max_node_repr_length=max_node_repr_length
+    )
+    children_count: int = len(children_ids)
+    regions: list[list[SpanT]] = []
+    region_lengths: list[int] = []
+
+    start: int = 0
+    # Runs of packed children end at each enqueued child, the last one
+    # at the end of the children.
+    for end in itertools.chain(children_to_enqueue, [children_count]):
+        while start < end:
+            # The region holds at least the child at start.
+            stop: int = bisect.bisect_left(
+                prefix_sums,
+                prefix_sums[start] + max_node_repr_length,
+                start + 1
+            )
+            if stop > end:
+                break
+            regions.append([(start, stop)])
+            region_lengths.append(prefix_sums[stop] - prefix_sums[start])
+            start = stop
+        if end == children_count:
+            break
+        regions.append([(start, end)])
+        region_lengths.append(prefix_sums[end] - prefix_sums[start])
+        start = end + 1
+
+    steps: int = children_count + len(regions) + 1
+
+    hanging_length: int = prefix_sums[children_count] - prefix_sums[start]
+    if hanging_length > 0 and regions:
+        last_start, last_end = regions[-1][-1]
+        if last_start == last_end:
+            regions[-1] = [(start, children_count)]
+        elif last_end == start:
+            regions[-1][-1] = (last_start, children_count)
+        else:
+            regions[-1].append((start, children_count))
+        region_lengths[-1] += hanging_length
+
+    return ChildrenPacking(
+        regions=regions,
+        repr_lengths=region_lengths,
+        children_to_enqueue=children_to_enqueue,
+        steps=steps
+    )
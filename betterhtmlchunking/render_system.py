@@ -4,7 +4,9 @@ import attrs
 
 from attrs_strict import type_validator
 
-import parsel_text
+from collections import OrderedDict
+
+from collections.abc import Mapping
 
 from betterhtmlchunking.tree_representation import\
     DOMTreeRepresentation
@@ -12,10 +14,180 @@ from betterhtmlchunking.tree_representation import\
 from betterhtmlchunking.tree_regions_system import\
     TreeRegionsSystem
 
+from betterhtmlchunking.source_spans import SourceSpanT
+
+from betterhtmlchunking.stats import StatsRecorder
+from betterhtmlchunking.stats import RENDERED_CHUNKS_COUNTER
+from betterhtmlchunking.stats import REUSED_NODE_RENDERS_COUNTER
+
+from enum import StrEnum
+
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+
 
 RegionOfInterestRenderT = dict[int, str]
 
 
+class RenderMode(StrEnum):
+    # Every chunk is rendered up front.
+    EAGER: str = "eager"
+    # Chunks are rendered on first access, see LazyRenderMapping.
+    LAZY: str = "lazy"
+
+
+class ChunkKind(StrEnum):
+    TEXT: str = "text"
+    HTML: str = "html"
+
+
+def make_chunk_kinds(kinds: Iterable[str] | str) -> tuple[ChunkKind, ...]:
+    # ChunkKind values or their names ("html", "text"), or a single one.
+    if isinstance(kinds, str):
+        kinds = (kinds,)
+    return tuple(ChunkKind(kind) for kind in kinds)
+
+
+def get_node_render_function(
+    tree_representation: DOMTreeRepresentation,
+    kind: ChunkKind
+        ) -> Callable[..., str]:
+    match kind:
+        case ChunkKind.HTML:
+            return tree_representation.render_node_html
+        case ChunkKind.TEXT:
+            return tree_representation.render_node_text
+
+
+DEFAULT_NODE_RENDER_CACHE_SIZE: int = 4096
+
+
+@attrs.define(eq=False)
+class NodeRenderCache:
+    """Renders of single nodes, shared by the RenderSystems of one tree.
+
+    Used when a tree is chunked at several maximum lengths (see
+    DomRepresentation.start_budgets): a node found in the regions of
+    more than one of them is rendered once while it is cached. At most
+    cache_size renders are kept (least recently used ones are dropped
+    first). None keeps them all, every rendered subtree of the document.
+    """
+    tree_representation: DOMTreeRepresentation = attrs.field(
+        validator=type_validator()
+    )
+    cache_size: Optional[int] = attrs.field(
+        validator=type_validator(),
+        default=DEFAULT_NODE_RENDER_CACHE_SIZE
+    )
+    renders: OrderedDict[tuple[ChunkKind, str], str] = attrs.field(
+        validator=attrs.validators.instance_of(OrderedDict),
+        init=False,
+        factory=OrderedDict,
+        repr=False
+    )
+    hits: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+    evictions: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+
+    def render_node(self, pos_xpath: str, kind: ChunkKind) -> str:
+        render: Optional[str] = self.renders.get((kind, pos_xpath))
+        if render is not None:
+            self.renders.move_to_end((kind, pos_xpath))
+            self.hits += 1
+            return render
+        render = get_node_render_function(
+            tree_representation=self.tree_representation,
+            kind=kind
+        )(pos_xpath=pos_xpath)
+        if self.cache_size is None or self.cache_size > 0:
+            self.renders[(kind, pos_xpath)] = render
+            if self.cache_size is not None and\
+                    len(self.renders) > self.cache_size:
+                self.renders.popitem(last=False)
+                self.evictions += 1
+        return render
+
+
+def render_pos_xpath_list(
+    tree_representation: DOMTreeRepresentation,
+    pos_xpath_list: list[str],
+    kind: ChunkKind,
+    node_render_cache: Optional[NodeRenderCache] = None
+        ) -> str:
+    if node_render_cache is not None:
+        return "\n".join(
+            node_render_cache.render_node(pos_xpath=pos_xpath, kind=kind)
+            for pos_xpath in pos_xpath_list
+        )
+
+    render_node = get_node_render_function(
+        tree_representation=tree_representation,
+        kind=kind
+    )
+    return "\n".join(
+        render_node(pos_xpath=pos_xpath) for pos_xpath in pos_xpath_list
+    )
+
+
+@attrs.define(eq=False)
+class LazyRenderMapping(Mapping):
+    """Read-only mapping of roi_idx -> render, computed on first access.
+
+    At most cache_size renders are kept (least recently used ones are
+    dropped first and rendered again if asked for). None keeps them all.
+    """
+    render_function: Callable[[int], Any] = attrs.field(
+        validator=type_validator()
+    )
+    roi_indices: Mapping[int, Any] = attrs.field(
+        validator=attrs.validators.instance_of(Mapping)
+    )
+    cache_size: Optional[int] = attrs.field(
+        validator=type_validator(),
+        default=128
+    )
+    cache: OrderedDict = attrs.field(
+        validator=attrs.validators.instance_of(OrderedDict),
+        init=False,
+        factory=OrderedDict
+    )
+
+    def __getitem__(self, roi_idx: int) -> Any:
+        if roi_idx in self.cache:
+            self.cache.move_to_end(roi_idx)
+            return self.cache[roi_idx]
+        if roi_idx not in self.roi_indices:
+            raise KeyError(roi_idx)
+
+        render: Any = self.render_function(roi_idx)
+        if self.cache_size is None or self.cache_size > 0:
+            self.cache[roi_idx] = render
+            if self.cache_size is not None and\
+                    len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return render
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.roi_indices)
+
+    def __len__(self) -> int:
+        return len(self.roi_indices)
+
+    def __contains__(self, roi_idx: object) -> bool:
+        # Without rendering.
+        return roi_idx in self.roi_indices
+
+
 @attrs.define()
 class RenderSystem:
     tree_regions_system: TreeRegionsSystem = attrs.field(
@@ -24,25 +196,55 @@ class RenderSystem:
     tree_representation: DOMTreeRepresentation = attrs.field(
         validator=type_validator()
     )
+    render_mode: RenderMode = attrs.field(
+        validator=type_validator(),
+        default=RenderMode.EAGER
+    )
+    # Rendered up front with RenderMode.EAGER, the mappings of the other
+    # kinds are left empty. Lazy mappings render any kind asked for.
+    kinds: tuple[ChunkKind, ...] = attrs.field(
+        validator=type_validator(),
+        converter=make_chunk_kinds,
+        default=(ChunkKind.HTML, ChunkKind.TEXT)
+    )
+    # Renders kept by each lazy mapping (RenderMode.LAZY only).
+    cache_size: Optional[int] = attrs.field(
+        validator=type_validator(),
+        default=128
+    )
+    stats_recorder: Optional[StatsRecorder] = attrs.field(
+        validator=type_validator(),
+        default=None,
+        repr=False
+    )
+    # Shared with the RenderSystems of other maximum lengths.
+    node_render_cache: Optional[NodeRenderCache] = attrs.field(
+        validator=type_validator(),
+        default=None,
+        repr=False
+    )
 
-    html_render_with_pos_xpath: dict[int, RegionOfInterestRenderT] =\
+    # dict with RenderMode.EAGER, LazyRenderMapping with RenderMode.LAZY.
+    # Only the mapping type is validated, a lazy mapping would otherwise
+    # render everything.
+    html_render_with_pos_xpath: Mapping[int, RegionOfInterestRenderT] =\
         attrs.field(
-            validator=type_validator(),
+            validator=attrs.validators.instance_of(Mapping),
             init=False
         )
-    text_render_with_pos_xpath: dict[int, RegionOfInterestRenderT] =\
+    text_render_with_pos_xpath: Mapping[int, RegionOfInterestRenderT] =\
         attrs.field(
-            validator=type_validator(),
+            validator=attrs.validators.instance_of(Mapping),
             init=False
         )
 
     # Render of the regions of interest, each one of them full:
-    html_render_roi: dict[int, str] = attrs.field(
-        validator=type_validator(),
+    html_render_roi: Mapping[int, str] = attrs.field(
+        validator=attrs.validators.instance_of(Mapping),
         init=False
     )
-    text_render_roi: dict[int, str] = attrs.field(
-        validator=type_validator(),
+    text_render_roi: Mapping[int, str] = attrs.field(
+        validator=attrs.validators.instance_of(Mapping),
         init=False
     )
 
@@ -56,6 +258,112 @@ class RenderSystem:
             self.html_render_with_pos_xpath[roi_idx].values()
         )
 
+    def get_roi_pos_xpath_list(self, roi_idx: int) -> list[str]:
+        return self.tree_regions_system.sorted_roi_by_pos_xpath[
+            roi_idx].pos_xpath_list
+
+    def get_roi_source_spans(self, roi_idx: int) -> dict[str, SourceSpanT]:
+        """Where the nodes of a region are in the input, by pos_xpath."""
+        return {
+            pos_xpath: self.tree_representation.get_node_source_span(
+                pos_xpath=pos_xpath
+            )
+            for pos_xpath in self.get_roi_pos_xpath_list(roi_idx=roi_idx)
+        }
+
+    def get_roi_sources(self, roi_idx: int) -> dict[str, Any]:
+        """The input of the nodes of a region, by pos_xpath, as views."""
+        return {
+            pos_xpath: self.tree_representation.get_node_source(
+                pos_xpath=pos_xpath
+            )
+            for pos_xpath in self.get_roi_pos_xpath_list(roi_idx=roi_idx)
+        }
+
+    def render_node(self, pos_xpath: str, kind: ChunkKind) -> str:
+        if self.node_render_cache is None:
+            return get_node_render_function(
+                tree_representation=self.tree_representation,
+                kind=kind
+            )(pos_xpath=pos_xpath)
+
+        hits: int = self.node_render_cache.hits
+        render: str = self.node_render_cache.render_node(
+            pos_xpath=pos_xpath, kind=kind
+        )
+        if self.stats_recorder is not None:
+            self.stats_recorder.count(
+                name=REUSED_NODE_RENDERS_COUNTER,
+                value=self.node_render_cache.hits - hits
+            )
+        return render
+
+    def render_roi_html_with_pos_xpath(
+        self,
+        roi_idx: int
+            ) -> RegionOfInterestRenderT:
+        return {
+            pos_xpath: self.render_node(
+                pos_xpath=pos_xpath, kind=ChunkKind.HTML
+            )
+            for pos_xpath in self.get_roi_pos_xpath_list(roi_idx=roi_idx)
+        }
+
+    def render_roi_text_with_pos_xpath(
+        self,
+        roi_idx: int
+            ) -> RegionOfInterestRenderT:
+        return {
+            pos_xpath: self.render_node(
+                pos_xpath=pos_xpath, kind=ChunkKind.TEXT
+            )
+            for pos_xpath in self.get_roi_pos_xpath_list(roi_idx=roi_idx)
+        }
+
+    def count_rendered_chunk(self) -> None:
+        if self.stats_recorder is not None:
+            self.stats_recorder.count(name=RENDERED_CHUNKS_COUNTER)
+
+    def render_roi_html(self, roi_idx: int) -> str:
+        self.count_rendered_chunk()
+        return "\n".join(
+            self.render_node(pos_xpath=pos_xpath, kind=ChunkKind.HTML)
+            for pos_xpath in self.get_roi_pos_xpath_list(roi_idx=roi_idx)
+        )
+
+    def render_roi_text(self, roi_idx: int) -> str:
+        self.count_rendered_chunk()
+        return "\n".join(
+            self.render_node(pos_xpath=pos_xpath, kind=ChunkKind.TEXT)
+            for pos_xpath in self.get_roi_pos_xpath_list(roi_idx=roi_idx)
+        )
+
+    def make_lazy_render_mapping(
+        self,
+        render_function: Callable[[int], Any]
+            ) -> LazyRenderMapping:
+        return LazyRenderMapping(
+            render_function=render_function,
+            roi_indices=self.tree_regions_system.sorted_roi_by_pos_xpath,
+            cache_size=self.cache_size
+        )
+
+    def render_lazy(self) -> None:
+        # HTML and text are independent: text-only callers never
+        # prettify anything.
+        self.html_render_with_pos_xpath = self.make_lazy_render_mapping(
+            render_function=self.render_roi_html_with_pos_xpath
+        )
+        self.text_render_with_pos_xpath = self.make_lazy_render_mapping(
+            render_function=self.render_roi_text_with_pos_xpath
+        )
+        self.html_render_roi = self.make_lazy_render_mapping(
+            render_function=self.render_roi_html
+        )
+        self.text_render_roi = self.make_lazy_render_mapping(
+            render_function=self.render_roi_text
+        )
+
     def render(self) -> None:
         self.html_render_with_pos_xpath: dict[
             int, RegionOfInterestRenderT] = {}
@@ -70,8 +378,10 @@ class RenderSystem:
         # Execute the function:
         for roi_idx, roi in\
                 self.tree_regions_system.sorted_roi_by_pos_xpath.items():
-            self.html_render_with_pos_xpath[roi_idx] = {}
-            self.text_render_with_pos_xpath[roi_idx] = {}
+            if ChunkKind.HTML in self.kinds:
+                self.html_render_with_pos_xpath[roi_idx] = {}
+            if ChunkKind.TEXT in self.kinds:
+                self.text_render_with_pos_xpath[roi_idx] = {}
 
             # print("*" * 50)
             # print(roi.pos_xpath_list)
@@ -80,36 +390,37 @@ class RenderSystem:
                 # print(pos_xpath)
 
                 # HTML render:
-                prettified_pos_xpath_html: str =\
-                    self.tree_regions_system.tree_representation.xpaths_metadata[
-                        pos_xpath].bs4_elem.prettify(
-                            formatter="minimal"
+                if ChunkKind.HTML in self.kinds:
+                    self.html_render_with_pos_xpath[
+                        roi_idx][pos_xpath] = self.render_node(
+                            pos_xpath=pos_xpath, kind=ChunkKind.HTML
                         )
-                # print(prettified_pos_xpath_html)
 
                 # Text render:
-                pos_xpath_text: str =\
-                    parsel_text.get_bs4_soup_text(
-                        bs4_soup=self.tree_regions_system.tree_representation.xpaths_metadata[
-                            pos_xpath
-                        ].bs4_elem
-                    )
-
-                self.html_render_with_pos_xpath[
-                    roi_idx][pos_xpath] = prettified_pos_xpath_html
-                self.text_render_with_pos_xpath[
-                    roi_idx][pos_xpath] = pos_xpath_text
+                if ChunkKind.TEXT in self.kinds:
+                    self.text_render_with_pos_xpath[
+                        roi_idx][pos_xpath] = self.render_node(
+                            pos_xpath=pos_xpath, kind=ChunkKind.TEXT
+                        )
 
                 region_of_interest_idx += 1
 
-            self.html_render_roi[roi_idx] =\
-                self.get_roi_html_render_with_pos_xpath(
-                    roi_idx=roi_idx
-                )
-            self.text_render_roi[roi_idx] =\
-                self.get_roi_text_render_with_pos_xpath(
-                    roi_idx=roi_idx
-                )
+            if ChunkKind.HTML in self.kinds:
+                self.html_render_roi[roi_idx] =\
+                    self.get_roi_html_render_with_pos_xpath(
+                        roi_idx=roi_idx
+                    )
+                self.count_rendered_chunk()
+            if ChunkKind.TEXT in self.kinds:
+                self.text_render_roi[roi_idx] =\
+                    self.get_roi_text_render_with_pos_xpath(
+                        roi_idx=roi_idx
+                    )
+                self.count_rendered_chunk()
 
     def __attrs_post_init__(self):
-        self.render()
+        match self.render_mode:
+            case RenderMode.EAGER:
+                self.render()
+            case RenderMode.LAZY:
+                self.render_lazy()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+import abc
+
+import attrs
+
+from attrs_strict import type_validator
+
+import functools
+
+import hashlib
+
+import json
+
+import sqlite3
+
+import time
+
+from collections import OrderedDict
+
+from pathlib import Path
+
+from typing import Any
+from typing import Optional
+
+
+#############################
+#                           #
+#   --- Result caches ---   #
+#                           #
+#############################
+
+# Chunking results keyed by a hash of the HTML, the chunking parameters
+# and the library version. Values are JSON documents: a cache hit needs
+# no parsing at all.
+
+DEFAULT_MAX_BYTES: int = 256 * 1024 ** 2
+
+
+@functools.cache
+def get_library_version() -> str:
+    from importlib import metadata
+
+    try:
+        return metadata.version("betterhtmlchunking")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def make_cache_key(website_code: Any, parameters: list[Any]) -> str:
+    """sha256 of the library version, parameters (JSON) and HTML.
+
+    Text is hashed as UTF-8, bytes (or a memory map) as they are, under
+    other keys: the parser decodes them, not always as UTF-8.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(
+        json.dumps([get_library_version(), parameters]).encode("utf-8")
+    )
+    if isinstance(website_code, str):
+        hasher.update(b"\0")
+        hasher.update(website_code.encode("utf-8", errors="surrogatepass"))
+    else:
+        hasher.update(b"\1")
+        hasher.update(website_code)
+    return hasher.hexdigest()
+
+
+@attrs.define()
+class ResultCache(abc.ABC):
+    # Stored values (serialized) are evicted least recently used first
+    # beyond this size; None for no bound.
+    max_bytes: Optional[int] = attrs.field(
+        validator=type_validator(),
+        default=DEFAULT_MAX_BYTES
+    )
+    hits: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+    misses: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+    evictions: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+
+    def get(self, key: str) -> Optional[Any]:
+        data: Optional[str] = self.load(key=key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(data)
+
+    def put(self, key: str, value: Any) -> None:
+        data: str = json.dumps(value, ensure_ascii=False)
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            return None
+        self.store(key=key, data=data)
+        return None
+
+    @abc.abstractmethod
+    def load(self, key: str) -> Optional[str]:
+        pass
+
+    @abc.abstractmethod
+    def store(self, key: str, data: str) -> None:
+        pass
+
+
+@attrs.define()
+class MemoryResultCache(ResultCache):
+    entries: OrderedDict[str, str] = attrs.field(
+        validator=attrs.validators.instance_of(OrderedDict),
+        init=False,
+        factory=OrderedDict,
+        repr=False
+    )
+    total_bytes: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+
+    def load(self, key: str) -> Optional[str]:
+        data: Optional[str] = self.entries.get(key)
+        if data is not None:
+            self.entries.move_to_end(key)
+        return data
+
+    def store(self, key: str, data: str) -> None:
+        previous: Optional[str] = self.entries.pop(key, None)
+        if previous is not None:
+            self.total_bytes -= len(previous)
+        self.entries[key] = data
+        self.total_bytes += len(data)
+        while self.max_bytes is not None\
+                and self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= len(evicted)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+@attrs.define()
+class SQLiteResultCache(ResultCache):
+    """On-disk cache, shareable between processes and runs."""
+    path: Path = attrs.field(
+        validator=type_validator(),
+        converter=Path,
+        kw_only=True
+    )
+    connection: sqlite3.Connection = attrs.field(
+        validator=type_validator(),
+        init=False,
+        repr=False
+    )
+
+    def __attrs_post_init__(self):
+        self.connection = sqlite3.connect(self.path, timeout=30.0)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS results_last_access "
+                "ON results (last_access)"
+            )
+            # Running total of results.size, kept in the same
+            # transactions as the rows.
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_size ("
+                "total_bytes INTEGER NOT NULL)"
+            )
+            self.connection.execute(
+                "INSERT INTO cache_size "
+                "SELECT COALESCE(SUM(size), 0) FROM results "
+                "WHERE NOT EXISTS (SELECT 1 FROM cache_size)"
+            )
+
+    def load(self, key: str) -> Optional[str]:
+        row: Optional[tuple] = self.connection.execute(
+            "SELECT data FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        with self.connection:
+            self.connection.execute(
+                "UPDATE results SET last_access = ? WHERE key = ?",
+                (time.time(), key)
+            )
+        return row[0]
+
+    def store(self, key: str, data: str) -> None:
+        with self.connection:
+            row: Optional[tuple] = self.connection.execute(
+                "SELECT size FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time())
+            )
+            self.add_total_bytes(
+                size=len(data) - (0 if row is None else row[0])
+            )
+            if self.max_bytes is not None:
+                self.evict(max_bytes=self.max_bytes)
+
+    def evict(self, max_bytes: int) -> None:
+        total_bytes: int = self.get_total_bytes()
+        while total_bytes > max_bytes:
+            rows: list[tuple[str, int]] = self.connection.execute(
+                "SELECT key, size FROM results "
+                "ORDER BY last_access LIMIT 64"
+            ).fetchall()
+            for key, size in rows:
+                if total_bytes <= max_bytes:
+                    break
+                self.connection.execute(
+                    "DELETE FROM results WHERE key = ?", (key,)
+                )
+                self.add_total_bytes(size=-size)
+                total_bytes -= size
+                self.evictions += 1
+
+    def add_total_bytes(self, size: int) -> None:
+        self.connection.execute(
+            "UPDATE cache_size SET total_bytes = total_bytes + ?", (size,)
+        )
+
+    def get_total_bytes(self) -> int:
+        return self.connection.execute(
+            "SELECT total_bytes FROM cache_size"
+        ).fetchone()[0]
+
+    def __len__(self) -> int:
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM results"
+        ).fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
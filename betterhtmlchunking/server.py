@@ -0,0 +1,619 @@
+#!/usr/bin/env python3
+
+import attrs
+
+from attrs_strict import type_validator
+
+import http.server
+
+import json
+
+import math
+
+import multiprocessing
+
+import errno
+
+import queue
+
+import signal
+
+import socket
+
+import socketserver
+
+import stat
+
+import sys
+
+import threading
+
+import time
+
+from collections import deque
+
+from multiprocessing.connection import Connection
+
+from pathlib import Path
+
+from betterhtmlchunking.batch import ChunkingOptions
+from betterhtmlchunking.batch import DocumentChunks
+from betterhtmlchunking.batch import chunk_document
+
+from typing import Any
+from typing import Optional
+
+
+###############################
+#                             #
+#   --- Chunking server ---   #
+#                             #
+###############################
+
+# A local HTTP server (localhost TCP port or Unix socket) in front of a
+# pool of worker processes that have already imported and run the
+# chunker, so that callers do not pay for interpreter startup.
+#
+#   POST /chunk   {"html": "...", "options": {...}, "timeout": 5, "id": ..}
+#                 -> 200 {"id": .., "chunks": [{"roi_idx", "xpaths",
+#                    "html", "text", "length"}, ...]}
+#                 400 bad request, 413 body too large, 422 the document
+#                 could not be chunked, 503 queue full (Retry-After),
+#                 504 timed out, 500 worker crashed (it is replaced).
+#   GET  /stats   queue depth, counters and latency percentiles.
+#   GET  /health
+#
+# Options are ChunkingOptions fields (the keyword arguments of
+# chunk_many), over the defaults the server was started with. At most
+# workers + queue_size requests are in flight, the next ones are
+# rejected at once. Each worker is a process of its own with a pipe to
+# the server: a request that times out while waiting for a worker just
+# gives up, one that times out while running terminates its worker,
+# which is replaced. Requests running on the other workers go on.
+
+DEFAULT_PORT: int = 8765
+DEFAULT_QUEUE_SIZE: int = 64
+DEFAULT_TIMEOUT: float = 30.0
+MAX_BODY_SIZE: int = 64 * 1024 ** 2
+# Latencies the percentiles are taken over.
+LATENCY_WINDOW: int = 1024
+
+WARM_UP_DOCUMENT: str = (
+    "<html><head><title>Warm up</title></head><body>"
+    "<div><p>Warm up &amp; first call</p><ul><li>one</li><li>two</li></ul>"
+    "</div></body></html>"
+)
+
+# ChunkingOptions fields a request can set, which converts the JSON
+# values. The tokenizer is not here: a callable does not come from JSON.
+OPTION_NAMES: frozenset[str] = frozenset({
+    "max_length",
+    "compared_by",
+    "kinds",
+    "tag_list_to_filter_out",
+    "html_unescape",
+    "metrics_mode",
+    "backend",
+    "html_serialization",
+    "layout_cache",
+})
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class WorkerCrashedError(RuntimeError):
+    pass
+
+
+def make_request_options(
+    default_options: ChunkingOptions,
+    values: Any
+        ) -> ChunkingOptions:
+    """Raises TypeError or ValueError for options that are not valid."""
+    if not isinstance(values, dict):
+        raise TypeError("options must be an object")
+    unknown: list[str] = sorted(set(values) - OPTION_NAMES)
+    if unknown:
+        raise ValueError(f"unknown options: {', '.join(unknown)}")
+    max_length: Any = values.get("max_length", default_options.max_length)
+    if isinstance(max_length, bool) or not isinstance(max_length, int)\
+            or max_length < 1:
+        raise ValueError("max_length must be a positive integer")
+    return attrs.evolve(default_options, **values)
+
+
+def get_percentile(sorted_values: list[float], fraction: float) -> float:
+    # Nearest rank.
+    rank: int = math.ceil(fraction * len(sorted_values))
+    return sorted_values[max(rank - 1, 0)]
+
+
+def warm_up_worker() -> None:
+    # Imports and first-call costs are paid when a worker starts, not
+    # by the first requests it takes.
+    chunk_document(
+        index=0,
+        website_code=WARM_UP_DOCUMENT,
+        options=ChunkingOptions(max_length=64)
+    )
+
+
+def run_worker(connection: Connection) -> None:
+    # Worker process: chunks the documents it is sent until None. The
+    # server stops it, Ctrl-C in the terminal is for the server.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    warm_up_worker()
+    connection.send(None)
+    while True:
+        task: Optional[tuple[str, ChunkingOptions]] = connection.recv()
+        if task is None:
+            return None
+        website_code, options = task
+        connection.send(
+            chunk_document(index=0, website_code=website_code,
+                           options=options)
+        )
+
+
+@attrs.define(eq=False)
+class ChunkingWorker:
+    """A worker process and the pipe it takes its documents from."""
+    process: multiprocessing.Process = attrs.field(
+        validator=attrs.validators.instance_of(multiprocessing.Process)
+    )
+    connection: Connection = attrs.field(
+        validator=attrs.validators.instance_of(Connection),
+        repr=False
+    )
+    # Whether the warm up message was received.
+    warm: bool = attrs.field(
+        validator=type_validator(),
+        default=False
+    )
+
+    @classmethod
+    def start(cls) -> "ChunkingWorker":
+        connection, worker_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=run_worker,
+            kwargs={"connection": worker_connection},
+            daemon=True
+        )
+        process.start()
+        worker_connection.close()
+        return cls(process=process, connection=connection)
+
+    def receive(self, deadline: Optional[float]) -> Any:
+        """Raises TimeoutError, or EOFError once the process is gone.
+
+        Waits for as long as it takes when deadline is None.
+        """
+        timeout: Optional[float] = None if deadline is None else\
+            max(deadline - time.perf_counter(), 0)
+        if not self.connection.poll(timeout):
+            raise TimeoutError("timed out")
+        return self.connection.recv()
+
+    def wait_warm(self, deadline: Optional[float]) -> None:
+        if not self.warm:
+            self.receive(deadline=deadline)
+            self.warm = True
+
+    def chunk(
+        self,
+        website_code: str,
+        options: ChunkingOptions,
+        deadline: float
+            ) -> DocumentChunks:
+        """Raises TimeoutError, or EOFError or OSError if the process
+        died."""
+        self.wait_warm(deadline=deadline)
+        self.connection.send((website_code, options))
+        return self.receive(deadline=deadline)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        # Terminated at once, or asked to exit within timeout first.
+        if timeout is not None:
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+            self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.connection.close()
+
+
+@attrs.define(eq=False)
+class ChunkingService:
+    workers: int = attrs.field(
+        validator=type_validator()
+    )
+    queue_size: int = attrs.field(
+        validator=type_validator(),
+        default=DEFAULT_QUEUE_SIZE
+    )
+    # Seconds, for requests that do not set their own.
+    timeout: float = attrs.field(
+        validator=type_validator(),
+        default=DEFAULT_TIMEOUT
+    )
+    default_options: ChunkingOptions = attrs.field(
+        validator=type_validator(),
+        factory=lambda: ChunkingOptions(max_length=32768)
+    )
+    # Running workers, and those of them waiting for a request.
+    pool: list[ChunkingWorker] = attrs.field(
+        validator=attrs.validators.instance_of(list),
+        init=False,
+        factory=list
+    )
+    idle: queue.SimpleQueue = attrs.field(
+        validator=attrs.validators.instance_of(queue.SimpleQueue),
+        init=False,
+        factory=queue.SimpleQueue
+    )
+    lock: Any = attrs.field(
+        init=False,
+        factory=threading.Lock
+    )
+    # Requests accepted and not answered yet, running or waiting.
+    in_flight: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+    counters: dict[str, int] = attrs.field(
+        validator=type_validator(),
+        init=False,
+        factory=lambda: dict.fromkeys(
+            ("accepted", "rejected", "completed", "failed", "timed_out",
+             "crashed", "restarts", "recycles"),
+            0
+        )
+    )
+    latencies: deque = attrs.field(
+        validator=attrs.validators.instance_of(deque),
+        init=False,
+        factory=lambda: deque(maxlen=LATENCY_WINDOW)
+    )
+    started_at: float = attrs.field(
+        validator=type_validator(),
+        init=False,
+        factory=time.monotonic
+    )
+
+    def __attrs_post_init__(self) -> None:
+        if self.workers < 1:
+            raise ValueError(f"workers must be at least 1, got {self.workers}")
+        if self.queue_size < 0:
+            raise ValueError(
+                f"queue_size must not be negative, got {self.queue_size}"
+            )
+
+    def start(self) -> None:
+        """Start the workers, and return once they are warm."""
+        for _ in range(self.workers):
+            self.add_worker(worker=ChunkingWorker.start())
+        for worker in self.pool:
+            worker.wait_warm(deadline=None)
+
+    def close(self) -> None:
+        with self.lock:
+            pool: list[ChunkingWorker] = self.pool
+            self.pool = []
+        for worker in pool:
+            worker.stop(timeout=1.0)
+
+    def add_worker(self, worker: ChunkingWorker) -> None:
+        with self.lock:
+            self.pool.append(worker)
+        self.idle.put(worker)
+
+    def replace(self, worker: ChunkingWorker, counter: str) -> None:
+        # Terminated, because it timed out (recycles) or crashed
+        # (restarts). Not replaced once the service is closed.
+        worker.stop()
+        with self.lock:
+            self.counters[counter] += 1
+            if worker not in self.pool:
+                return None
+            self.pool.remove(worker)
+        self.add_worker(worker=ChunkingWorker.start())
+
+    def run(
+        self,
+        website_code: str,
+        options: ChunkingOptions,
+        deadline: float
+            ) -> DocumentChunks:
+        try:
+            worker: ChunkingWorker = self.idle.get(
+                timeout=max(deadline - time.perf_counter(), 0)
+            )
+        except queue.Empty:
+            raise TimeoutError("timed out") from None
+        try:
+            result: DocumentChunks = worker.chunk(
+                website_code=website_code, options=options, deadline=deadline
+            )
+        except TimeoutError:
+            # Running: only terminating its worker stops it.
+            self.replace(worker=worker, counter="recycles")
+            raise
+        except (EOFError, OSError):
+            self.replace(worker=worker, counter="restarts")
+            with self.lock:
+                self.counters["crashed"] += 1
+            raise WorkerCrashedError("worker crashed") from None
+        except BaseException:
+            self.idle.put(worker)
+            raise
+        self.idle.put(worker)
+        return result
+
+    def chunk(
+        self,
+        website_code: str,
+        options: ChunkingOptions,
+        timeout: Optional[float] = None
+            ) -> DocumentChunks:
+        """Raises QueueFullError, TimeoutError or WorkerCrashedError."""
+        start: float = time.perf_counter()
+        deadline: float = start + (
+            self.timeout if timeout is None else timeout
+        )
+        with self.lock:
+            if self.in_flight >= self.workers + self.queue_size:
+                self.counters["rejected"] += 1
+                raise QueueFullError("queue full")
+            self.in_flight += 1
+            self.counters["accepted"] += 1
+        try:
+            result: DocumentChunks = self.run(
+                website_code=website_code, options=options, deadline=deadline
+            )
+        except TimeoutError:
+            with self.lock:
+                self.counters["timed_out"] += 1
+            raise
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+        with self.lock:
+            self.counters["completed" if result.ok else "failed"] += 1
+            self.latencies.append(time.perf_counter() - start)
+        return result
+
+    def get_stats(self) -> dict[str, Any]:
+        with self.lock:
+            in_flight: int = self.in_flight
+            counters: dict[str, int] = dict(self.counters)
+            latencies: list[float] = sorted(self.latencies)
+
+        latency_ms: dict[str, Any] = {"count": len(latencies)}
+        if latencies:
+            for name, fraction in (("p50", 0.5), ("p90", 0.9),
+                                   ("p99", 0.99), ("max", 1.0)):
+                latency_ms[name] = round(
+                    get_percentile(latencies, fraction) * 1000, 3
+                )
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "in_flight": in_flight,
+            # Requests waiting for a worker.
+            "queue_depth": max(in_flight - self.workers, 0),
+            **counters,
+            "latency_ms": latency_ms,
+            "uptime": round(time.monotonic() - self.started_at, 3),
+        }
+
+
+class ChunkingRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Quiet; /stats is the record of what happened.
+        pass
+
+    def send_json(
+        self,
+        status: int,
+        payload: dict,
+        headers: Optional[dict[str, str]] = None
+            ) -> None:
+        body: bytes = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: int, error: str, **payload) -> None:
+        self.send_json(status=status, payload={**payload, "error": error})
+
+    def do_GET(self) -> None:
+        service: ChunkingService = self.server.service
+        match self.path:
+            case "/stats":
+                self.send_json(status=200, payload=service.get_stats())
+            case "/health":
+                self.send_json(status=200, payload={"status": "ok"})
+            case _:
+                self.send_error_json(status=404, error="not found")
+
+    def do_POST(self) -> None:
+        if self.path != "/chunk":
+            self.close_connection = True
+            self.send_error_json(status=404, error="not found")
+            return
+        try:
+            length: int = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self.close_connection = True
+            self.send_error_json(status=411, error="Content-Length needed")
+            return
+        if length > MAX_BODY_SIZE:
+            # The body is not read: the connection can not be reused.
+            self.close_connection = True
+            self.send_error_json(
+                status=413, error=f"body over {MAX_BODY_SIZE} bytes"
+            )
+            return
+
+        body: bytes = self.rfile.read(length)
+        service: ChunkingService = self.server.service
+        try:
+            request: Any = json.loads(body)
+            if not isinstance(request, dict):
+                raise TypeError("request must be an object")
+            website_code: Any = request["html"]
+            if not isinstance(website_code, str):
+                raise TypeError("html must be a string")
+            options: ChunkingOptions = make_request_options(
+                default_options=service.default_options,
+                values=request.get("options", {})
+            )
+            timeout: Any = request.get("timeout")
+            if timeout is not None and (
+                    isinstance(timeout, bool) or
+                    not isinstance(timeout, (int, float)) or timeout <= 0):
+                raise ValueError("timeout must be a positive number")
+        except KeyError as error:
+            self.send_error_json(status=400, error=f"missing {error}")
+            return
+        except (TypeError, ValueError) as error:
+            self.send_error_json(status=400, error=str(error))
+            return
+
+        document_id: Any = request.get("id")
+        try:
+            result: DocumentChunks = service.chunk(
+                website_code=website_code, options=options, timeout=timeout
+            )
+        except QueueFullError as error:
+            self.send_json(
+                status=503,
+                payload={"id": document_id, "error": str(error)},
+                headers={"Retry-After": "1"}
+            )
+            return
+        except TimeoutError:
+            self.send_error_json(status=504, error="timed out", id=document_id)
+            return
+        except WorkerCrashedError:
+            self.send_error_json(
+                status=500, error="worker crashed", id=document_id
+            )
+            return
+
+        if not result.ok:
+            self.send_error_json(status=422, error=result.error,
+                                 id=document_id)
+            return
+        self.send_json(
+            status=200,
+            payload={
+                "id": document_id,
+                "chunks": [chunk.as_dict() for chunk in result.chunks],
+            }
+        )
+
+
+def is_socket_listening(path: Path) -> bool:
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(str(path))
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+    finally:
+        probe.close()
+    return True
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    daemon_threads = True
+    # Whether the socket file is this server's, to remove on close.
+    socket_bound: bool = False
+
+    def server_bind(self) -> None:
+        path = Path(self.server_address)
+        if path.exists() and stat.S_ISSOCK(path.stat().st_mode):
+            if is_socket_listening(path=path):
+                raise OSError(
+                    errno.EADDRINUSE,
+                    f"a server is already listening on {path}"
+                )
+            # Left by a server that did not exit cleanly.
+            path.unlink(missing_ok=True)
+        super().server_bind()
+        self.socket_bound = True
+
+    def server_close(self) -> None:
+        super().server_close()
+        if self.socket_bound:
+            Path(self.server_address).unlink(missing_ok=True)
+
+
+def make_server(
+    service: ChunkingService,
+    port: int = DEFAULT_PORT,
+    socket_path: Optional[Path] = None
+        ) -> socketserver.BaseServer:
+    """Server on socket_path if given, else on 127.0.0.1:port (0: any)."""
+    server: socketserver.BaseServer
+    if socket_path is not None:
+        server = UnixHTTPServer(str(socket_path), ChunkingRequestHandler)
+    else:
+        server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", port), ChunkingRequestHandler
+        )
+    server.service = service
+    return server
+
+
+def get_server_address(server: socketserver.BaseServer) -> str:
+    if isinstance(server, UnixHTTPServer):
+        return f"unix:{server.server_address}"
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def serve(
+    service: ChunkingService,
+    port: int = DEFAULT_PORT,
+    socket_path: Optional[Path] = None
+        ) -> None:
+    """Start the workers and serve until SIGINT or SIGTERM."""
+    service.start()
+    try:
+        server: socketserver.BaseServer = make_server(
+            service=service, port=port, socket_path=socket_path
+        )
+    except BaseException:
+        service.close()
+        raise
+    # SIGTERM stops the server like Ctrl-C does.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(
+        f"serving on {get_server_address(server=server)} with "
+        f"{service.workers} workers",
+        file=sys.stderr,
+        flush=True
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+import attrs
+
+from attrs_strict import type_validator
+
+import codecs
+
+import itertools
+
+import lxml.etree
+
+import re
+
+from betterhtmlchunking.html_source import ENCODING_SNIFF_SIZE
+from betterhtmlchunking.html_source import detect_encoding
+
+from typing import Any
+from typing import Optional
+
+
+############################
+#                          #
+#   --- Source spans ---   #
+#                          #
+############################
+
+# Where each element is in the input, as (start, end) offsets: str
+# indices for text, byte offsets for bytes. lxml does not report
+# positions, so the document is fed to it one markup token at a time
+# (tag, comment, or script/style content), and each event is placed at
+# the token it was fed with.
+#   * An element starts at its start tag. An element lxml implies
+#     (html, body, tbody) starts at the text or the token that made lxml
+#     create it.
+#   * An element ends after its own end tag, or after its start tag
+#     for void elements (<br>). When it is closed implicitly (by the
+#     next <li>, or by </div> around it) it ends where that token
+#     starts, and at the end of the input when nothing closes it.
+# Spans are taken over the raw input, before any html.unescape.
+
+SourceSpanT = tuple[int, int]
+
+TOKEN_PATTERN_SOURCE: str = (
+    r"<!--.*?(?:-->|\Z)"
+    # Raw text: a "<" in a script is not a tag.
+    r"|<(?P<raw>script|style|textarea|title|xmp|noembed|noframes)"
+    r"(?=[\s/>])[^>]*>?.*?(?=</(?P=raw)|\Z)"
+    r"|</(?P<end>[A-Za-z][^\s/>]*)[^>]*>?"
+    # Quoted attribute values can hold ">" and "<".
+    r"|<(?P<start>[A-Za-z][^\s/>]*)"
+    r"(?:=\s*(?:\"[^\"]*\"|'[^']*')|[^>])*>?"
+    r"|<[!?][^>]*>?"
+    r"|<"
+)
+TOKEN_PATTERN: re.Pattern = re.compile(
+    TOKEN_PATTERN_SOURCE, re.IGNORECASE | re.DOTALL
+)
+BYTES_TOKEN_PATTERN: re.Pattern = re.compile(
+    TOKEN_PATTERN_SOURCE.encode("ascii"), re.IGNORECASE | re.DOTALL
+)
+
+
+# Fields are validated on init only: they change with every token.
+@attrs.define(eq=False, on_setattr=attrs.setters.NO_OP)
+class SourceSpanRecorder:
+    """lxml parser target recording the span of every element.
+
+    Events are passed on to target (a TreeBuilder), if any. Spans are
+    in the order the elements were opened, which is document order.
+    """
+    target: Optional[Any] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+    # Encoding of byte tokens, to compare their names with lxml's.
+    encoding: str = attrs.field(
+        validator=type_validator(),
+        default="utf-8"
+    )
+    spans: list[list[int]] = attrs.field(
+        validator=attrs.validators.instance_of(list),
+        init=False,
+        factory=list
+    )
+    # What target.start returned for each span.
+    elements: list[Any] = attrs.field(
+        validator=attrs.validators.instance_of(list),
+        init=False,
+        factory=list
+    )
+    open_spans: list[int] = attrs.field(
+        validator=attrs.validators.instance_of(list),
+        init=False,
+        factory=list
+    )
+    # Token being fed, and whether an element ended with it. lxml only
+    # reports text when the token after it is fed: text_start is the
+    # end of the previous token.
+    token_start: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+    text_start: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+    token: Optional[re.Match] = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=None
+    )
+    token_used: bool = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=False
+    )
+
+    def set_token(self, token_start: int, token: Optional[re.Match]) -> None:
+        if self.token is not None:
+            self.text_start = self.token.end()
+        self.token_start = token_start
+        self.token = token
+        self.token_used = False
+
+    def get_token_name(self, group: str) -> Optional[str]:
+        name: Any = self.token.group(group)
+        if isinstance(name, (bytes, bytearray)):
+            name = name.decode(self.encoding, errors="replace")
+        return None if name is None else name.lower()
+
+    def start(self, tag: str, attrib: dict, nsmap: Any = None) -> Any:
+        elem: Any = None
+        if self.target is not None:
+            elem = self.target.start(tag, attrib)
+        start: int = self.token_start
+        if self.token is None or tag not in (
+                self.get_token_name(group="start"),
+                self.get_token_name(group="raw")):
+            start = min(self.text_start, start)
+        if self.open_spans:
+            # Text before <html> is not in the implied body.
+            start = max(start, self.spans[self.open_spans[-1]][0])
+        self.open_spans.append(len(self.spans))
+        self.spans.append([start, start])
+        self.elements.append(elem)
+        return elem
+
+    def end(self, tag: str) -> Any:
+        span: list[int] = self.spans[self.open_spans.pop()]
+        span[1] = self.token_start
+        if self.token is not None and not self.token_used:
+            if self.get_token_name(group="end") == tag or (
+                    span[0] == self.token_start and
+                    self.get_token_name(group="start") == tag):
+                span[1] = self.token.end()
+                self.token_used = True
+        if self.target is not None:
+            return self.target.end(tag)
+        return None
+
+    def data(self, data: str) -> None:
+        if self.target is not None:
+            self.target.data(data)
+
+    def comment(self, text: str) -> Any:
+        if self.target is not None:
+            return self.target.comment(text)
+        return None
+
+    def pi(self, target: str, data: Optional[str] = None) -> Any:
+        if self.target is not None:
+            return self.target.pi(target, data)
+        return None
+
+    def close(self) -> Any:
+        if self.target is not None:
+            return self.target.close()
+        return None
+
+
+def parse_with_source_spans(
+    document: Any,
+    recorder: SourceSpanRecorder
+        ) -> Any:
+    """Parse an opened document (see html_source.py) into recorder.
+
+    Returns what the recorder's target returns on close.
+    """
+    parser = lxml.etree.HTMLParser(target=recorder)
+    position: int = 0
+    decoder = None
+    pattern: re.Pattern = TOKEN_PATTERN
+    if not isinstance(document, str):
+        encoding, position = detect_encoding(
+            head=bytes(document[:ENCODING_SNIFF_SIZE])
+        )
+        if "<".encode(encoding) != b"<":
+            raise ValueError(
+                f"source spans need an ASCII compatible encoding, "
+                f"not {encoding}"
+            )
+        recorder.encoding = encoding
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        pattern = BYTES_TOKEN_PATTERN
+
+    # Each piece runs from a token to the next one.
+    for token in itertools.chain(pattern.finditer(document, position), [None]):
+        end: int = len(document) if token is None else token.start()
+        if end > position:
+            piece: Any = document[position:end]
+            parser.feed(piece if decoder is None else decoder.decode(piece))
+        if token is not None:
+            position = end
+            recorder.set_token(token_start=position, token=token)
+    if decoder is not None:
+        tail: str = decoder.decode(b"", final=True)
+        if tail:
+            parser.feed(tail)
+
+    recorder.set_token(token_start=len(document), token=None)
+    return parser.close()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import attrs
+
+from attrs_strict import type_validator
+
+import contextlib
+
+import time
+
+import tracemalloc
+
+from typing import Any
+from typing import Callable
+from typing import Iterator
+from typing import Optional
+
+
+###################################
+#                                 #
+#   --- Pipeline statistics ---   #
+#                                 #
+###################################
+
+# Stage names, in pipeline order:
+PARSE_STAGE: str = "parse"
+METRICS_STAGE: str = "metrics"
+FILTER_STAGE: str = "filter"
+TREE_STAGE: str = "tree"
+ROI_STAGE: str = "roi"
+RENDER_STAGE: str = "render"
+
+# Counter names:
+NODES_COUNTER: str = "nodes"
+FILTERED_OUT_COUNTER: str = "filtered_out"
+ROIS_COUNTER: str = "rois"
+ROI_NODES_VISITED_COUNTER: str = "roi_nodes_visited"
+ROI_MAKER_STEPS_COUNTER: str = "roi_maker_steps"
+RENDERED_CHUNKS_COUNTER: str = "rendered_chunks"
+TOKENIZED_SEGMENTS_COUNTER: str = "tokenized_segments"
+TOKEN_CACHE_HITS_COUNTER: str = "token_cache_hits"
+REUSED_SUBTREES_COUNTER: str = "reused_subtrees"
+REUSED_RENDERS_COUNTER: str = "reused_renders"
+REUSED_NODE_RENDERS_COUNTER: str = "reused_node_renders"
+LAYOUT_CACHE_HITS_COUNTER: str = "layout_cache_hits"
+LAYOUT_CACHE_MISSES_COUNTER: str = "layout_cache_misses"
+LAYOUT_ADJUSTED_NODES_COUNTER: str = "layout_adjusted_nodes"
+
+
+@attrs.define()
+class StageStats:
+    name: str = attrs.field(
+        validator=type_validator()
+    )
+    wall_time: float = attrs.field(
+        validator=type_validator(),
+        default=0.0
+    )
+    cpu_time: float = attrs.field(
+        validator=type_validator(),
+        default=0.0
+    )
+    # Peak traced memory during the stage, in bytes (trace_memory only).
+    peak_memory: Optional[int] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+
+@attrs.define()
+class PipelineStats:
+    stages: dict[str, StageStats] = attrs.field(
+        validator=type_validator(),
+        factory=dict
+    )
+    counters: dict[str, int] = attrs.field(
+        validator=type_validator(),
+        factory=dict
+    )
+
+    @property
+    def wall_time(self) -> float:
+        return sum(stage.wall_time for stage in self.stages.values())
+
+    @property
+    def cpu_time(self) -> float:
+        return sum(stage.cpu_time for stage in self.stages.values())
+
+    @property
+    def peak_memory(self) -> Optional[int]:
+        peaks: list[int] = [
+            stage.peak_memory for stage in self.stages.values()
+            if stage.peak_memory is not None
+        ]
+        return max(peaks) if peaks else None
+
+    def as_dict(self) -> dict[str, Any]:
+        # Plain data, ready for json.dumps or a metrics exporter.
+        return {
+            "stages": {
+                name: attrs.asdict(stage)
+                for name, stage in self.stages.items()
+            },
+            "counters": dict(self.counters),
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "peak_memory": self.peak_memory,
+        }
+
+
+StageCallbackT = Callable[[StageStats], Any]
+
+
+@attrs.define()
+class StatsRecorder:
+    trace_memory: bool = attrs.field(
+        validator=type_validator(),
+        default=False
+    )
+    # Called with each stage as soon as it ends.
+    stage_callback: Optional[StageCallbackT] = attrs.field(
+        validator=attrs.validators.optional(attrs.validators.is_callable()),
+        default=None
+    )
+    stats: PipelineStats = attrs.field(
+        validator=type_validator(),
+        init=False,
+        factory=PipelineStats
+    )
+    # Whether tracemalloc was started here, and has to be stopped here.
+    started_tracing: bool = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=False
+    )
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[StageStats]:
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            tracemalloc.reset_peak()
+
+        stage_stats = StageStats(name=name)
+        wall_start: float = time.perf_counter()
+        cpu_start: float = time.process_time()
+        try:
+            yield stage_stats
+        finally:
+            # A stage run more than once (recompute) adds up.
+            stage_stats.wall_time = time.perf_counter() - wall_start
+            stage_stats.cpu_time = time.process_time() - cpu_start
+            if self.trace_memory:
+                stage_stats.peak_memory = tracemalloc.get_traced_memory()[1]
+            self.add_stage(stage_stats=stage_stats)
+
+    def add_stage(self, stage_stats: StageStats) -> None:
+        previous: Optional[StageStats] = self.stats.stages.get(
+            stage_stats.name
+        )
+        if previous is not None:
+            stage_stats.wall_time += previous.wall_time
+            stage_stats.cpu_time += previous.cpu_time
+            if previous.peak_memory is not None:
+                stage_stats.peak_memory = max(
+                    previous.peak_memory, stage_stats.peak_memory or 0
+                )
+        self.stats.stages[stage_stats.name] = stage_stats
+        if self.stage_callback is not None:
+            self.stage_callback(stage_stats)
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.stats.counters[name] = self.stats.counters.get(name, 0) + value
+
+    def set_counter(self, name: str, value: int) -> None:
+        self.stats.counters[name] = value
+
+    def finish(self) -> PipelineStats:
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        return self.stats
+
+
+def record_stage(
+    stats_recorder: Optional[StatsRecorder],
+    name: str
+        ) -> contextlib.AbstractContextManager:
+    # For components that may run without a recorder.
+    if stats_recorder is None:
+        return contextlib.nullcontext()
+    return stats_recorder.stage(name=name)
@@ -0,0 +1,736 @@
+#!/usr/bin/env python3
+
+import attrs
+
+from attrs_strict import type_validator
+
+import lxml.etree
+import lxml.html
+
+from collections import deque
+
+from betterhtmlchunking.main import tag_list_to_filter_out
+
+from betterhtmlchunking.batch import ChunkingOptions
+from betterhtmlchunking.batch import ChunkRecord
+
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+
+from betterhtmlchunking.render_system import ChunkKind
+
+from betterhtmlchunking.node_metrics import _TagFrame
+from betterhtmlchunking.node_metrics import wanted_xpath
+from betterhtmlchunking.node_metrics import HtmlSerialization
+
+from betterhtmlchunking.lxml_backend import format_lxml_open_tag
+from betterhtmlchunking.lxml_backend import format_lxml_close_tag
+from betterhtmlchunking.lxml_backend import collapse_whitespace_string
+from betterhtmlchunking.lxml_backend import format_lxml_text
+from betterhtmlchunking.lxml_backend import format_lxml_special_node
+from betterhtmlchunking.lxml_backend import is_void_lxml_elem
+from betterhtmlchunking.lxml_backend import prettify_lxml_element
+from betterhtmlchunking.lxml_backend import decode_lxml_element
+from betterhtmlchunking.lxml_backend import get_lxml_elem_text
+
+from betterhtmlchunking.html_source import HtmlSourceT
+from betterhtmlchunking.html_source import iter_decoded_blocks
+from betterhtmlchunking.html_source import iter_file_blocks
+from betterhtmlchunking.html_source import iter_source_blocks
+from betterhtmlchunking.html_source import iter_unescaped_blocks
+from betterhtmlchunking.html_source import open_html_source
+
+from betterhtmlchunking.token_length import TokenCounter
+from betterhtmlchunking.token_length import get_token_counter
+
+from typing import Any
+from typing import Iterator
+from typing import Optional
+
+
+#################################
+#                               #
+#   --- Streaming chunker ---   #
+#                               #
+#################################
+
+# Chunks a document while it is parsed, for inputs too large to hold in
+# memory. lxml's push parser feeds the same tree builder as the lxml
+# backend, one block at a time; every element is measured when its end
+# tag is reached (same _TagFrame sums as node_metrics.py) and the
+# ROIMaker decisions are replayed child by child:
+#   * a child is gone into as soon as a lower bound of its length (the
+#     children closed so far) reaches the maximum length;
+#   * the other children are added to the current region of their
+#     parent as they close;
+#   * a region is rendered once it can no longer change (the next one
+#     started, or its parent closed), then its elements are freed.
+# Memory is bounded by the regions still open, about two chunks per
+# level of the tree, instead of the document.
+#
+# Two differences with DomRepresentation:
+#   * positional xpaths always carry the sibling index (div[1]): whether
+#     a tag has same-name siblings is not known until its parent closes;
+#   * chunks are emitted as they are completed, not level by level: the
+#     chunks of a child that is gone into can come before those of its
+#     parent.
+
+DEFAULT_BLOCK_SIZE: int = 64 * 1024
+INDENT_WIDTH: int = 1
+
+
+class _StreamRegion:
+    __slots__ = (
+        "pos_xpaths",
+        "repr_length",
+        "members",
+    )
+
+    def __init__(self):
+        self.pos_xpaths: list[str] = []
+        self.repr_length: int = 0
+        # (parent, element) of every node, rendered once the region is
+        # complete. No parent for a node region, freed by its parent.
+        self.members: list[tuple[Optional["_StreamNode"], Any]] = []
+
+    def add(
+        self,
+        parent: Optional["_StreamNode"],
+        node: "_StreamNode"
+            ) -> None:
+        self.pos_xpaths.append(node.pos_xpath)
+        self.repr_length += node.repr_length
+        self.members.append((parent, node.elem))
+
+    def merge(self, region: "_StreamRegion") -> None:
+        self.pos_xpaths += region.pos_xpaths
+        self.repr_length += region.repr_length
+        self.members += region.members
+
+
+class _StreamNode:
+    __slots__ = (
+        "elem",
+        "tag",
+        "parent",
+        "frame",
+        "pos_xpath",
+        "source_xpath",
+        "name_counts",
+        "source_name_counts",
+        "repr_length",
+        "closed_children",
+        # ROIMaker state, once the chunker goes into the node:
+        "explored",
+        "region_ready",
+        "children_count",
+        "regions_count",
+        "current_region",
+        "last_region",
+        "keep_children",
+        "kept_elems",
+    )
+
+    def __init__(
+        self,
+        elem,
+        parent: Optional["_StreamNode"],
+        frame: _TagFrame,
+        pos_xpath: str,
+        source_xpath: str
+            ):
+        self.elem = elem
+        self.tag: str = elem.tag
+        self.parent: Optional[_StreamNode] = parent
+        self.frame: _TagFrame = frame
+        self.pos_xpath: str = pos_xpath
+        self.source_xpath: str = source_xpath
+        self.name_counts: dict[str, int] = {}
+        self.source_name_counts: dict[str, int] = {}
+        self.repr_length: int = 0
+        # Closed children, while it is not known whether the node is
+        # gone into or is part of a region as a whole.
+        self.closed_children: list[_StreamNode] = []
+        self.explored: bool = False
+
+    def explore(self) -> None:
+        self.explored = True
+        self.closed_children = []
+        self.region_ready: bool = False
+        self.children_count: int = 0
+        self.regions_count: int = 0
+        self.current_region = _StreamRegion()
+        self.last_region: Optional[_StreamRegion] = None
+        # While the node may still end up as a region itself, its
+        # children are kept to render it.
+        self.keep_children: bool = True
+        self.kept_elems: list[Any] = []
+
+
+def get_child_xpath(
+    parent_xpath: str,
+    name_counts: dict[str, int],
+    name: str
+        ) -> str:
+    position: int = name_counts.get(name, 0) + 1
+    name_counts[name] = position
+    return f"{parent_xpath}/{name}[{position}]"
+
+
+@attrs.define(eq=False)
+class StreamingChunker:
+    """lxml parser target chunking the document as it is parsed.
+
+    Feed it with ``feed()`` and collect the chunks completed so far with
+    ``pop_chunks()``; ``iter_stream_chunks`` does both.
+    """
+    options: ChunkingOptions = attrs.field(
+        validator=type_validator()
+    )
+    token_counter: Optional[TokenCounter] = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=None,
+        repr=False
+    )
+    tree_builder: Any = attrs.field(
+        validator=type_validator(),
+        init=False,
+        repr=False
+    )
+    parser: Any = attrs.field(
+        validator=type_validator(),
+        init=False,
+        repr=False
+    )
+    # Open elements, the explored ones first.
+    stack: list[_StreamNode] = attrs.field(
+        validator=attrs.validators.instance_of(list),
+        init=False,
+        factory=list,
+        repr=False
+    )
+    explored_depth: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+    root: Optional[_StreamNode] = attrs.field(
+        validator=attrs.validators.optional(
+            attrs.validators.instance_of(_StreamNode)
+        ),
+        init=False,
+        default=None,
+        repr=False
+    )
+    # Depth inside a filtered out (or extra top-level) element.
+    skip_depth: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+    # Depth inside an element lxml refuses to create (invalid tag or
+    # attribute name), dropped with its content.
+    invalid_depth: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+    # Filtered out elements still in the tree, see lxml_removed.
+    skipped: set[Any] = attrs.field(
+        validator=attrs.validators.instance_of(set),
+        init=False,
+        factory=set,
+        repr=False
+    )
+    pending_data: list[str] = attrs.field(
+        validator=attrs.validators.instance_of(list),
+        init=False,
+        factory=list,
+        repr=False
+    )
+    chunks: deque[ChunkRecord] = attrs.field(
+        validator=attrs.validators.instance_of(deque),
+        init=False,
+        factory=deque,
+        repr=False
+    )
+    emitted: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+
+    def __attrs_post_init__(self):
+        if self.options.compared_by ==\
+                ReprLengthComparisionBy.TOKEN_LENGTH:
+            if self.options.tokenizer is None:
+                raise ValueError("TOKEN_LENGTH needs a tokenizer")
+            self.token_counter = get_token_counter(
+                tokenizer=self.options.tokenizer
+            )
+        # Same tree builder as make_lxml_root.
+        self.tree_builder = lxml.etree.TreeBuilder(
+            parser=lxml.html.HTMLParser()
+        )
+        self.parser = lxml.etree.HTMLParser(target=self)
+
+    @property
+    def max_length(self) -> int:
+        return self.options.max_length
+
+    # --- Parser target interface ---
+
+    def start(self, tag: str, attrib: dict, nsmap: Any = None) -> Any:
+        if self.invalid_depth:
+            self.invalid_depth += 1
+            return None
+        self.flush_data()
+        try:
+            elem = self.tree_builder.start(tag, attrib)
+        except ValueError:
+            self.invalid_depth = 1
+            return None
+        if self.skip_depth:
+            self.skip_depth += 1
+            return elem
+
+        parent: Optional[_StreamNode] = self.stack[-1] if self.stack\
+            else None
+        if parent is None:
+            if self.root is not None:
+                self.skip_depth = 1
+                return elem
+            source_xpath: str = f"/{tag}[1]"
+            pos_xpath: str = source_xpath
+        else:
+            source_xpath = get_child_xpath(
+                parent_xpath=parent.source_xpath,
+                name_counts=parent.source_name_counts,
+                name=tag
+            )
+        if not wanted_xpath(
+                xpath=source_xpath,
+                tag_list_to_filter_out=self.get_tag_list_to_filter_out()):
+            self.skip_depth = 1
+            return elem
+        if parent is not None:
+            pos_xpath = get_child_xpath(
+                parent_xpath=parent.pos_xpath,
+                name_counts=parent.name_counts,
+                name=tag
+            )
+
+        node = _StreamNode(
+            elem=elem,
+            parent=parent,
+            frame=_TagFrame(
+                elem=None,
+                name=tag,
+                idx=0,
+                in_pre=parent.frame.in_pre if parent is not None else False,
+                open_tag="",
+                close_tag="",
+                is_void=False,
+                token_counter=self.token_counter
+            ),
+            pos_xpath=pos_xpath,
+            source_xpath=source_xpath
+        )
+        self.stack.append(node)
+        if parent is None:
+            self.root = node
+            node.explore()
+            self.explored_depth = 1
+        return elem
+
+    def end(self, tag: str) -> Any:
+        if self.invalid_depth:
+            self.invalid_depth -= 1
+            return None
+        self.flush_data()
+        elem = self.tree_builder.end(tag)
+        if self.skip_depth:
+            self.skip_depth -= 1
+            if self.skip_depth == 0 and self.stack:
+                # Left in the tree, like lxml_removed, so that its tail
+                # stays where it is.
+                elem.clear(keep_tail=True)
+                self.skipped.add(elem)
+            return elem
+
+        node: _StreamNode = self.stack.pop()
+        if node.explored:
+            self.explored_depth -= 1
+        self.close_node(node=node)
+        self.promote_open_nodes()
+        return elem
+
+    def data(self, data: str) -> None:
+        # lxml may split a string, it is collapsed and measured once
+        # whole.
+        if self.invalid_depth:
+            return None
+        self.pending_data.append(data)
+
+    def comment(self, text: str) -> Any:
+        if self.invalid_depth:
+            return None
+        self.flush_data()
+        if self.stack and not self.stack[-1].frame.in_pre:
+            text = collapse_whitespace_string(text=text)
+        return self.add_special_node(
+            node=self.tree_builder.comment(text)
+        )
+
+    def pi(self, target: str, data: Optional[str] = None) -> Any:
+        if self.invalid_depth:
+            return None
+        self.flush_data()
+        return self.add_special_node(
+            node=self.tree_builder.pi(target, data)
+        )
+
+    def close(self) -> None:
+        self.flush_data()
+        return None
+
+    # --- Measuring ---
+
+    def get_tag_list_to_filter_out(self) -> list[str]:
+        if self.options.tag_list_to_filter_out is None:
+            return tag_list_to_filter_out
+        return self.options.tag_list_to_filter_out
+
+    def flush_data(self) -> None:
+        if not self.pending_data:
+            return None
+        text: str = "".join(self.pending_data)
+        self.pending_data.clear()
+        if self.stack and not self.stack[-1].frame.in_pre:
+            # As make_lxml_root does after parsing.
+            text = collapse_whitespace_string(text=text)
+        self.tree_builder.data(text)
+        if self.stack and not self.skip_depth:
+            node: _StreamNode = self.stack[-1]
+            node.frame.add_string(
+                output=format_lxml_text(text=text, parent_tag=node.tag),
+                text=text,
+                indent_width=INDENT_WIDTH
+            )
+        return None
+
+    def add_special_node(self, node: Any) -> Any:
+        self.flush_data()
+        if not self.skip_depth and self.stack:
+            self.stack[-1].frame.add_string(
+                output=format_lxml_special_node(node=node),
+                text=None,
+                indent_width=INDENT_WIDTH
+            )
+        return node
+
+    def get_frame_length(self, frame: _TagFrame) -> int:
+        match self.options.compared_by:
+            case ReprLengthComparisionBy.TEXT_LENGTH:
+                return frame.get_text_length()
+            case ReprLengthComparisionBy.HTML_LENGTH:
+                return frame.get_html_length(
+                    html_serialization=self.options.html_serialization
+                )
+            case ReprLengthComparisionBy.TOKEN_LENGTH:
+                return frame.token_length
+
+    def get_lower_bound(self, depth: int) -> int:
+        # Length of stack[depth] counting what is closed so far under it,
+        # summed up the open chain the way _TagFrame.add_child will.
+        raw_length: int = 0
+        pretty_length: int = 0
+        text_length: int = 0
+        pre_text_length: int = 0
+        for node in reversed(self.stack[depth:]):
+            frame: _TagFrame = node.frame
+            match self.options.compared_by:
+                case ReprLengthComparisionBy.HTML_LENGTH:
+                    raw_length += frame.raw_length
+                    pretty_length = raw_length if frame.literal else\
+                        frame.pretty_length + pretty_length
+                case ReprLengthComparisionBy.TEXT_LENGTH:
+                    text_length, pre_text_length = (
+                        frame.text_length + (
+                            0 if frame.excluded else
+                            pre_text_length if frame.preformatted else
+                            text_length
+                        ),
+                        frame.pre_text_length + (
+                            0 if frame.excluded else pre_text_length
+                        )
+                    )
+                case ReprLengthComparisionBy.TOKEN_LENGTH:
+                    text_length, pre_text_length = (
+                        frame.token_length + (
+                            0 if frame.excluded else
+                            pre_text_length if frame.preformatted else
+                            text_length
+                        ),
+                        frame.pre_token_length + (
+                            0 if frame.excluded else pre_text_length
+                        )
+                    )
+        match self.options.compared_by:
+            case ReprLengthComparisionBy.HTML_LENGTH:
+                match self.options.html_serialization:
+                    case HtmlSerialization.PRETTIFIED:
+                        return pretty_length
+                    case HtmlSerialization.COMPACT:
+                        return raw_length
+            case _:
+                return text_length
+
+    def close_node(self, node: _StreamNode) -> None:
+        frame: _TagFrame = node.frame
+        frame.open_tag = format_lxml_open_tag(elem=node.elem)
+        frame.close_tag = format_lxml_close_tag(elem=node.elem)
+        frame.is_void = is_void_lxml_elem(elem=node.elem)
+        frame.close()
+        node.repr_length = self.get_frame_length(frame=frame)
+
+        parent: Optional[_StreamNode] = node.parent
+        if parent is not None:
+            parent.frame.add_child(child=frame, indent_width=INDENT_WIDTH)
+
+        if node.explored:
+            self.finish_explored(node=node)
+        elif parent is not None and parent.explored:
+            self.add_closed_child(parent=parent, child=node)
+        elif parent is not None:
+            parent.closed_children.append(node)
+
+    # --- Regions (ROIMaker, one child at a time) ---
+
+    def add_closed_child(
+        self,
+        parent: _StreamNode,
+        child: _StreamNode
+            ) -> None:
+        if child.repr_length < self.max_length:
+            self.add_child(parent=parent, child=child, explored=False)
+            return None
+        self.add_child(parent=parent, child=child, explored=True)
+        closed_children: list[_StreamNode] = child.closed_children
+        child.explore()
+        for grandchild in closed_children:
+            self.add_closed_child(parent=child, child=grandchild)
+        self.finish_explored(node=child)
+        return None
+
+    def promote_open_nodes(self) -> None:
+        # Open children of explored nodes are gone into as soon as
+        # their length reaches the maximum.
+        while self.explored_depth < len(self.stack) and\
+                self.get_lower_bound(depth=self.explored_depth) >=\
+                self.max_length:
+            node: _StreamNode = self.stack[self.explored_depth]
+            self.add_child(parent=node.parent, child=node, explored=True)
+            closed_children: list[_StreamNode] = node.closed_children
+            node.explore()
+            for child in closed_children:
+                self.add_closed_child(parent=node, child=child)
+            self.explored_depth += 1
+
+    def add_child(
+        self,
+        parent: _StreamNode,
+        child: _StreamNode,
+        explored: bool
+            ) -> None:
+        parent.children_count += 1
+        if parent.region_ready:
+            self.append_region(node=parent)
+        if explored:
+            parent.region_ready = True
+            # The child is in none of its regions.
+            self.release_children(node=parent)
+            return None
+
+        region: _StreamRegion = parent.current_region
+        region.add(parent=parent, node=child)
+        child.closed_children = []
+        if region.repr_length >= self.max_length:
+            parent.region_ready = True
+        return None
+
+    def append_region(self, node: _StreamNode) -> None:
+        node.regions_count += 1
+        if node.last_region is not None:
+            # Only the last region takes in hanging nodes.
+            self.emit(region=node.last_region)
+        node.last_region = node.current_region
+        node.current_region = _StreamRegion()
+        node.region_ready = False
+        if node.regions_count > 1:
+            self.release_children(node=node)
+
+    def finish_explored(self, node: _StreamNode) -> None:
+        if node.region_ready:
+            self.append_region(node=node)
+        hanging: _StreamRegion = node.current_region
+        if hanging.repr_length > 0 and node.regions_count > 0:
+            node.last_region.merge(region=hanging)
+
+        if node.children_count == 0 or (
+                node.regions_count == 1 and
+                len(node.last_region.pos_xpaths) == node.children_count):
+            region = _StreamRegion()
+            region.add(parent=None, node=node)
+            node.last_region = region
+        if node.last_region is not None:
+            self.emit(region=node.last_region)
+
+        node.last_region = None
+        node.current_region = None
+        node.kept_elems = []
+        if node.parent is not None:
+            self.free_elem(node=node.parent, elem=node.elem)
+
+    # --- Output and memory ---
+
+    def render_elem(self, elem: Any, kind: ChunkKind) -> str:
+        match kind, self.options.html_serialization:
+            case ChunkKind.HTML, HtmlSerialization.PRETTIFIED:
+                return prettify_lxml_element(elem=elem, skipped=self.skipped)
+            case ChunkKind.HTML, HtmlSerialization.COMPACT:
+                return decode_lxml_element(elem=elem, skipped=self.skipped)
+            case ChunkKind.TEXT, _:
+                return get_lxml_elem_text(elem=elem, skipped=self.skipped)
+
+    def emit(self, region: _StreamRegion) -> None:
+        if not region.pos_xpaths:
+            return None
+        self.chunks.append(
+            ChunkRecord(
+                roi_idx=self.emitted,
+                pos_xpaths=region.pos_xpaths,
+                repr_length=region.repr_length,
+                **{
+                    kind.value: "\n".join(
+                        self.render_elem(elem=elem, kind=kind)
+                        for _, elem in region.members
+                    )
+                    for kind in self.options.kinds
+                }
+            )
+        )
+        self.emitted += 1
+        for parent, elem in region.members:
+            if parent is not None:
+                self.free_elem(node=parent, elem=elem)
+        if self.emitted == 1:
+            # Nothing was freed so far, in case the whole document had
+            # to be the only chunk.
+            for node in self.stack:
+                if node.explored and not node.keep_children:
+                    self.release_children(node=node)
+        return None
+
+    def free_elem(self, node: _StreamNode, elem: Any) -> None:
+        if node.keep_children or self.emitted == 0:
+            node.kept_elems.append(elem)
+            return None
+        if self.skipped:
+            for descendant in elem.iter():
+                self.skipped.discard(descendant)
+        node.elem.remove(elem)
+        return None
+
+    def release_children(self, node: _StreamNode) -> None:
+        node.keep_children = False
+        kept_elems: list[Any] = node.kept_elems
+        node.kept_elems = []
+        for elem in kept_elems:
+            self.free_elem(node=node, elem=elem)
+
+    # --- Driving the parser ---
+
+    def feed(self, block: str) -> None:
+        self.parser.feed(block)
+
+    def finish(self) -> None:
+        try:
+            self.parser.close()
+        except (ValueError, lxml.etree.LxmlError):
+            # Empty document.
+            ...
+        # Same fallback as TreeRegionsSystem: the whole document.
+        if self.emitted == 0 and self.root is not None:
+            region = _StreamRegion()
+            region.add(parent=None, node=self.root)
+            self.emit(region=region)
+
+    def pop_chunks(self) -> Iterator[ChunkRecord]:
+        while self.chunks:
+            yield self.chunks.popleft()
+
+
+def iter_stream_blocks(
+    source: HtmlSourceT,
+    block_size: int,
+    encoding: Optional[str]
+        ) -> Iterator[str]:
+    """Text blocks of a document, read block_size at a time.
+
+    A str is HTML, paths are mapped in memory and files read as they
+    go, see html_source.py.
+    """
+    if hasattr(source, "read"):
+        yield from iter_decoded_blocks(
+            blocks=iter_file_blocks(file=source, block_size=block_size),
+            encoding=encoding
+        )
+        return
+    with open_html_source(source=source) as document:
+        yield from iter_decoded_blocks(
+            blocks=iter_source_blocks(
+                document=document, block_size=block_size
+            ),
+            encoding=encoding
+        )
+
+
+def iter_stream_chunks(
+    source: HtmlSourceT,
+    options: ChunkingOptions,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    encoding: Optional[str] = None
+        ) -> Iterator[ChunkRecord]:
+    """Chunk a document too large to load, as it is read.
+
+    Parameters
+    ----------
+    source:
+        HTML (str or bytes), a ``pathlib.Path`` of the document, or a
+        file open in text or binary mode (e.g. ``sys.stdin``). A str
+        is always HTML, never a path. Read ``block_size`` at a time.
+    options:
+        Same options as ``chunk_many``. The document is always parsed
+        with lxml and measured bottom-up, ``backend`` and
+        ``metrics_mode`` are not used.
+    encoding:
+        Of bytes. When None, detected as by ``chunk_many``: byte
+        order mark, declared charset, then UTF-8.
+
+    Yields a ``ChunkRecord`` per chunk, numbered in the order they are
+    completed, with the renders in ``options.kinds``. Positional xpaths
+    always carry the sibling index (``/html[1]/body[1]/div[3]``).
+    """
+    chunker = StreamingChunker(options=options)
+    blocks: Iterator[str] = iter_stream_blocks(
+        source=source, block_size=block_size, encoding=encoding
+    )
+    if options.html_unescape:
+        blocks = iter_unescaped_blocks(blocks=blocks)
+
+    for block in blocks:
+        chunker.feed(block=block)
+        yield from chunker.pop_chunks()
+    chunker.finish()
+    yield from chunker.pop_chunks()
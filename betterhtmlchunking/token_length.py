@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import attrs
+
+from attrs_strict import type_validator
+
+from collections import OrderedDict
+
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+
+##############################
+#                            #
+#   --- Token counting ---   #
+#                            #
+##############################
+
+# With ReprLengthComparisionBy.TOKEN_LENGTH, lengths are model tokens.
+# Every text segment is tokenized once while the tree is measured, and a
+# node's token length is the sum over the segments under it. Counts are
+# cached by segment content, so the boilerplate repeated across pages
+# (menus, footers, cookie banners) is tokenized only once.
+
+# Returns the tokens of a text (anything with a len()) or their count,
+# e.g. tiktoken's Encoding.encode or a HuggingFace tokenizer's encode.
+TokenizerT = Callable[[str], Any]
+
+# Tokenizers whose counter is shared between documents.
+MAX_SHARED_TOKEN_COUNTERS: int = 8
+
+
+@attrs.define(eq=False)
+class TokenCounter:
+    tokenizer: TokenizerT = attrs.field(
+        validator=attrs.validators.is_callable()
+    )
+    # Segments kept in the cache, None for no bound.
+    cache_size: Optional[int] = attrs.field(
+        validator=type_validator(),
+        default=65536
+    )
+    cache: OrderedDict[str, int] = attrs.field(
+        validator=attrs.validators.instance_of(OrderedDict),
+        init=False,
+        factory=OrderedDict,
+        repr=False
+    )
+    hits: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+    misses: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+
+    def tokenize(self, text: str) -> int:
+        tokens = self.tokenizer(text)
+        if isinstance(tokens, int):
+            return tokens
+        return len(tokens)
+
+    def count(self, text: str) -> int:
+        token_count: Optional[int] = self.cache.get(text)
+        if token_count is not None:
+            self.cache.move_to_end(text)
+            self.hits += 1
+            return token_count
+
+        self.misses += 1
+        token_count = self.tokenize(text=text)
+        if self.cache_size != 0:
+            self.cache[text] = token_count
+            if self.cache_size is not None\
+                    and len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return token_count
+
+    def __call__(self, text: str) -> int:
+        return self.count(text=text)
+
+
+shared_token_counters: OrderedDict[Any, TokenCounter] = OrderedDict()
+
+
+def get_token_counter(tokenizer: TokenizerT) -> TokenCounter:
+    """Counter of a tokenizer, shared by every document using it.
+
+    A TokenCounter is used as is, which allows to control its cache.
+    """
+    if isinstance(tokenizer, TokenCounter):
+        return tokenizer
+    try:
+        token_counter: Optional[TokenCounter] =\
+            shared_token_counters.get(tokenizer)
+    except TypeError:
+        # Unhashable callable, its counts are only reused in a document.
+        return TokenCounter(tokenizer=tokenizer)
+
+    if token_counter is None:
+        token_counter = TokenCounter(tokenizer=tokenizer)
+        shared_token_counters[tokenizer] = token_counter
+        if len(shared_token_counters) > MAX_SHARED_TOKEN_COUNTERS:
+            shared_token_counters.popitem(last=False)
+    return token_counter
@@ -4,12 +4,24 @@ import attrs
 
 from attrs_strict import type_validator
 
-import queue
+import array
 
-import treelib
+import sys
+
+import warnings
+
+from collections import deque
 
 from betterhtmlchunking.tree_representation import\
     DOMTreeRepresentation
+from betterhtmlchunking.compact_tree import CompactTree
+from betterhtmlchunking.packing import ChildrenPacking
+from betterhtmlchunking.packing import pack_children
+
+from betterhtmlchunking.stats import StatsRecorder
+from betterhtmlchunking.stats import ROIS_COUNTER
+from betterhtmlchunking.stats import ROI_NODES_VISITED_COUNTER
+from betterhtmlchunking.stats import ROI_MAKER_STEPS_COUNTER
 from betterhtmlchunking.tree_representation import\
     get_xpath_depth
 
@@ -18,6 +30,10 @@ from enum import StrEnum
 from typing import Iterator
 from typing import Any
 from typing import Optional
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import treelib
 
 # import prettyprinter
 
@@ -28,13 +44,9 @@ from typing import Optional
 #                               #
 #################################
 
-class ROIParsingState(StrEnum):
-    SEEK_END: str = "seek_end"
-    REGION_READY: str = "region_ready"
-    EOF: str = "EOF"
-
-
-@attrs.define()
+# Filled in by CompactROIMaker, which creates one or more per visited node:
+# assignments are not validated.
+@attrs.define(on_setattr=attrs.setters.NO_OP)
 class RegionOfInterest:
     pos_xpath_list: list[str] = attrs.field(
         validator=type_validator(),
@@ -58,17 +70,43 @@ class RegionOfInterest:
 class ReprLengthComparisionBy(StrEnum):
     TEXT_LENGTH: str = "text_length"
     HTML_LENGTH: str = "html_length"
+    # Needs a tokenizer, see token_length.py.
+    TOKEN_LENGTH: str = "token_length"
+
+
+def get_repr_lengths(
+    compact_tree: CompactTree,
+    repr_length_compared_by: ReprLengthComparisionBy
+        ) -> array.array:
+    match repr_length_compared_by:
+        case ReprLengthComparisionBy.TEXT_LENGTH:
+            repr_lengths: array.array = compact_tree.text_lengths
+        case ReprLengthComparisionBy.HTML_LENGTH:
+            repr_lengths: array.array = compact_tree.html_lengths
+        case ReprLengthComparisionBy.TOKEN_LENGTH:
+            if compact_tree.token_lengths is None:
+                raise ValueError(
+                    "TOKEN_LENGTH needs the tree to be measured with a "
+                    "tokenizer"
+                )
+            repr_lengths: array.array = compact_tree.token_lengths
 
+    return repr_lengths
 
-@attrs.define()
-class ROIMaker:
-    node_xpath: str = attrs.field(
+
+# Fields are validated on init only: the results are set for every
+# visited node.
+@attrs.define(on_setattr=attrs.setters.NO_OP)
+class CompactROIMaker:
+    node_id: int = attrs.field(
         validator=type_validator()
     )
-    children_tags: list[str] = attrs.field(
-        validator=type_validator()
+    # Only the container type is checked, as for the CompactTree
+    # columns: nodes can have thousands of children.
+    children_ids: list[int] = attrs.field(
+        validator=attrs.validators.instance_of(list)
     )
-    tree_representation: DOMTreeRepresentation = attrs.field(
+    compact_tree: CompactTree = attrs.field(
         validator=type_validator()
     )
     max_node_repr_length: int = attrs.field(
@@ -78,146 +116,164 @@ class ROIMaker:
         validator=type_validator(),
     )
 
-    PARSING_STATE: ROIParsingState = attrs.field(
-        validator=type_validator(),
-        default=ROIParsingState.SEEK_END
-    )
-    children_tags_iter: Iterator[str] = attrs.field(
+    repr_lengths: array.array = attrs.field(
         validator=type_validator(),
         init=False
     )
-    actual_region_of_interest: Any = attrs.field(
+    regions_of_interest_list: list[RegionOfInterest] = attrs.field(
         validator=type_validator(),
         init=False
     )
-    regions_of_interest_list: list[RegionOfInterest] = attrs.field(
+    children_to_enqueue: list[int] = attrs.field(
         validator=type_validator(),
         init=False
     )
-    children_to_enqueue: list[str] = attrs.field(
+    steps: int = attrs.field(
         validator=type_validator(),
-        init=False
+        init=False,
+        default=0
     )
 
     def __attrs_post_init__(self) -> None:
-        # print(f"> ROIMaker: Node XPATH: {self.node_xpath}")
-
-        self.regions_of_interest_list: list[RegionOfInterest] = []
-        self.children_to_enqueue: list[str] = []
-        self.actual_region_of_interest = RegionOfInterest()
+        self.repr_lengths = get_repr_lengths(
+            compact_tree=self.compact_tree,
+            repr_length_compared_by=self.repr_length_compared_by
+        )
 
         # Explore for ROIs on children.
-        self.children_tags_iter = iter(self.children_tags)
-
-        self.actual_region_of_interest.node_is_roi = False
-
-        self.step()
-        while self.PARSING_STATE != ROIParsingState.EOF:
-            self.step()
+        packing: ChildrenPacking = pack_children(
+            repr_lengths=self.repr_lengths,
+            children_ids=self.children_ids,
+            max_node_repr_length=self.max_node_repr_length
+        )
+        self.steps = packing.steps
+        self.children_to_enqueue = [
+            self.children_ids[child_idx]
+            for child_idx in packing.children_to_enqueue
+        ]
 
         node_is_roi: bool = False
-        if len(self.children_tags) == 0:
+        if len(self.children_ids) == 0:
             node_is_roi = True
-        elif len(self.regions_of_interest_list) == 1:
-            roi = self.regions_of_interest_list[0]
-            if len(roi.pos_xpath_list) == len(self.children_tags):
+        elif len(packing.regions) == 1:
+            if packing.get_span_count(region_idx=0) ==\
+                    len(self.children_ids):
                 node_is_roi = True
 
         # Node itself is ROI.
         if node_is_roi is True:
-            # print(f"> Node itself is ROI: {self.node_xpath}")
-            node: treelib.Node =\
-                self.tree_representation.tree.get_node(
-                    nid=self.node_xpath
-                )
+            roi = RegionOfInterest()
+            roi.repr_length = self.get_node_repr_length(node_id=self.node_id)
+            roi.pos_xpath_list.append(
+                self.compact_tree.pos_xpaths[self.node_id]
+            )
+            roi.node_is_roi = True
+            self.regions_of_interest_list = [roi]
+            return None
 
-            node_repr_length: int =\
-                self.get_node_repr_length(node=node)
+        # Regions left empty by children sent deeper are dropped.
+        pos_xpaths: list[str] = self.compact_tree.pos_xpaths
+        self.regions_of_interest_list = []
+        for spans, repr_length in zip(packing.regions, packing.repr_lengths):
+            roi = RegionOfInterest()
+            for start, end in spans:
+                roi.pos_xpath_list += [
+                    pos_xpaths[child_id]
+                    for child_id in self.children_ids[start:end]
+                ]
+            if roi.pos_xpath_list == []:
+                continue
+            roi.repr_length = repr_length
+            self.regions_of_interest_list.append(roi)
 
-            # prettyprinter.cpprint(node_repr_length)
+        return None
 
-            # if node_repr_length > self.max_node_repr_length:
-            self.actual_region_of_interest.repr_length =\
-                node_repr_length
-            self.actual_region_of_interest.pos_xpath_list.append(
-                self.node_xpath
-            )
-            self.actual_region_of_interest.node_is_roi = True
+    def get_node_repr_length(self, node_id: int) -> int:
+        return self.repr_lengths[node_id]
 
-            self.regions_of_interest_list = []
 
-            self.regions_of_interest_list.append(
-                self.actual_region_of_interest
-            )
+class ROIParsingState(StrEnum):
+    SEEK_END: str = "seek_end"
+    REGION_READY: str = "region_ready"
+    EOF: str = "EOF"
 
-        return None
 
-    def get_node_repr_length(self, node: treelib.Node) -> int:
-        match self.repr_length_compared_by:
-            case ReprLengthComparisionBy.TEXT_LENGTH:
-                node_repr_length: int = node.data.text_length
-            case ReprLengthComparisionBy.HTML_LENGTH:
-                node_repr_length: int = node.data.html_length
-
-        return node_repr_length
-
-    # Based on XMLStreamer.
-    def step(self):
-        match self.PARSING_STATE:
-            case ROIParsingState.SEEK_END:
-                # print("> SEEK END:")
-                try:
-                    children_tag: str = next(self.children_tags_iter)
-                    # print(f"children_tag: {children_tag}")
-                    node: treelib.Node =\
-                        self.tree_representation.tree.get_node(
-                            nid=children_tag
-                        )
-
-                    node_repr_length: int = self.get_node_repr_length(
-                        node=node
-                    )
-                    # print(f"node_repr_length: {node_repr_length}")
-
-                    if node_repr_length >= self.max_node_repr_length:
-                        self.PARSING_STATE = ROIParsingState.REGION_READY
-                        self.children_to_enqueue.append(children_tag)
-                    else:
-                        proposed_repr_length: int = node_repr_length +\
-                            self.actual_region_of_interest.repr_length
-
-                        # print(f"proposed_repr_length: {proposed_repr_length}")
-
-                        self.actual_region_of_interest.pos_xpath_list.append(
-                            node.identifier
-                        )
-                        self.actual_region_of_interest.repr_length =\
-                            proposed_repr_length
-
-                        if proposed_repr_length >= self.max_node_repr_length:
-                            self.PARSING_STATE = ROIParsingState.REGION_READY
-
-                except StopIteration:
-                    self.PARSING_STATE = ROIParsingState.EOF
-                    # print("StopIteration.")
-                    # prettyprinter.cpprint(self.actual_region_of_interest)
-                    if self.actual_region_of_interest.repr_length > 0 and\
-                            len(self.regions_of_interest_list) > 0:
-                        # print("Hanging xpaths.")
-                        self.regions_of_interest_list[-1].repr_length +=\
-                            self.actual_region_of_interest.repr_length
-                        self.regions_of_interest_list[-1].pos_xpath_list +=\
-                            self.actual_region_of_interest.pos_xpath_list
-                        self.actual_region_of_interest = RegionOfInterest()
-
-            case ROIParsingState.REGION_READY:
-                # print("> REGION READY:")
-                self.regions_of_interest_list.append(
-                    self.actual_region_of_interest
-                )
+@attrs.define()
+class ROIMaker:
+    """Deprecated: the regions of a node, by pos_xpath.
+
+    The former interface, over tree_representation.tree. Runs
+    CompactROIMaker on tree_representation.compact_tree, with the same
+    results: regions_of_interest_list, and children_to_enqueue as
+    pos_xpaths. Regions are made in __init__, which leaves
+    PARSING_STATE at EOF as before.
+    """
+    node_xpath: str = attrs.field(
+        validator=type_validator()
+    )
+    children_tags: list[str] = attrs.field(
+        validator=type_validator()
+    )
+    tree_representation: DOMTreeRepresentation = attrs.field(
+        validator=type_validator()
+    )
+    max_node_repr_length: int = attrs.field(
+        validator=type_validator()
+    )
+    repr_length_compared_by: ReprLengthComparisionBy = attrs.field(
+        validator=type_validator(),
+    )
+
+    PARSING_STATE: ROIParsingState = attrs.field(
+        validator=type_validator(),
+        default=ROIParsingState.SEEK_END
+    )
+    regions_of_interest_list: list[RegionOfInterest] = attrs.field(
+        validator=type_validator(),
+        init=False
+    )
+    children_to_enqueue: list[str] = attrs.field(
+        validator=type_validator(),
+        init=False
+    )
 
-                self.PARSING_STATE = ROIParsingState.SEEK_END
-                self.actual_region_of_interest = RegionOfInterest()
+    def __attrs_post_init__(self) -> None:
+        warnings.warn(
+            "ROIMaker is deprecated, use CompactROIMaker with the node ids "
+            "of tree_representation.compact_tree",
+            DeprecationWarning,
+            stacklevel=3
+        )
+        compact_tree: CompactTree = self.tree_representation.compact_tree
+        region_of_interest_maker = CompactROIMaker(
+            node_id=compact_tree.get_node_id(pos_xpath=self.node_xpath),
+            children_ids=[
+                compact_tree.get_node_id(pos_xpath=children_tag)
+                for children_tag in self.children_tags
+            ],
+            compact_tree=compact_tree,
+            max_node_repr_length=self.max_node_repr_length,
+            repr_length_compared_by=self.repr_length_compared_by
+        )
+        self.regions_of_interest_list =\
+            region_of_interest_maker.regions_of_interest_list
+        self.children_to_enqueue = [
+            compact_tree.pos_xpaths[child_id]
+            for child_id in region_of_interest_maker.children_to_enqueue
+        ]
+        self.PARSING_STATE = ROIParsingState.EOF
+
+    def get_node_repr_length(self, node: "treelib.Node") -> int:
+        return get_repr_lengths(
+            compact_tree=self.tree_representation.compact_tree,
+            repr_length_compared_by=self.repr_length_compared_by
+        )[self.tree_representation.compact_tree.get_node_id(
+            pos_xpath=node.identifier
+        )]
+
+    def step(self) -> None:
+        # Every child is taken in __init__: nothing is left at EOF.
+        return None
 
 
 def order_regions_of_interest_by_pos_xpath(
@@ -242,6 +298,449 @@ def order_regions_of_interest_by_pos_xpath(
     return sorted_regions
 
 
+def get_root_node_id(
+    compact_tree: CompactTree,
+    root_xpath: Optional[str] = None
+        ) -> Optional[int]:
+    if root_xpath is not None:
+        return compact_tree.get_node_id(pos_xpath=root_xpath)
+    if "/html" in compact_tree.node_ids:
+        return compact_tree.get_node_id(pos_xpath="/html")
+    if len(compact_tree) > 0:
+        return 0
+    return None
+
+
+def iter_explored_regions(
+    compact_tree: CompactTree,
+    root_id: int,
+    max_node_repr_length: int,
+    repr_length_compared_by: ReprLengthComparisionBy
+        ) -> Iterator[RegionOfInterest]:
+    # Each entry is an iterator of (node id, region or None) where None
+    # means that node has to be explored.
+    stack: list[Iterator[tuple[int, Optional[RegionOfInterest]]]] = [
+        iter([(root_id, None)])
+    ]
+    while stack:
+        item = next(stack[-1], None)
+        if item is None:
+            stack.pop()
+            continue
+
+        node_id, roi = item
+        if roi is not None:
+            yield roi
+            continue
+
+        region_of_interest_maker = CompactROIMaker(
+            node_id=node_id,
+            children_ids=compact_tree.get_children(node_id=node_id),
+            compact_tree=compact_tree,
+            max_node_repr_length=max_node_repr_length,
+            repr_length_compared_by=repr_length_compared_by
+        )
+        # A region starts at its first node, the subtree of an explored
+        # child lies between the child and its next sibling.
+        items: list[tuple[int, Optional[RegionOfInterest]]] = [
+            (compact_tree.get_node_id(pos_xpath=roi.pos_xpath_list[0]), roi)
+            for roi in region_of_interest_maker.regions_of_interest_list
+            if roi.pos_xpath_list != []
+        ]
+        items += [
+            (child_id, None)
+            for child_id in region_of_interest_maker.children_to_enqueue
+        ]
+        items.sort(key=lambda item: item[0])
+        stack.append(iter(items))
+
+
+def iter_regions_of_interest(
+    tree_representation: DOMTreeRepresentation,
+    max_node_repr_length: int,
+    repr_length_compared_by: ReprLengthComparisionBy =\
+        ReprLengthComparisionBy.HTML_LENGTH,
+    root_xpath: Optional[str] = None,
+    layout_cache: Optional[Any] = None,
+    stats_recorder: Optional[StatsRecorder] = None
+        ) -> Iterator[RegionOfInterest]:
+    """Yield the regions of TreeRegionsSystem, in the same order.
+
+    Depth first instead of breadth first: the regions of a node and the
+    children it sends deeper are visited in child order, so each region
+    is final, and yielded, as soon as it is reached. With a layout_cache
+    the regions are planned up front.
+    """
+    compact_tree: CompactTree = tree_representation.compact_tree
+    root_id: Optional[int] = get_root_node_id(
+        compact_tree=compact_tree,
+        root_xpath=root_xpath
+    )
+    if root_id is None:
+        return
+
+    if layout_cache is None:
+        regions: Iterator[RegionOfInterest] = iter_explored_regions(
+            compact_tree=compact_tree,
+            root_id=root_id,
+            max_node_repr_length=max_node_repr_length,
+            repr_length_compared_by=repr_length_compared_by
+        )
+    else:
+        regions = iter(layout_cache.plan(
+            compact_tree=compact_tree,
+            root_id=root_id,
+            max_node_repr_length=max_node_repr_length,
+            repr_length_compared_by=repr_length_compared_by,
+            stats_recorder=stats_recorder
+        ))
+
+    any_region: bool = False
+    for roi in regions:
+        any_region = True
+        yield roi
+
+    # Same fallback as TreeRegionsSystem.
+    if any_region is False and len(compact_tree) > 0:
+        roi = RegionOfInterest()
+        roi.pos_xpath_list = [compact_tree.pos_xpaths[0]]
+        roi.repr_length = get_repr_lengths(
+            compact_tree=compact_tree,
+            repr_length_compared_by=repr_length_compared_by
+        )[0]
+        roi.node_is_roi = True
+        yield roi
+
+
+# Entries of the regions kept for a subtree, in document order. XPaths
+# are relative to the subtree root ("" is the root itself).
+REGION_ENTRY: str = "region"
+NODE_ENTRY: str = "node"
+
+
+def relative_xpath(pos_xpath: str, root_xpath: str) -> str:
+    return pos_xpath[len(root_xpath):]
+
+
+def make_region(
+    pos_xpath_list: list[str],
+    repr_length: int,
+    node_is_roi: bool
+        ) -> RegionOfInterest:
+    roi = RegionOfInterest()
+    roi.pos_xpath_list = pos_xpath_list
+    roi.repr_length = repr_length
+    roi.node_is_roi = node_is_roi
+    return roi
+
+
+@attrs.define()
+class RegionPlanner:
+    # Same regions, in the same order, as iter_regions_of_interest, with
+    # the regions of already seen subtrees taken from previous_regions.
+    # Subtrees are keyed by subtree_hashes (see incremental.py).
+    compact_tree: CompactTree = attrs.field(
+        validator=type_validator()
+    )
+    subtree_hashes: list[str] = attrs.field(
+        validator=attrs.validators.instance_of(list)
+    )
+    max_node_repr_length: int = attrs.field(
+        validator=type_validator()
+    )
+    repr_length_compared_by: ReprLengthComparisionBy = attrs.field(
+        validator=type_validator()
+    )
+    previous_regions: dict[str, list[list]] = attrs.field(
+        validator=attrs.validators.instance_of(dict),
+        factory=dict
+    )
+    # Entries of every subtree visited in this run.
+    subtree_regions: dict[str, list[list]] = attrs.field(
+        validator=attrs.validators.instance_of(dict),
+        init=False,
+        factory=dict
+    )
+    reused_subtrees: int = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=0
+    )
+
+    def get_entries(self, node_id: int) -> list[list]:
+        subtree_hash: str = self.subtree_hashes[node_id]
+        entries: Optional[list[list]] =\
+            self.subtree_regions.get(subtree_hash)
+        if entries is not None:
+            return entries
+
+        entries = self.previous_regions.get(subtree_hash)
+        if entries is not None:
+            entries = self.reuse_entries(node_id=node_id, entries=entries)
+        if entries is not None:
+            self.reused_subtrees += 1
+        else:
+            entries = self.explore(node_id=node_id)
+        self.subtree_regions[subtree_hash] = entries
+        return entries
+
+    def reuse_entries(
+        self,
+        node_id: int,
+        entries: list[list]
+            ) -> Optional[list[list]]:
+        # Entries to use for a previously seen subtree, None to explore
+        # it again.
+        return entries
+
+    def explore(self, node_id: int) -> list[list]:
+        compact_tree: CompactTree = self.compact_tree
+        root_xpath: str = compact_tree.pos_xpaths[node_id]
+        region_of_interest_maker = CompactROIMaker(
+            node_id=node_id,
+            children_ids=compact_tree.get_children(node_id=node_id),
+            compact_tree=compact_tree,
+            max_node_repr_length=self.max_node_repr_length,
+            repr_length_compared_by=self.repr_length_compared_by
+        )
+        items: list[tuple[int, list]] = [
+            (
+                compact_tree.get_node_id(pos_xpath=roi.pos_xpath_list[0]),
+                [
+                    REGION_ENTRY,
+                    [relative_xpath(pos_xpath, root_xpath)
+                     for pos_xpath in roi.pos_xpath_list],
+                    roi.repr_length,
+                    roi.node_is_roi
+                ]
+            )
+            for roi in region_of_interest_maker.regions_of_interest_list
+            if roi.pos_xpath_list != []
+        ]
+        items += [
+            (
+                child_id,
+                [
+                    NODE_ENTRY,
+                    relative_xpath(
+                        compact_tree.pos_xpaths[child_id], root_xpath
+                    )
+                ]
+            )
+            for child_id in region_of_interest_maker.children_to_enqueue
+        ]
+        items.sort(key=lambda item: item[0])
+        return [entry for _, entry in items]
+
+    def iter_regions(self, root_id: int) -> Iterator[RegionOfInterest]:
+        stack: list[tuple[str, Iterator[list]]] = [
+            (
+                self.compact_tree.pos_xpaths[root_id],
+                iter(self.get_entries(node_id=root_id))
+            )
+        ]
+        while stack:
+            root_xpath, entries = stack[-1]
+            entry: Optional[list] = next(entries, None)
+            if entry is None:
+                stack.pop()
+            elif entry[0] == REGION_ENTRY:
+                yield make_region(
+                    pos_xpath_list=[root_xpath + pos_xpath
+                                    for pos_xpath in entry[1]],
+                    repr_length=entry[2],
+                    node_is_roi=entry[3]
+                )
+            else:
+                child_xpath: str = root_xpath + entry[1]
+                stack.append(
+                    (
+                        child_xpath,
+                        iter(self.get_entries(
+                            node_id=self.compact_tree.get_node_id(
+                                pos_xpath=child_xpath
+                            )
+                        ))
+                    )
+                )
+
+    def plan(self) -> list[RegionOfInterest]:
+        root_id: Optional[int] = get_root_node_id(
+            compact_tree=self.compact_tree
+        )
+        if root_id is None:
+            return []
+        regions: list[RegionOfInterest] = list(
+            self.iter_regions(root_id=root_id)
+        )
+        # Same fallback as TreeRegionsSystem.
+        if not regions:
+            regions.append(
+                make_region(
+                    pos_xpath_list=[self.compact_tree.pos_xpaths[0]],
+                    repr_length=get_repr_lengths(
+                        compact_tree=self.compact_tree,
+                        repr_length_compared_by=self.repr_length_compared_by
+                    )[0],
+                    node_is_roi=True
+                )
+            )
+        return regions
+
+
+# The subtrees CompactROIMaker sends deeper are explored independently of each
+# other. With discovery_workers > 1 and Python running without the GIL,
+# a large document is explored breadth first until enough subtrees are
+# waiting, and these are then explored on a thread pool. The regions
+# are sorted in document order as usual, so the result does not depend
+# on the pool.
+#
+# There is no process pool: sending the tree columns to the workers and
+# pickling the regions back made discovery 2-3x slower than serial, so
+# with the GIL discovery stays in the calling thread, with a
+# RuntimeWarning when more workers were asked for.
+
+# Below this many nodes the pool costs more than it saves.
+MIN_PARALLEL_NODES: int = 20000
+# Batches of subtrees per worker, to even out their sizes.
+BATCHES_PER_WORKER: int = 4
+
+
+@attrs.define()
+class SubtreesExploration:
+    regions: list[RegionOfInterest] = attrs.field(
+        validator=attrs.validators.instance_of(list),
+        factory=list
+    )
+    # Subtrees left to explore when the exploration stopped early.
+    frontier: list[int] = attrs.field(
+        validator=attrs.validators.instance_of(list),
+        factory=list
+    )
+    nodes_visited: int = attrs.field(
+        validator=type_validator(),
+        default=0
+    )
+    maker_steps: int = attrs.field(
+        validator=type_validator(),
+        default=0
+    )
+
+    def merge(self, exploration: "SubtreesExploration") -> None:
+        self.regions += exploration.regions
+        self.nodes_visited += exploration.nodes_visited
+        self.maker_steps += exploration.maker_steps
+
+
+def explore_subtrees(
+    compact_tree: CompactTree,
+    root_ids: list[int],
+    max_node_repr_length: int,
+    repr_length_compared_by: ReprLengthComparisionBy,
+    max_frontier: Optional[int] = None
+        ) -> SubtreesExploration:
+    """Run CompactROIMaker breadth first from root_ids.
+
+    With max_frontier, stop as soon as that many subtrees are waiting
+    to be explored, and leave them in ``frontier``.
+    """
+    exploration = SubtreesExploration()
+    subtrees_queue: deque[int] = deque(root_ids)
+
+    while subtrees_queue:
+        if max_frontier is not None and\
+                len(subtrees_queue) >= max_frontier:
+            break
+        node_id: int = subtrees_queue.popleft()
+
+        region_of_interest_maker = CompactROIMaker(
+            node_id=node_id,
+            children_ids=compact_tree.get_children(node_id=node_id),
+            compact_tree=compact_tree,
+            max_node_repr_length=max_node_repr_length,
+            repr_length_compared_by=repr_length_compared_by
+        )
+
+        for roi in region_of_interest_maker.regions_of_interest_list:
+            # If we are based on text_length,
+            # tags like img (text_length == 0) are ignored.
+            # For that reason we base ROI on pos_xpath_list.
+            # if roi.text_length > 0:
+            if roi.pos_xpath_list != []:
+                exploration.regions.append(roi)
+
+        """
+        Try to make ROIs under.
+        If ROI occupy all children, ROI contains node itself.
+
+        Those elements who are not ROI, are put into queue.
+        Elements who are ROI, are put into a separate dict.
+        """
+        subtrees_queue.extend(region_of_interest_maker.children_to_enqueue)
+
+        exploration.nodes_visited += 1
+        exploration.maker_steps += region_of_interest_maker.steps
+
+    exploration.frontier = list(subtrees_queue)
+    return exploration
+
+
+def split_subtrees(
+    compact_tree: CompactTree,
+    subtree_ids: list[int],
+    batches: int
+        ) -> list[list[int]]:
+    # Consecutive subtrees, about the same number of nodes per batch.
+    sizes: list[int] = [
+        compact_tree.get_subtree_end(node_id=node_id) - node_id
+        for node_id in subtree_ids
+    ]
+    batch_size: float = sum(sizes) / batches
+
+    split: list[list[int]] = [[]]
+    batch_nodes: int = 0
+    for node_id, size in zip(subtree_ids, sizes):
+        if batch_nodes >= batch_size:
+            split.append([])
+            batch_nodes = 0
+        split[-1].append(node_id)
+        batch_nodes += size
+    return split
+
+
+def is_free_threaded() -> bool:
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def explore_subtrees_in_pool(
+    compact_tree: CompactTree,
+    subtree_ids: list[int],
+    max_node_repr_length: int,
+    repr_length_compared_by: ReprLengthComparisionBy,
+    workers: int
+        ) -> list[SubtreesExploration]:
+    """Explorations of every batch of subtrees, in subtree order."""
+    # Not needed by serial discovery.
+    from concurrent.futures import ThreadPoolExecutor
+
+    batches: list[list[int]] = split_subtrees(
+        compact_tree=compact_tree,
+        subtree_ids=subtree_ids,
+        batches=workers * BATCHES_PER_WORKER
+    )
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+            lambda root_ids: explore_subtrees(
+                compact_tree=compact_tree,
+                root_ids=root_ids,
+                max_node_repr_length=max_node_repr_length,
+                repr_length_compared_by=repr_length_compared_by
+            ),
+            batches
+        ))
+
+
 @attrs.define()
 class TreeRegionsSystem:
     tree_representation: DOMTreeRepresentation = attrs.field(
@@ -266,129 +765,140 @@ class TreeRegionsSystem:
         validator=type_validator(),
         default=ReprLengthComparisionBy.HTML_LENGTH
     )
+    stats_recorder: Optional[StatsRecorder] = attrs.field(
+        validator=type_validator(),
+        default=None,
+        repr=False
+    )
+    # A LayoutCache (see layout_cache.py) reusing the regions of pages
+    # with the same structure.
+    layout_cache: Optional[Any] = attrs.field(
+        validator=type_validator(),
+        default=None,
+        repr=False
+    )
+    # Threads exploring the subtrees of large documents when Python
+    # runs without the GIL, 1 explores them in the calling thread. More
+    # than 1 with the GIL only warns.
+    discovery_workers: int = attrs.field(
+        validator=type_validator(),
+        default=1
+    )
 
     def __attrs_post_init__(self):
+        if self.discovery_workers < 1:
+            raise ValueError(
+                f"discovery_workers must be at least 1, got "
+                f"{self.discovery_workers}"
+            )
+        if self.discovery_workers > 1 and not is_free_threaded():
+            warnings.warn(
+                "discovery_workers > 1 needs Python running without the "
+                "GIL; regions are discovered in the calling thread",
+                RuntimeWarning,
+                stacklevel=2
+            )
         self.start()
 
     def print_tree_node_states(self):
         print("--- PRINT TREE NODE STATES ---")
-        for pos_xpath in self.tree_representation.pos_xpaths_list:
+        compact_tree: CompactTree = self.tree_representation.compact_tree
+        for node_id, pos_xpath in enumerate(compact_tree.pos_xpaths):
             pad: str = get_xpath_depth(xpath=pos_xpath) * " " * 4
-            node = self.tree_representation.tree.get_node(pos_xpath)
             print(f"{pad}|")
             print(f"{pad}| {pos_xpath}")
-            print(f"{pad}| Text length: {node.data.text_length}")
-            print(f"{pad}| HTML length: {node.data.html_length}")
+            print(f"{pad}| Text length: {compact_tree.text_lengths[node_id]}")
+            print(f"{pad}| HTML length: {compact_tree.html_lengths[node_id]}")
+            if compact_tree.token_lengths is not None:
+                print(
+                    f"{pad}| Token length: "
+                    f"{compact_tree.token_lengths[node_id]}"
+                )
 
-    def get_node_repr_length(self, node: treelib.Node) -> int:
-        match self.repr_length_compared_by:
-            case ReprLengthComparisionBy.TEXT_LENGTH:
-                node_repr_length: int = node.data.text_length
-            case ReprLengthComparisionBy.HTML_LENGTH:
-                node_repr_length: int = node.data.html_length
+    def get_node_repr_length(self, node_id: int) -> int:
+        repr_lengths: array.array = get_repr_lengths(
+            compact_tree=self.tree_representation.compact_tree,
+            repr_length_compared_by=self.repr_length_compared_by
+        )
+        return repr_lengths[node_id]
+
+    def discover_regions(self, root_id: int) -> list[RegionOfInterest]:
+        compact_tree: CompactTree = self.tree_representation.compact_tree
+        parallel: bool = self.discovery_workers > 1 and\
+            len(compact_tree) >= MIN_PARALLEL_NODES and is_free_threaded()
+
+        exploration: SubtreesExploration = explore_subtrees(
+            compact_tree=compact_tree,
+            root_ids=[root_id],
+            max_node_repr_length=self.max_node_repr_length,
+            repr_length_compared_by=self.repr_length_compared_by,
+            max_frontier=self.discovery_workers * BATCHES_PER_WORKER
+            if parallel else None
+        )
+        if exploration.frontier:
+            for subtrees_exploration in explore_subtrees_in_pool(
+                    compact_tree=compact_tree,
+                    subtree_ids=exploration.frontier,
+                    max_node_repr_length=self.max_node_repr_length,
+                    repr_length_compared_by=self.repr_length_compared_by,
+                    workers=self.discovery_workers):
+                exploration.merge(exploration=subtrees_exploration)
+        self.regions_of_interest_list.extend(exploration.regions)
+
+        if self.stats_recorder is not None:
+            self.stats_recorder.count(
+                name=ROI_NODES_VISITED_COUNTER,
+                value=exploration.nodes_visited
+            )
+            self.stats_recorder.count(
+                name=ROI_MAKER_STEPS_COUNTER,
+                value=exploration.maker_steps
+            )
 
-        return node_repr_length
+        return order_regions_of_interest_by_pos_xpath(
+            region_of_interest_list=self.regions_of_interest_list,
+            pos_xpaths_list=self.tree_representation.pos_xpaths_list
+        )
 
     def start(self):
         self.regions_of_interest_list: list[RegionOfInterest] = []
 
-        subtrees_queue = queue.Queue()
-
-        if self.root_xpath is not None:
-            root_xpath = self.root_xpath
-        elif "/html" in self.tree_representation.pos_xpaths_list:
-            root_xpath = "/html"
-        elif self.tree_representation.pos_xpaths_list:
-            root_xpath = self.tree_representation.pos_xpaths_list[0]
-        else:
+        compact_tree: CompactTree = self.tree_representation.compact_tree
+        root_id: Optional[int] = get_root_node_id(
+            compact_tree=compact_tree,
+            root_xpath=self.root_xpath
+        )
+        if root_id is None:
             self.sorted_roi_by_pos_xpath = {}
             return
 
-        subtrees_queue.put(root_xpath)
-
-        while subtrees_queue.empty() is False:
-            # print("#" * 100)
-            node_xpath: str = subtrees_queue.get()
-            # print("--- NODE XPATH ---")
-            # print(node_xpath)
-
-            node: treelib.Node = self.tree_representation.tree.get_node(
-                node_xpath
-            )
-            # print(node.data.text_length)
-
-            children_tags: list[str] =\
-                self.tree_representation.get_children_tag_list(
-                    xpath=node_xpath
-                )
-
-            region_of_interest_maker = ROIMaker(
-                node_xpath=node_xpath,
-                children_tags=children_tags,
-                tree_representation=self.tree_representation,
+        if self.layout_cache is None:
+            sorted_regions: list[RegionOfInterest] =\
+                self.discover_regions(root_id=root_id)
+        else:
+            # Already in document order.
+            sorted_regions = self.layout_cache.plan(
+                compact_tree=compact_tree,
+                root_id=root_id,
                 max_node_repr_length=self.max_node_repr_length,
-                repr_length_compared_by=self.repr_length_compared_by
-            )
-
-            # print("--- REGIONS OF INTEREST LIST ---")
-            # prettyprinter.cpprint(region_of_interest_maker.regions_of_interest_list)
-
-            for roi in region_of_interest_maker.regions_of_interest_list:
-                # If we are based on text_length,
-                # tags like img (text_length == 0) are ignored.
-                # For that reason we base ROI on pos_xpath_list.
-                # if roi.text_length > 0:
-                if roi.pos_xpath_list != []:
-                    self.regions_of_interest_list.append(roi)
-
-            # print("--- CHILDREN TO ENQUEUE ---")
-            # prettyprinter.cpprint(region_of_interest_maker.children_to_enqueue)
-
-            """
-            Try to make ROIs under.
-            If ROI occupy all children, ROI contains node itself.
-
-            Those elements who are not ROI, are put into queue.
-            Elements who are ROI, are put into a separate dict.
-            """
-
-            for child_tag in region_of_interest_maker.children_to_enqueue:
-                subtrees_queue.put(child_tag)
-
-            """
-            for child_tag in children_tags:
-                subtrees_queue.put(child_tag)
-            """
-
-        sorted_regions: list[RegionOfInterest] =\
-            order_regions_of_interest_by_pos_xpath(
-                region_of_interest_list=\
-                self.regions_of_interest_list,
-                pos_xpaths_list=\
-                self.tree_representation.pos_xpaths_list
+                repr_length_compared_by=self.repr_length_compared_by,
+                stats_recorder=self.stats_recorder
             )
+            self.regions_of_interest_list.extend(sorted_regions)
 
         # This happen when there are no nodes to detect as RegionOfInterest
         # or when max_node_repr_length is greater than total repr_length in
         # the document.
-        if sorted_regions == [] and\
-                len(self.tree_representation.pos_xpaths_list) > 0:
-            node_xpath: str = self.tree_representation.pos_xpaths_list[0]
-
-            node: treelib.Node = self.tree_representation.tree.get_node(
-                node_xpath
-            )
-
-            node_repr_length: int = self.get_node_repr_length(
-                node=node
-            )
-            # print(node_repr_length)
-
+        if sorted_regions == [] and len(compact_tree) > 0:
             roi = RegionOfInterest()
-            roi.pos_xpath_list = [node_xpath]
-            roi.repr_length = node_repr_length
+            roi.pos_xpath_list = [compact_tree.pos_xpaths[0]]
+            roi.repr_length = self.get_node_repr_length(node_id=0)
             roi.node_is_roi = True
 
             sorted_regions = [roi]
 
         self.sorted_roi_by_pos_xpath = dict(enumerate(sorted_regions))
+        if self.stats_recorder is not None:
+            self.stats_recorder.set_counter(
+                name=ROIS_COUNTER, value=len(self.sorted_roi_by_pos_xpath)
+            )
@@ -1,15 +1,64 @@
 #!/usr/bin/env python3
 
+import array
+
 import attrs
 from attrs_strict import type_validator
 
-import parsel_text
-
-import treelib
-
-import bs4
+import lxml.etree
+
+import mmap
+
+from betterhtmlchunking.node_metrics import MetricsMode
+from betterhtmlchunking.node_metrics import HtmlSerialization
+from betterhtmlchunking.node_metrics import measure_bs4_tree
+from betterhtmlchunking.node_metrics import measure_lxml_tree
+from betterhtmlchunking.node_metrics import iter_bs4_pos_xpaths
+from betterhtmlchunking.node_metrics import MeasuredTree
+from betterhtmlchunking.node_metrics import NO_TEXT_SPAN
+from betterhtmlchunking.node_metrics import fix_text
+
+from betterhtmlchunking.compact_tree import CompactTree
+from betterhtmlchunking.compact_tree import NO_NODE
+
+from betterhtmlchunking.stats import StatsRecorder
+from betterhtmlchunking.stats import record_stage
+from betterhtmlchunking.stats import PARSE_STAGE
+from betterhtmlchunking.stats import METRICS_STAGE
+from betterhtmlchunking.stats import FILTER_STAGE
+from betterhtmlchunking.stats import TREE_STAGE
+from betterhtmlchunking.stats import NODES_COUNTER
+from betterhtmlchunking.stats import FILTERED_OUT_COUNTER
+from betterhtmlchunking.stats import TOKENIZED_SEGMENTS_COUNTER
+from betterhtmlchunking.stats import TOKEN_CACHE_HITS_COUNTER
+
+from betterhtmlchunking.token_length import TokenCounter
+
+from betterhtmlchunking.html_source import HtmlSourceT
+from betterhtmlchunking.html_source import validate_html_source
+from betterhtmlchunking.html_source import open_html_source
+from betterhtmlchunking.html_source import get_soup_markup
+
+from betterhtmlchunking.lxml_backend import ParserBackend
+from betterhtmlchunking.lxml_backend import make_lxml_root
+from betterhtmlchunking.lxml_backend import prettify_lxml_element
+from betterhtmlchunking.lxml_backend import decode_lxml_element
+from betterhtmlchunking.lxml_backend import get_lxml_elem_text
+
+from betterhtmlchunking.source_spans import SourceSpanT
+from betterhtmlchunking.source_spans import SourceSpanRecorder
+from betterhtmlchunking.source_spans import parse_with_source_spans
 
 from typing import Any
+from typing import Optional
+from typing import TYPE_CHECKING
+
+# bs4, parsel_text and treelib are imported where they are used: the
+# lxml backend needs none of them, and treelib only serves the tree
+# property.
+if TYPE_CHECKING:
+    import bs4
+    import treelib
 
 # import prettyprinter
 
@@ -33,6 +82,8 @@ def get_children_tags(node):
 
 
 def get_pos_xpath_from_bs4_elem(element) -> str:
+    import bs4
+
     components = []
     child = element if isinstance(element, bs4.Tag) else element.parent
 
@@ -76,28 +127,128 @@ class NodeMetadata:
         validator=type_validator(),
         default=None
     )
+    # Set instead of bs4_elem with the lxml backend.
+    lxml_elem: Any = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+    # Set when measured with a tokenizer.
+    token_length: Optional[int] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
 
 
 @attrs.define()
 class DOMTreeRepresentation:
-    website_code: str = attrs.field(
-        validator=type_validator()
+    # HTML as text or bytes, a path or a file, see html_source.py.
+    website_code: HtmlSourceT = attrs.field(
+        validator=validate_html_source
     )
-    soup: bs4.BeautifulSoup = attrs.field(
+    metrics_mode: MetricsMode = attrs.field(
         validator=type_validator(),
-        init=False
+        default=MetricsMode.BOTTOM_UP
+    )
+    backend: ParserBackend = attrs.field(
+        validator=type_validator(),
+        default=ParserBackend.BS4
+    )
+    # How nodes are serialized, both for html_length and for renders.
+    html_serialization: HtmlSerialization = attrs.field(
+        validator=type_validator(),
+        default=HtmlSerialization.PRETTIFIED
+    )
+    # html.unescape the document as it is fed to the parser.
+    html_unescape: bool = attrs.field(
+        validator=type_validator(),
+        default=False
+    )
+    # Record where each element is in the input, see source_spans.py.
+    record_source_spans: bool = attrs.field(
+        validator=type_validator(),
+        default=False
+    )
+    # Elements whose positional XPath contains any of these are left out
+    # while the tree is built, with their subtree.
+    tag_list_to_filter_out: Optional[list[str]] = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+    # Token lengths are measured as well when given.
+    token_counter: Optional[TokenCounter] = attrs.field(
+        validator=type_validator(),
+        default=None,
+        repr=False
+    )
+    # Stage timings and counters are recorded here when given.
+    stats_recorder: Optional[StatsRecorder] = attrs.field(
+        validator=type_validator(),
+        default=None,
+        repr=False
+    )
+    # bs4.BeautifulSoup with the bs4 backend.
+    soup: Any = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=None
+    )
+    # Document root with the lxml backend (None for an empty document).
+    lxml_root: Any = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=None
+    )
+    # Deleted elements with the lxml backend. They stay in the lxml tree,
+    # so that the strings around them are not merged, and are skipped
+    # when measuring and rendering.
+    lxml_removed: set[Any] = attrs.field(
+        validator=type_validator(),
+        init=False,
+        factory=set
     )
 
-    tree: treelib.Tree = attrs.field(
+    # Spans by element (by id with bs4), None when not recorded.
+    source_spans: Optional[dict[Any, SourceSpanT]] = attrs.field(
         validator=type_validator(),
-        init=False
+        init=False,
+        default=None,
+        repr=False
+    )
+    # The input the spans are offsets into, None when it was a path.
+    source_buffer: Any = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=None,
+        repr=False
+    )
+    # Extracted text of the whole document, which text renders are
+    # sliced from (see node_metrics.py). None with MetricsMode.PER_NODE
+    # and the bs4 backend.
+    document_text: Optional[str] = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=None,
+        repr=False
     )
 
-    xpaths_metadata: dict[str, NodeMetadata] = attrs.field(
+    compact_tree: CompactTree = attrs.field(
         validator=type_validator(),
         init=False
     )
 
+    # treelib and per node metadata views of compact_tree, only built
+    # when the tree or xpaths_metadata properties are first used.
+    _tree: Optional[Any] = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=None
+    )
+    _xpaths_metadata: Optional[dict[str, NodeMetadata]] = attrs.field(
+        validator=type_validator(),
+        init=False,
+        default=None
+    )
+
     pos_xpaths_list: list[str] = attrs.field(
         validator=type_validator(),
         init=False
@@ -108,74 +259,375 @@ class DOMTreeRepresentation:
     )
 
     def __attrs_post_init__(self):
+        if self.record_source_spans and self.html_unescape:
+            raise ValueError(
+                "record_source_spans needs html_unescape=False: spans are "
+                "offsets into the input as given."
+            )
         self.start()
 
-    def make_html_soup(self):
+    def make_html_soup(self, document: Any):
+        import bs4
+
         self.soup = bs4.BeautifulSoup(
-            self.website_code,
+            get_soup_markup(
+                document=document, html_unescape=self.html_unescape
+            ),
             features="lxml"
         )
-
-    def compute_xpaths_data(self):
-        children = self.soup.find_all(
-            name=True,
-            recursive=True
+        if self.record_source_spans:
+            self.record_soup_source_spans(document=document)
+
+    def record_soup_source_spans(self, document: Any):
+        # bs4 builds its tags from the same lxml events, in the same
+        # order: the recorded spans are matched to them one to one.
+        recorder = SourceSpanRecorder()
+        try:
+            parse_with_source_spans(document=document, recorder=recorder)
+        except (ValueError, lxml.etree.LxmlError):
+            return
+        tags: list["bs4.Tag"] = self.soup.find_all(True)
+        if len(tags) != len(recorder.spans):
+            return
+        self.source_spans = {
+            id(tag): tuple(span) for tag, span in zip(tags, recorder.spans)
+        }
+
+    def make_lxml_tree(self, document: Any):
+        recorder: Optional[SourceSpanRecorder] = None
+        if self.record_source_spans:
+            recorder = SourceSpanRecorder()
+        self.lxml_root = make_lxml_root(
+            website_code=document,
+            html_unescape=self.html_unescape,
+            span_recorder=recorder
         )
+        self.lxml_removed = set()
+        # Spans are left out when lxml had to parse the document again.
+        if recorder is not None and\
+                (recorder.spans or self.lxml_root is None):
+            self.source_spans = {
+                elem: tuple(span)
+                for elem, span in zip(recorder.elements, recorder.spans)
+            }
+
+    def parse_html(self):
+        self.source_spans = None
+        self.source_buffer = None
+        with open_html_source(source=self.website_code) as document:
+            match self.backend:
+                case ParserBackend.BS4:
+                    self.make_html_soup(document=document)
+                case ParserBackend.LXML:
+                    self.make_lxml_tree(document=document)
+            # A mapped file is closed after parsing.
+            if self.record_source_spans and\
+                    not isinstance(document, mmap.mmap):
+                self.source_buffer = document
+
+    def make_node_metadata(
+        self,
+        elem: Any,
+        text_length: int,
+        html_length: int,
+        token_length: Optional[int] = None
+            ) -> NodeMetadata:
+        node_metadata = NodeMetadata()
+        node_metadata.text_length = text_length
+        node_metadata.html_length = html_length
+        node_metadata.token_length = token_length
+        match self.backend:
+            case ParserBackend.BS4:
+                node_metadata.bs4_elem = elem
+            case ParserBackend.LXML:
+                node_metadata.bs4_elem = None
+                node_metadata.lxml_elem = elem
+        return node_metadata
+
+    def get_node_elem(self, pos_xpath: str) -> Any:
+        return self.compact_tree.elements[
+            self.compact_tree.get_node_id(pos_xpath=pos_xpath)
+        ]
 
-        self.xpaths_metadata: dict[str, Any] = {}
+    def render_elem_html(self, elem: Any) -> str:
+        match self.backend, self.html_serialization:
+            case ParserBackend.BS4, HtmlSerialization.PRETTIFIED:
+                return elem.prettify(formatter="minimal")
+            case ParserBackend.BS4, HtmlSerialization.COMPACT:
+                return elem.decode(formatter="minimal")
+            case ParserBackend.LXML, HtmlSerialization.PRETTIFIED:
+                return prettify_lxml_element(
+                    elem=elem,
+                    skipped=self.lxml_removed
+                )
+            case ParserBackend.LXML, HtmlSerialization.COMPACT:
+                return decode_lxml_element(
+                    elem=elem,
+                    skipped=self.lxml_removed
+                )
+
+    def render_elem_text(self, elem: Any) -> str:
+        match self.backend:
+            case ParserBackend.BS4:
+                import parsel_text
+
+                return parsel_text.get_bs4_soup_text(bs4_soup=elem)
+            case ParserBackend.LXML:
+                return get_lxml_elem_text(
+                    elem=elem,
+                    skipped=self.lxml_removed
+                )
+
+    def get_elem_source_span(self, elem: Any) -> SourceSpanT:
+        match self.backend:
+            case ParserBackend.BS4:
+                return self.source_spans[id(elem)]
+            case ParserBackend.LXML:
+                return self.source_spans[elem]
+
+    def get_node_source_span(self, pos_xpath: str) -> SourceSpanT:
+        """(start, end) of a node in the input: str indices for text,
+        byte offsets otherwise."""
+        if self.compact_tree.source_starts is None:
+            raise ValueError(
+                "No source spans: record_source_spans is off, or the "
+                "document could not be parsed token by token."
+            )
+        node_id: int = self.compact_tree.get_node_id(pos_xpath=pos_xpath)
+        return (
+            self.compact_tree.source_starts[node_id],
+            self.compact_tree.source_ends[node_id]
+        )
 
-        for child in children:
-            pos_xpath: str = get_pos_xpath_from_bs4_elem(
-                element=child
+    def get_node_source(self, pos_xpath: str) -> Any:
+        """The input of a node, without copying it: a str slice for
+        text, a memoryview over byte inputs."""
+        start, end = self.get_node_source_span(pos_xpath=pos_xpath)
+        if self.source_buffer is None:
+            raise ValueError(
+                "The input was read from a path: only spans are kept."
             )
+        if isinstance(self.source_buffer, str):
+            return self.source_buffer[start:end]
+        return memoryview(self.source_buffer)[start:end]
+
+    def render_node_html(self, pos_xpath: str) -> str:
+        return self.render_elem_html(
+            elem=self.get_node_elem(pos_xpath=pos_xpath)
+        )
+
+    def render_node_text(self, pos_xpath: str) -> str:
+        node_id: int = self.compact_tree.get_node_id(pos_xpath=pos_xpath)
+        if self.compact_tree.text_starts is not None:
+            start: int = self.compact_tree.text_starts[node_id]
+            if start != NO_TEXT_SPAN:
+                # parsel_text repairs mojibake over the joined text.
+                return fix_text(
+                    text=self.document_text[
+                        start:self.compact_tree.text_ends[node_id]
+                    ]
+                )
+        return self.render_elem_text(
+            elem=self.compact_tree.elements[node_id]
+        )
 
-            child_text: str = parsel_text.get_bs4_soup_text(
-                bs4_soup=child
+    def compute_xpaths_data(self):
+        if self.token_counter is not None:
+            hits: int = self.token_counter.hits
+            misses: int = self.token_counter.misses
+
+        match self.metrics_mode:
+            case MetricsMode.BOTTOM_UP:
+                measured: MeasuredTree = self.compute_xpaths_data_bottom_up()
+            case MetricsMode.PER_NODE:
+                measured: MeasuredTree = self.compute_xpaths_data_per_node()
+
+        with self.stage(name=TREE_STAGE):
+            source_starts: Optional[array.array] = None
+            source_ends: Optional[array.array] = None
+            if self.source_spans is not None:
+                spans: list[SourceSpanT] = [
+                    self.get_elem_source_span(elem=elem)
+                    for elem in measured.elements
+                ]
+                source_starts = array.array("q", (a for a, _ in spans))
+                source_ends = array.array("q", (b for _, b in spans))
+            self.document_text = measured.text
+            self.compact_tree = CompactTree(
+                pos_xpaths=measured.pos_xpaths,
+                elements=measured.elements,
+                parents=array.array("q", measured.parents),
+                text_lengths=array.array("q", measured.text_lengths),
+                html_lengths=array.array("q", measured.html_lengths),
+                token_lengths=None if self.token_counter is None else
+                array.array("q", measured.token_lengths),
+                source_starts=source_starts,
+                source_ends=source_ends,
+                text_starts=None if measured.text is None else
+                array.array("q", measured.text_starts),
+                text_ends=None if measured.text is None else
+                array.array("q", measured.text_ends)
+            )
+        if self.stats_recorder is not None:
+            self.stats_recorder.set_counter(
+                name=NODES_COUNTER, value=len(self.compact_tree)
             )
-            text_length: int = len(child_text)
+            self.stats_recorder.count(
+                name=FILTERED_OUT_COUNTER, value=len(measured.filtered_out)
+            )
+            if self.token_counter is not None:
+                self.stats_recorder.count(
+                    name=TOKENIZED_SEGMENTS_COUNTER,
+                    value=self.token_counter.misses - misses
+                )
+                self.stats_recorder.count(
+                    name=TOKEN_CACHE_HITS_COUNTER,
+                    value=self.token_counter.hits - hits
+                )
+
+    def stage(self, name: str):
+        return record_stage(stats_recorder=self.stats_recorder, name=name)
+
+    def get_tag_list_to_filter_out(self) -> list[str]:
+        if self.tag_list_to_filter_out is None:
+            return []
+        return self.tag_list_to_filter_out
+
+    def remove_filtered_out(self, elems: list[Any]) -> None:
+        match self.backend:
+            case ParserBackend.BS4:
+                for elem in elems:
+                    elem.decompose()
+            case ParserBackend.LXML:
+                self.lxml_removed.update(elems)
+
+    def measure_tree(self) -> MeasuredTree:
+        match self.backend:
+            case ParserBackend.BS4:
+                return measure_bs4_tree(
+                    soup=self.soup,
+                    formatter="minimal",
+                    tag_list_to_filter_out=self.get_tag_list_to_filter_out(),
+                    token_counter=self.token_counter,
+                    html_serialization=self.html_serialization
+                )
+            case ParserBackend.LXML:
+                return measure_lxml_tree(
+                    root=self.lxml_root,
+                    skipped=self.lxml_removed,
+                    tag_list_to_filter_out=self.get_tag_list_to_filter_out(),
+                    token_counter=self.token_counter,
+                    html_serialization=self.html_serialization
+                )
+
+    def compute_xpaths_data_bottom_up(self) -> MeasuredTree:
+        with self.stage(name=METRICS_STAGE):
+            measured: MeasuredTree = self.measure_tree()
+        with self.stage(name=FILTER_STAGE):
+            self.remove_filtered_out(elems=measured.filtered_out)
+        return measured
+
+    def compute_xpaths_data_per_node(self) -> MeasuredTree:
+        with self.stage(name=METRICS_STAGE):
+            match self.backend:
+                case ParserBackend.BS4:
+                    measured = MeasuredTree()
+                    node_ids: dict[str, int] = {}
+                    for pos_xpath, child in iter_bs4_pos_xpaths(
+                            soup=self.soup,
+                            tag_list_to_filter_out=\
+                            self.get_tag_list_to_filter_out(),
+                            filtered_out=measured.filtered_out):
+                        node_ids[pos_xpath] = measured.add_element(
+                            pos_xpath=pos_xpath,
+                            elem=child,
+                            parent=node_ids.get(
+                                get_parent_xpath(xpath=pos_xpath), NO_NODE
+                            )
+                        )
+                case ParserBackend.LXML:
+                    measured: MeasuredTree = self.measure_tree()
+
+        # Before rendering, so that no render includes them.
+        with self.stage(name=FILTER_STAGE):
+            self.remove_filtered_out(elems=measured.filtered_out)
+
+        with self.stage(name=METRICS_STAGE):
+            for idx, child in enumerate(measured.elements):
+                child_text: str = self.render_elem_text(elem=child)
+                measured.text_lengths[idx] = len(child_text)
+
+                child_html: str = self.render_elem_html(elem=child)
+                measured.html_lengths[idx] = len(child_html)
+
+                # The whole text of every node is tokenized here, the
+                # bottom-up mode sums the counts of its segments.
+                if self.token_counter is not None:
+                    measured.token_lengths[idx] = self.token_counter.count(
+                        text=child_text
+                    )
+
+        return measured
 
-            child_html: str = child.prettify(
-                formatter="minimal"
+    def make_tree_representation(self):
+        # The views are rebuilt on demand from the new compact tree.
+        self._tree = None
+        self._xpaths_metadata = None
+
+    def make_xpaths_metadata(self) -> dict[str, NodeMetadata]:
+        xpaths_metadata: dict[str, NodeMetadata] = {}
+        for node_id, pos_xpath in enumerate(self.compact_tree.pos_xpaths):
+            node_metadata: NodeMetadata = self.make_node_metadata(
+                elem=self.compact_tree.elements[node_id],
+                text_length=self.compact_tree.text_lengths[node_id],
+                html_length=self.compact_tree.html_lengths[node_id],
+                token_length=None if self.compact_tree.token_lengths is None
+                else self.compact_tree.token_lengths[node_id]
             )
-            html_length: int = len(child_html)
+            node_metadata.idx = node_id
+            xpaths_metadata[pos_xpath] = node_metadata
+        return xpaths_metadata
 
-            node_metadata = NodeMetadata()
-            node_metadata.text_length = text_length
-            node_metadata.html_length = html_length
-            node_metadata.bs4_elem = child
+    @property
+    def xpaths_metadata(self) -> dict[str, NodeMetadata]:
+        if self._xpaths_metadata is None:
+            self._xpaths_metadata = self.make_xpaths_metadata()
+        return self._xpaths_metadata
 
-            self.xpaths_metadata[pos_xpath] = node_metadata
+    def make_treelib_tree(self) -> "treelib.Tree":
+        import treelib
 
-    def make_tree_representation(self):
         # Initialize the tree.
-        self.tree = treelib.Tree()
+        tree = treelib.Tree()
 
         # Add the root node:
-        self.tree.create_node(
+        tree.create_node(
             tag="root",
             identifier="root"
         )
 
-        i = 0
         # Add nodes to the tree:
-
+        pos_xpaths: list[str] = self.compact_tree.pos_xpaths
         for pos_xpath, node_metadata in self.xpaths_metadata.items():
-            parent_xpath: str = get_parent_xpath(xpath=pos_xpath)
-
-            node_metadata.idx = i
-
-            self.tree.create_node(
+            parent_id: int = self.compact_tree.parents[node_metadata.idx]
+            tree.create_node(
                 tag=pos_xpath,
                 identifier=pos_xpath,
-                parent=parent_xpath,
+                parent="root" if parent_id == NO_NODE else
+                pos_xpaths[parent_id],
                 data=node_metadata
             )
+        return tree
 
-            i += 1
+    @property
+    def tree(self) -> "treelib.Tree":
+        if self._tree is None:
+            self._tree = self.make_treelib_tree()
+        return self._tree
 
     def define_pos_xpaths_list(self):
         self.pos_xpaths_list: list[str] = list(
-            self.xpaths_metadata.keys()
+            self.compact_tree.pos_xpaths
         )
 
     def sort_pos_xpaths(self):
@@ -186,10 +638,12 @@ class DOMTreeRepresentation:
         )
 
     def get_children_tag_list(self, xpath: str) -> list[str]:
-        children_tags: list[str] = get_children_tags(
-            self.tree.children(xpath)
-        )
-        return children_tags
+        return [
+            self.compact_tree.pos_xpaths[child_id]
+            for child_id in self.compact_tree.iter_children(
+                node_id=self.compact_tree.get_node_id(pos_xpath=xpath)
+            )
+        ]
 
     def delete_node(self, pos_xpath: str) -> None:
         # Delete on treelib.Tree:
@@ -197,20 +651,27 @@ class DOMTreeRepresentation:
         # print(self.tree)
 
         # Delete on soup:
-        node = self.xpaths_metadata[pos_xpath].bs4_elem
-        node.decompose()
+        node = self.get_node_elem(pos_xpath=pos_xpath)
+        match self.backend:
+            case ParserBackend.BS4:
+                node.decompose()
+            case ParserBackend.LXML:
+                self.lxml_removed.add(node)
         # print(self.soup.prettify())
 
-        keys_to_remove: list[str] = [
+        keys_to_remove: set[str] = {
             xpath for xpath in self.pos_xpaths_list
             if xpath.startswith(pos_xpath)
-        ]
+        }
 
         # Delete on metadata all which start with pos_xpath:
         for xpath in keys_to_remove:
             del self.xpaths_metadata[xpath]
 
-        self.define_pos_xpaths_list()
+        self.pos_xpaths_list: list[str] = [
+            xpath for xpath in self.pos_xpaths_list
+            if xpath not in keys_to_remove
+        ]
         self.sort_pos_xpaths()
 
         # After operating with node deletion
@@ -218,10 +679,12 @@ class DOMTreeRepresentation:
 
     def recompute_representation(self):
         self.compute_xpaths_data()
-        self.make_tree_representation()
-        self.define_pos_xpaths_list()
-        self.sort_pos_xpaths()
+        with self.stage(name=TREE_STAGE):
+            self.make_tree_representation()
+            self.define_pos_xpaths_list()
+            self.sort_pos_xpaths()
 
     def start(self):
-        self.make_html_soup()
+        with self.stage(name=PARSE_STAGE):
+            self.parse_html()
         self.recompute_representation()
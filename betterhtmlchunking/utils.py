@@ -2,17 +2,10 @@
 
 import treelib
 
+from betterhtmlchunking.node_metrics import wanted_xpath
 from betterhtmlchunking.tree_representation import DOMTreeRepresentation
 
 
-def wanted_xpath(
-    xpath: str,
-    tag_list_to_filter_out: list[str]
-        ) -> bool:
-    # Check if any of the unwanted tags are present in the given XPath
-    return not any(tag in xpath for tag in tag_list_to_filter_out)
-
-
 def remove_unwanted_tags(
     tree_representation: DOMTreeRepresentation,
     tag_list_to_filter_out: list[str]
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import random
+
+from pathlib import Path
+
+from benchmarks.generators import GENERATORS
+
+
+##########################
+#                        #
+#   --- Test corpus ---  #
+#                        #
+##########################
+
+# Deterministic documents the equivalence tests run on: the benchmark
+# fixtures, small synthetic pages, hand written edge cases and random
+# (often malformed) markup.
+
+FIXTURES_DIR: Path = Path(__file__).parent.parent / "benchmarks" / "fixtures"
+
+EDGE_CASES: list[str] = [
+    "<html><body><p>a<b>x</b>c</p><pre>  keep\n  <b> spaced  </b>\n</pre>"
+    "</body></html>",
+    "<div>one<!-- c -->two<script>var x</script>three<style>p{}</style>"
+    "<noscript><p>ns <i>it</i></p></noscript>four</div>",
+    "<table><tr><td> a </td><td>b\n\nc</td></tr></table>"
+    "<textarea>  t  x </textarea>",
+    "<ul><li>one<li>two<ul><li>three</ul></ul>"
+    "<template><p>tpl <b>b</b></p></template>",
+    "text before <p>para &amp; &lt;tag&gt;</p> after",
+    "<pre>\nlead newline</pre><pre><code>  def f():\n    pass</code></pre>",
+    "<div><p>x</p><nav>filtered <a>link</a></nav><p>y</p></div>",
+    "<html><head><title>T  itle</title><meta charset=utf-8></head>"
+    "<body><h1>H</h1> <p>café naïve</p><br><img src=a.png>"
+    "</body></html>",
+]
+
+RANDOM_TAGS: list[str] = [
+    "div", "p", "span", "b", "pre", "textarea", "script", "style",
+    "noscript", "template", "ul", "li", "table", "tr", "td", "a", "br",
+    "img", "h1", "code", "nav", "section",
+]
+RANDOM_TEXTS: list[str] = [
+    "  hello  world ", "\n", "   ", "x&amp;y", "café", "a\tb\n c",
+    "&lt;b&gt;", "ü", " ", "z",
+]
+
+
+def make_random_markup(rng: random.Random, depth: int = 0) -> str:
+    pieces: list[str] = []
+    for _ in range(rng.randint(0, 5)):
+        draw: float = rng.random()
+        if draw < 0.4:
+            pieces.append(rng.choice(RANDOM_TEXTS))
+        elif draw < 0.47:
+            pieces.append(f"<!--{rng.choice(RANDOM_TEXTS)}-->")
+        elif depth < 6:
+            tag: str = rng.choice(RANDOM_TAGS)
+            # Some tags are left open.
+            closing: str = "" if rng.random() < 0.1 else f"</{tag}>"
+            pieces.append(
+                f"<{tag}>{make_random_markup(rng, depth + 1)}{closing}"
+            )
+    return "".join(pieces)
+
+
+def make_random_documents(count: int, seed: int = 0) -> list[str]:
+    # Wrapped in <body>: a document holding only a comment is not an
+    # element tree.
+    rng = random.Random(seed)
+    return [
+        f"<html><body>{make_random_markup(rng)}</body></html>"
+        for _ in range(count)
+    ]
+
+
+def get_documents(random_count: int = 150) -> list[str]:
+    documents: list[str] = list(EDGE_CASES)
+    documents += [
+        path.read_text() for path in sorted(FIXTURES_DIR.glob("*.html"))
+    ]
+    documents += [
+        generate(20_000, seed)
+        for generate in GENERATORS.values()
+        for seed in range(2)
+    ]
+    documents += make_random_documents(count=random_count)
+    return documents
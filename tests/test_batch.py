@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from typing import Iterator
+
+from benchmarks.generators import GENERATORS
+
+from betterhtmlchunking.batch import ORDERED_BATCHES_AHEAD
+from betterhtmlchunking.batch import ChunkingOptions
+from betterhtmlchunking.batch import chunk_many
+from betterhtmlchunking.node_metrics import HtmlSerialization
+from betterhtmlchunking.render_system import ChunkKind
+from betterhtmlchunking.result_cache import MemoryResultCache
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+
+
+DOCUMENT: str = "<html><body><p>a b c</p><p>d e</p></body></html>"
+
+
+def split_tokenizer(text: str) -> list[str]:
+    return text.split()
+
+
+def test_token_length_cache_key_uses_tokenizer_id():
+    options = ChunkingOptions(
+        max_length=3,
+        compared_by=ReprLengthComparisionBy.TOKEN_LENGTH,
+        tokenizer=split_tokenizer,
+        tokenizer_id="split"
+    )
+    assert options.cacheable
+    assert options.make_cache_key(website_code=DOCUMENT) !=\
+        ChunkingOptions(
+            max_length=3,
+            compared_by=ReprLengthComparisionBy.TOKEN_LENGTH,
+            tokenizer=split_tokenizer,
+            tokenizer_id="other"
+        ).make_cache_key(website_code=DOCUMENT)
+
+
+def test_token_length_without_tokenizer_id_is_not_cached():
+    result_cache = MemoryResultCache()
+    for _ in range(2):
+        results = list(
+            chunk_many(
+                [DOCUMENT],
+                max_length=3,
+                compared_by=ReprLengthComparisionBy.TOKEN_LENGTH,
+                workers=1,
+                tokenizer=split_tokenizer,
+                result_cache=result_cache
+            )
+        )
+        assert results[0].ok
+    assert (result_cache.hits, result_cache.misses) == (0, 0)
+
+    for _ in range(2):
+        list(
+            chunk_many(
+                [DOCUMENT],
+                max_length=3,
+                compared_by=ReprLengthComparisionBy.TOKEN_LENGTH,
+                workers=1,
+                tokenizer=split_tokenizer,
+                tokenizer_id="split",
+                result_cache=result_cache
+            )
+        )
+    assert (result_cache.hits, result_cache.misses) == (1, 1)
+
+
+def test_layout_cached_results_are_not_stored():
+    result_cache = MemoryResultCache()
+    for _ in range(2):
+        results = list(
+            chunk_many(
+                [DOCUMENT],
+                max_length=3,
+                workers=1,
+                layout_cache=True,
+                result_cache=result_cache
+            )
+        )
+        assert results[0].ok
+    assert (result_cache.hits, result_cache.misses) == (0, 0)
+
+
+def test_kinds_converted_to_chunk_kinds():
+    assert ChunkingOptions(max_length=3, kinds=["text"]).kinds ==\
+        (ChunkKind.TEXT,)
+    assert ChunkingOptions(max_length=3, kinds="html").kinds ==\
+        (ChunkKind.HTML,)
+
+
+def test_invalid_arguments_raise_at_once():
+    with pytest.raises(ValueError):
+        chunk_many([DOCUMENT], max_length=3, workers=0)
+    with pytest.raises(ValueError):
+        chunk_many([DOCUMENT], max_length=3, chunksize=0)
+
+
+def test_ordered_results_bounded_behind_slow_document():
+    consumed: list[int] = []
+
+    def iter_documents() -> Iterator[str]:
+        # Takes seconds to chunk, the rest milliseconds.
+        yield GENERATORS["deep_nesting"](3_000_000, 0)
+        for index in range(1, 400):
+            consumed.append(index)
+            yield DOCUMENT
+
+    results = chunk_many(iter_documents(), max_length=64, workers=2)
+    first = next(results)
+    assert (first.index, first.ok) == (0, True)
+    assert len(consumed) <= ORDERED_BATCHES_AHEAD * 2 + 1
+    assert [result.index for result in results] == list(range(1, 400))
+
+
+def test_enum_options_converted_from_values():
+    options = ChunkingOptions(
+        max_length=3,
+        compared_by="text_length",
+        html_serialization="compact"
+    )
+    assert options.compared_by is ReprLengthComparisionBy.TEXT_LENGTH
+    assert options.html_serialization is HtmlSerialization.COMPACT
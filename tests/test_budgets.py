@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from benchmarks.generators import GENERATORS
+
+from betterhtmlchunking.main import DomRepresentation
+from betterhtmlchunking.render_system import RenderMode
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+
+
+DOCUMENT: str = GENERATORS["articles"](20_000, 0)
+MAX_LENGTHS: list[int] = [256, 1024, 4096]
+
+
+def make_dom_representation(
+    max_length: int = 512,
+    render_mode: RenderMode = RenderMode.EAGER
+        ) -> DomRepresentation:
+    return DomRepresentation(
+        MAX_NODE_REPR_LENGTH=max_length,
+        website_code=DOCUMENT,
+        repr_length_compared_by=ReprLengthComparisionBy.TEXT_LENGTH,
+        render_mode=render_mode
+    )
+
+
+def get_renders(dom_representation: DomRepresentation) -> tuple[dict, dict]:
+    render_system = dom_representation.render_system
+    return (
+        dict(render_system.html_render_roi),
+        dict(render_system.text_render_roi)
+    )
+
+
+def get_single_renders() -> dict[int, tuple[dict, dict]]:
+    renders: dict[int, tuple[dict, dict]] = {}
+    for max_length in MAX_LENGTHS:
+        dom_representation = make_dom_representation(max_length=max_length)
+        dom_representation.start()
+        renders[max_length] = get_renders(dom_representation)
+    return renders
+
+
+SINGLE_RENDERS: dict[int, tuple[dict, dict]] = get_single_renders()
+
+
+@pytest.mark.parametrize("render_mode", list(RenderMode))
+@pytest.mark.parametrize("node_render_cache_size", [None, 8, 0])
+def test_budgets_equal_single_starts(render_mode, node_render_cache_size):
+    dom_representation = make_dom_representation(render_mode=render_mode)
+    budgets = dom_representation.start_budgets(
+        MAX_LENGTHS, node_render_cache_size=node_render_cache_size
+    )
+    assert list(budgets) == MAX_LENGTHS
+    for max_length, budget in budgets.items():
+        assert budget.tree_representation is\
+            dom_representation.tree_representation
+        assert get_renders(budget) == SINGLE_RENDERS[max_length]
+        # Parsed once, by dom_representation.
+        assert "parse" not in budget.stats.stages
+    assert "parse" in dom_representation.stats.stages
+
+
+def test_node_renders_shared():
+    budgets = make_dom_representation().start_budgets(MAX_LENGTHS)
+    node_render_cache = budgets[MAX_LENGTHS[0]].node_render_cache
+    assert all(
+        budget.node_render_cache is node_render_cache
+        for budget in budgets.values()
+    )
+    assert node_render_cache.hits > 0
+    assert node_render_cache.hits == sum(
+        budget.stats.counters.get("reused_node_renders", 0)
+        for budget in budgets.values()
+    )
+
+
+def test_node_render_cache_bounded():
+    budgets = make_dom_representation().start_budgets(
+        MAX_LENGTHS, node_render_cache_size=8
+    )
+    node_render_cache = budgets[MAX_LENGTHS[0]].node_render_cache
+    assert len(node_render_cache.renders) == 8
+    assert node_render_cache.evictions > 0
+
+    budgets = make_dom_representation().start_budgets(
+        MAX_LENGTHS, node_render_cache_size=0
+    )
+    assert all(
+        budget.node_render_cache is None for budget in budgets.values()
+    )
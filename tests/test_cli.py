@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import io
+
+import json
+
+from betterhtmlchunking.cli import run_batch
+from betterhtmlchunking.main import ReprLengthComparisionBy
+from betterhtmlchunking.node_metrics import HtmlSerialization
+
+
+def run_jsonl_batch(monkeypatch, capsys, lines: list[str]) -> list[dict]:
+    monkeypatch.setattr("sys.stdin", io.StringIO("\n".join(lines) + "\n"))
+    run_batch(
+        inputs=[],
+        jsonl=True,
+        max_length=64,
+        compare=ReprLengthComparisionBy.HTML_LENGTH,
+        html_serialization=HtmlSerialization.PRETTIFIED,
+        workers=1,
+        chunksize=1,
+        emit="text",
+        ordered=True
+    )
+    return [
+        json.loads(line) for line in capsys.readouterr().out.splitlines()
+    ]
+
+
+def test_jsonl_bad_records_reported(monkeypatch, capsys):
+    records = run_jsonl_batch(monkeypatch, capsys, lines=[
+        '{"id": "a", "html": "<p>x</p>"}',
+        '{"id": "b", "html": ',
+        "",
+        '{"id": "c"}',
+        "[1, 2]",
+    ])
+    assert records[0]["id"] == "a" and "error" not in records[0]
+    assert [(record["id"], record.get("error")) for record in records[1:]] ==\
+        [
+            (1, records[1]["error"]),
+            ("c", 'line 4: no "html" key'),
+            (3, "line 5: not a JSON object: list"),
+        ]
+    assert records[1]["error"].startswith("line 2: invalid JSON: ")
+
+
+def run_path_batch(
+    capsys,
+    inputs: list[str],
+    **kwargs
+        ) -> tuple[list[dict], str]:
+    run_batch(
+        inputs=inputs,
+        jsonl=False,
+        max_length=64,
+        compare=ReprLengthComparisionBy.TEXT_LENGTH,
+        html_serialization=HtmlSerialization.PRETTIFIED,
+        workers=1,
+        chunksize=1,
+        emit="text",
+        ordered=True,
+        **kwargs
+    )
+    captured = capsys.readouterr()
+    return [
+        json.loads(line) for line in captured.out.splitlines()
+    ], captured.err
+
+
+def test_input_files_decoded_by_their_charset(tmp_path, capsys):
+    (tmp_path / "latin.html").write_bytes(
+        '<html><head><meta charset="iso-8859-1"></head>'
+        "<body><p>café crème</p></body></html>".encode("latin-1")
+    )
+    (tmp_path / "utf8.html").write_bytes(
+        "<html><body><p>café crème</p></body></html>"
+        .encode("utf-8")
+    )
+    records, _ = run_path_batch(capsys, inputs=[str(tmp_path)])
+    assert [record["text"] for record in records] ==\
+        ["café crème"] * 2
+
+
+def test_input_files_cached(tmp_path, capsys):
+    (tmp_path / "page.html").write_text("<p>one two</p>", encoding="utf-8")
+    cache = tmp_path / "cache.sqlite"
+    first, err = run_path_batch(capsys, inputs=[str(tmp_path)], cache=cache)
+    assert "cache: 0 hits, 1 misses" in err
+    second, err = run_path_batch(capsys, inputs=[str(tmp_path)], cache=cache)
+    assert "cache: 1 hits, 0 misses" in err
+    assert second == first
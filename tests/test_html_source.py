@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import html
+
+import io
+
+import pytest
+
+from benchmarks.generators import GENERATORS
+
+from betterhtmlchunking.html_source import detect_encoding
+from betterhtmlchunking.html_source import iter_html_blocks
+from betterhtmlchunking.lxml_backend import ParserBackend
+from betterhtmlchunking.main import DomRepresentation
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+
+
+DOCUMENT: str = (
+    "<html><head><title>Caf&eacute;</title></head><body>"
+    "<p>Fish &amp; chips &lt;3, crème brûlée</p>"
+    + GENERATORS["articles"](20_000, 0)[len("<html><body>"):]
+)
+
+
+def get_chunks(website_code, **kwargs) -> dict[int, str]:
+    dom_representation = DomRepresentation(
+        MAX_NODE_REPR_LENGTH=256,
+        website_code=website_code,
+        repr_length_compared_by=ReprLengthComparisionBy.TEXT_LENGTH,
+        **kwargs
+    )
+    dom_representation.start()
+    return dict(dom_representation.render_system.html_render_roi)
+
+
+@pytest.mark.parametrize("backend", list(ParserBackend))
+@pytest.mark.parametrize("html_unescape", [True, False])
+def test_sources_equal_str(tmp_path, backend, html_unescape):
+    path = tmp_path / "page.html"
+    path.write_text(DOCUMENT, encoding="utf-8")
+    data: bytes = DOCUMENT.encode("utf-8")
+    expected = get_chunks(
+        DOCUMENT, backend=backend, html_unescape=html_unescape
+    )
+    for website_code in [
+            data, bytearray(data), memoryview(data), path,
+            io.BytesIO(data), io.StringIO(DOCUMENT)]:
+        assert get_chunks(
+            website_code, backend=backend, html_unescape=html_unescape
+        ) == expected, type(website_code).__name__
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "empty.html"
+    path.write_bytes(b"")
+    assert get_chunks(path) == get_chunks("")
+
+
+@pytest.mark.filterwarnings("ignore::bs4.MarkupResemblesLocatorWarning")
+def test_str_is_never_a_path(tmp_path):
+    path = tmp_path / "page.html"
+    path.write_text(DOCUMENT, encoding="utf-8")
+    assert get_chunks(str(path)) != get_chunks(path)
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 3, 7, 64])
+def test_blocks_unescaped_as_whole_text(block_size):
+    text: str = "a &amp; b &lt;&gt; &#x41;&#66; &unknown; &amp &eacute;x &"
+    for document in [text, text.encode("utf-8")]:
+        assert "".join(iter_html_blocks(
+            document=document, html_unescape=True, block_size=block_size
+        )) == html.unescape(text)
+
+
+def test_blocks_decoded_across_boundaries():
+    data: bytes = "é€\U0001f600 ok".encode("utf-8")
+    for block_size in range(1, 8):
+        assert "".join(iter_html_blocks(
+            document=data, html_unescape=False, block_size=block_size
+        )) == "é€\U0001f600 ok"
+
+
+def test_detect_encoding():
+    assert detect_encoding(head=b"\xef\xbb\xbf<p>x</p>") == ("utf-8", 3)
+    assert detect_encoding(
+        head=b'<meta charset="iso-8859-1"><p>x</p>'
+    ) == ("iso8859-1", 0)
+    assert detect_encoding(head=b"<p>x</p>") == ("utf-8", 0)
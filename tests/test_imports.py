@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+
+import os
+
+import pytest
+
+from benchmarks.run_benchmarks import IMPORT_BUDGETS
+from benchmarks.run_benchmarks import measure_import
+
+
+# Same as the --scale option of the imports benchmark, for slow machines.
+IMPORT_BUDGET_SCALE: float = float(
+    os.environ.get("IMPORT_BUDGET_SCALE", "1")
+)
+
+
+@pytest.mark.parametrize("module", list(IMPORT_BUDGETS))
+def test_import_budget(module):
+    # Best of a few fresh interpreters, see run_benchmarks.imports.
+    seconds, deferred = measure_import(module=module, repeat=3)
+    assert deferred == []
+    assert seconds <= IMPORT_BUDGETS[module] * IMPORT_BUDGET_SCALE
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import attrs
+
+from betterhtmlchunking.batch import ChunkingOptions
+from betterhtmlchunking.incremental import get_options_key
+from betterhtmlchunking.incremental import rechunk
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+
+
+DOCUMENT: str = "<html><body>" + "".join(
+    f"<div><p>w{i} a b c d</p><p>e f g</p></div>" for i in range(20)
+) + "</body></html>"
+
+
+def split_tokenizer(text: str) -> list[str]:
+    return text.split()
+
+
+def make_options(tokenizer_id) -> ChunkingOptions:
+    return ChunkingOptions(
+        max_length=8,
+        compared_by=ReprLengthComparisionBy.TOKEN_LENGTH,
+        tokenizer=split_tokenizer,
+        tokenizer_id=tokenizer_id
+    )
+
+
+def get_reused_subtrees(options: ChunkingOptions) -> int:
+    first = rechunk(DOCUMENT, options)
+    second = rechunk(DOCUMENT, options, previous=first.state.as_dict())
+    assert second.unchanged_chunks == list(range(len(first.chunks)))
+    return second.dom_representation.stats.counters["reused_subtrees"]
+
+
+def test_options_key_uses_tokenizer_id():
+    assert get_options_key(options=make_options(tokenizer_id="a")) !=\
+        get_options_key(options=make_options(tokenizer_id="b"))
+
+
+def test_token_length_regions_reused_with_tokenizer_id():
+    assert get_reused_subtrees(options=make_options(tokenizer_id=None)) == 0
+    assert get_reused_subtrees(options=make_options(tokenizer_id="split"))
+
+
+def make_page(paragraphs: list[str]) -> str:
+    return "<html><body>" + "".join(
+        f"<p>{paragraph}</p>" for paragraph in paragraphs
+    ) + "</body></html>"
+
+
+# Every paragraph is a chunk of its own.
+PAGE_OPTIONS: ChunkingOptions = ChunkingOptions(
+    max_length=10, compared_by=ReprLengthComparisionBy.TEXT_LENGTH
+)
+FIRST_PAGE: str = make_page([
+    "first paragraph", "second paragraph", "third paragraph",
+    "fourth paragraph",
+])
+
+
+def test_changed_unchanged_new_and_removed_chunks():
+    first = rechunk(FIRST_PAGE, PAGE_OPTIONS)
+    second = rechunk(
+        make_page([
+            "first paragraph", "second paragraph, edited",
+            "fourth paragraph", "fifth paragraph",
+        ]),
+        PAGE_OPTIONS,
+        previous=first.state.as_dict()
+    )
+    assert [chunk.text for chunk in second.chunks] == [
+        "first paragraph", "second paragraph, edited", "fourth paragraph",
+        "fifth paragraph",
+    ]
+    # The fourth paragraph moved up, the third one is gone.
+    assert second.unchanged_chunks == [0, 2]
+    assert second.changed_chunks == [1]
+    assert second.new_chunks == [3]
+    assert second.removed_chunks == [2]
+    assert second.previous_indices == {0: 0, 1: 1, 2: 3}
+    # HTML and text of the two unchanged chunks.
+    counters: dict[str, int] = second.dom_representation.stats.counters
+    assert (counters["reused_renders"], counters["rendered_chunks"]) ==\
+        (4, 4)
+
+
+def test_same_page_unchanged():
+    first = rechunk(FIRST_PAGE, PAGE_OPTIONS)
+    second = rechunk(FIRST_PAGE, PAGE_OPTIONS, previous=first.state)
+    assert second.unchanged_chunks == [0, 1, 2, 3]
+    assert second.changed_chunks == second.new_chunks ==\
+        second.removed_chunks == []
+    assert "rendered_chunks" not in second.dom_representation.stats.counters
+
+
+def test_other_options_not_reused():
+    # Same content: the prettified renders must not be taken over.
+    page: str = "<html><body><div><p>one two</p><p>three</p></div>" +\
+        "</body></html>"
+    options = ChunkingOptions(
+        max_length=10, compared_by=ReprLengthComparisionBy.TEXT_LENGTH
+    )
+    first = rechunk(page, options)
+    for changes in [
+            {"html_serialization": "compact"},
+            {"kinds": ["html"]},
+            {"backend": "lxml"}]:
+        other_options = attrs.evolve(options, **changes)
+        second = rechunk(page, other_options, previous=first.state)
+        fresh = rechunk(page, other_options)
+        if "html_serialization" in changes:
+            assert [chunk.html for chunk in second.chunks] ==\
+                ["<div><p>one two</p><p>three</p></div>"]
+        assert [chunk.html for chunk in second.chunks] ==\
+            [chunk.html for chunk in fresh.chunks]
+        assert second.unchanged_chunks == second.changed_chunks == []
+        assert second.new_chunks == list(range(len(second.chunks)))
+        assert second.removed_chunks == list(range(len(first.chunks)))
+        assert "reused_renders" not in\
+            second.dom_representation.stats.counters
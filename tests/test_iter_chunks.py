@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from betterhtmlchunking.lxml_backend import ParserBackend
+from betterhtmlchunking.main import DomRepresentation
+from betterhtmlchunking.render_system import ChunkKind
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+from betterhtmlchunking.tree_representation import DOMTreeRepresentation
+
+from tests.corpus import get_documents
+
+
+DOCUMENTS: list[str] = get_documents(random_count=20)
+
+
+def make_dom_representation(
+    website_code: str,
+    max_length: int,
+    backend: ParserBackend = ParserBackend.BS4
+        ) -> DomRepresentation:
+    return DomRepresentation(
+        MAX_NODE_REPR_LENGTH=max_length,
+        website_code=website_code,
+        repr_length_compared_by=ReprLengthComparisionBy.TEXT_LENGTH,
+        backend=backend
+    )
+
+
+@pytest.mark.parametrize("backend", list(ParserBackend))
+@pytest.mark.parametrize("max_length", [16, 256])
+def test_iter_chunks_equals_start(backend, max_length):
+    for website_code in DOCUMENTS:
+        eager = make_dom_representation(
+            website_code=website_code, max_length=max_length, backend=backend
+        )
+        eager.start()
+        render_system = eager.render_system
+        for kind, renders in [
+                (ChunkKind.TEXT, render_system.text_render_roi),
+                (ChunkKind.HTML, render_system.html_render_roi)]:
+            chunks = list(make_dom_representation(
+                website_code=website_code,
+                max_length=max_length,
+                backend=backend
+            ).iter_chunks(kind=kind))
+            assert [
+                (roi_idx, pos_xpaths, content)
+                for roi_idx, pos_xpaths, content in chunks
+            ] == [
+                (
+                    roi_idx,
+                    render_system.get_roi_pos_xpath_list(roi_idx=roi_idx),
+                    renders[roi_idx]
+                )
+                for roi_idx in renders
+            ]
+
+
+def test_iter_chunks_in_document_order():
+    for website_code in DOCUMENTS:
+        dom_representation = make_dom_representation(
+            website_code=website_code, max_length=64
+        )
+        chunks = list(dom_representation.iter_chunks())
+        assert [roi_idx for roi_idx, _, _ in chunks] ==\
+            list(range(len(chunks)))
+        compact_tree = dom_representation.tree_representation.compact_tree
+        first_node_ids: list[int] = [
+            compact_tree.get_node_id(pos_xpath=pos_xpaths[0])
+            for _, pos_xpaths, _ in chunks
+        ]
+        assert first_node_ids == sorted(first_node_ids)
+
+
+def test_iter_chunks_renders_as_it_goes(monkeypatch):
+    rendered: list[str] = []
+    render_node_text = DOMTreeRepresentation.render_node_text
+
+    def record_render(self, pos_xpath: str) -> str:
+        rendered.append(pos_xpath)
+        return render_node_text(self, pos_xpath=pos_xpath)
+
+    monkeypatch.setattr(DOMTreeRepresentation, "render_node_text",
+                        record_render)
+    dom_representation = make_dom_representation(
+        website_code=DOCUMENTS[-1], max_length=16
+    )
+    chunks = dom_representation.iter_chunks(kind="text")
+    _, pos_xpaths, _ = next(chunks)
+    # Only the nodes of the first chunk, start() did not run.
+    assert rendered == pos_xpaths
+    assert not hasattr(dom_representation, "render_system")
+    assert len(list(chunks)) > 0
+    assert len(rendered) > len(pos_xpaths)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import re
+
+import pytest
+
+from typing import Optional
+
+from betterhtmlchunking.layout_cache import LayoutCache
+from betterhtmlchunking.main import DomRepresentation
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+
+from tests.corpus import get_documents
+
+
+DOCUMENTS: list[str] = get_documents(random_count=40)
+
+
+def get_variants(website_code: str) -> list[str]:
+    # Same tags, other text lengths.
+    return [
+        website_code,
+        re.sub(r"(>[^<]*?)e", r"\1ee", website_code),
+        re.sub(r"(>[^<]*?)a", r"\1", website_code),
+    ]
+
+
+def get_regions(
+    website_code: str,
+    max_length: int,
+    layout_cache: Optional[LayoutCache]
+        ) -> list[tuple]:
+    dom_representation = DomRepresentation(
+        MAX_NODE_REPR_LENGTH=max_length,
+        website_code=website_code,
+        repr_length_compared_by=ReprLengthComparisionBy.TEXT_LENGTH,
+        layout_cache=layout_cache
+    )
+    dom_representation.start()
+    return [
+        (roi.pos_xpath_list, roi.repr_length, roi.node_is_roi)
+        for roi in dom_representation.tree_regions_system
+        .sorted_roi_by_pos_xpath.values()
+    ]
+
+
+@pytest.mark.parametrize("max_length", [40, 300])
+def test_reused_layouts_match_discovery(max_length):
+    layout_cache = LayoutCache()
+    for document in DOCUMENTS:
+        for website_code in get_variants(website_code=document):
+            assert get_regions(
+                website_code=website_code,
+                max_length=max_length,
+                layout_cache=layout_cache
+            ) == get_regions(
+                website_code=website_code,
+                max_length=max_length,
+                layout_cache=None
+            )
+    assert layout_cache.hits
+    assert layout_cache.adjusted_nodes
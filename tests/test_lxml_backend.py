@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from betterhtmlchunking.batch import ChunkingOptions
+from betterhtmlchunking.batch import chunk_document
+from betterhtmlchunking.lxml_backend import ParserBackend
+from betterhtmlchunking.lxml_backend import collapse_whitespace_string
+from betterhtmlchunking.node_metrics import HtmlSerialization
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+from betterhtmlchunking.tree_representation import DOMTreeRepresentation
+
+from tests.corpus import get_documents
+
+
+DOCUMENTS: list[str] = get_documents()
+
+
+def get_tree_metrics(dom: DOMTreeRepresentation) -> tuple:
+    return (
+        dom.compact_tree.pos_xpaths,
+        list(dom.compact_tree.text_lengths),
+        list(dom.compact_tree.html_lengths),
+    )
+
+
+def test_collapse_whitespace_string():
+    assert collapse_whitespace_string(text="\n    ") == "\n"
+    assert collapse_whitespace_string(text=" \t ") == " "
+    assert collapse_whitespace_string(text=" a ") == " a "
+    # Not an ASCII space.
+    assert collapse_whitespace_string(text="\xa0") == "\xa0"
+
+
+@pytest.mark.parametrize("html_serialization", list(HtmlSerialization))
+def test_lxml_tree_matches_bs4(html_serialization):
+    for document in DOCUMENTS:
+        bs4_dom = DOMTreeRepresentation(
+            website_code=document,
+            html_serialization=html_serialization
+        )
+        lxml_dom = DOMTreeRepresentation(
+            website_code=document,
+            html_serialization=html_serialization,
+            backend=ParserBackend.LXML
+        )
+        assert get_tree_metrics(dom=lxml_dom) ==\
+            get_tree_metrics(dom=bs4_dom)
+
+
+@pytest.mark.parametrize("html_serialization", list(HtmlSerialization))
+@pytest.mark.parametrize(
+    "compared_by",
+    [
+        ReprLengthComparisionBy.HTML_LENGTH,
+        ReprLengthComparisionBy.TEXT_LENGTH,
+    ]
+)
+def test_lxml_chunks_match_bs4(compared_by, html_serialization):
+    for document in DOCUMENTS:
+        bs4_chunks = chunk_document(
+            index=0,
+            website_code=document,
+            options=ChunkingOptions(
+                max_length=300,
+                compared_by=compared_by,
+                html_serialization=html_serialization
+            )
+        )
+        lxml_chunks = chunk_document(
+            index=0,
+            website_code=document,
+            options=ChunkingOptions(
+                max_length=300,
+                compared_by=compared_by,
+                html_serialization=html_serialization,
+                backend=ParserBackend.LXML
+            )
+        )
+        assert lxml_chunks == bs4_chunks
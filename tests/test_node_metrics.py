@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import bs4
+
+import pytest
+
+from betterhtmlchunking.batch import ChunkingOptions
+from betterhtmlchunking.batch import chunk_document
+from betterhtmlchunking.node_metrics import HtmlSerialization
+from betterhtmlchunking.node_metrics import MetricsMode
+from betterhtmlchunking.node_metrics import format_bs4_tags
+from betterhtmlchunking.node_metrics import format_bs4_tags_with_decode
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+from betterhtmlchunking.tree_representation import DOMTreeRepresentation
+
+from tests.corpus import FIXTURES_DIR
+from tests.corpus import get_documents
+
+
+DOCUMENTS: list[str] = get_documents()
+
+TAGS_DOCUMENT: str = (
+    "<div class=\"a b\" data-x='q\"&amp;<' hidden><br>"
+    "<img src=\"x.png?a=1&b=2\"><input disabled><p id=1>x</p></div>"
+)
+
+
+def test_format_bs4_tags_fallback_matches():
+    documents: list[str] = [TAGS_DOCUMENT] + [
+        path.read_text() for path in sorted(FIXTURES_DIR.glob("*.html"))
+    ]
+    for document in documents:
+        soup = bs4.BeautifulSoup(document, "lxml")
+        formatter = soup.formatter_for_name("minimal")
+        for tag in soup.find_all(True):
+            assert format_bs4_tags(elem=tag, formatter=formatter) ==\
+                format_bs4_tags_with_decode(elem=tag, formatter=formatter)
+
+
+def test_format_bs4_tags_void():
+    soup = bs4.BeautifulSoup(TAGS_DOCUMENT, "lxml")
+    formatter = soup.formatter_for_name("minimal")
+    assert format_bs4_tags(elem=soup.br, formatter=formatter) ==\
+        ("<br/>", "")
+    assert format_bs4_tags(elem=soup.p, formatter=formatter) ==\
+        ('<p id="1">', "</p>")
+
+
+def get_tree_metrics(dom: DOMTreeRepresentation) -> tuple:
+    return (
+        dom.compact_tree.pos_xpaths,
+        list(dom.compact_tree.text_lengths),
+        list(dom.compact_tree.html_lengths),
+    )
+
+
+@pytest.mark.parametrize("html_serialization", list(HtmlSerialization))
+def test_bottom_up_matches_per_node(html_serialization):
+    for document in DOCUMENTS:
+        bottom_up = DOMTreeRepresentation(
+            website_code=document,
+            html_serialization=html_serialization
+        )
+        per_node = DOMTreeRepresentation(
+            website_code=document,
+            html_serialization=html_serialization,
+            metrics_mode=MetricsMode.PER_NODE
+        )
+        assert get_tree_metrics(dom=bottom_up) ==\
+            get_tree_metrics(dom=per_node)
+
+
+@pytest.mark.parametrize(
+    "compared_by",
+    [
+        ReprLengthComparisionBy.HTML_LENGTH,
+        ReprLengthComparisionBy.TEXT_LENGTH,
+    ]
+)
+def test_bottom_up_chunks_match_per_node(compared_by):
+    options = ChunkingOptions(max_length=300, compared_by=compared_by)
+    per_node_options = ChunkingOptions(
+        max_length=300,
+        compared_by=compared_by,
+        metrics_mode=MetricsMode.PER_NODE
+    )
+    for document in DOCUMENTS:
+        assert chunk_document(
+            index=0, website_code=document, options=options
+        ) == chunk_document(
+            index=0, website_code=document, options=per_node_options
+        )
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import array
+
+import random
+
+import pytest
+
+from betterhtmlchunking import packing
+from betterhtmlchunking.packing import pack_children
+
+
+def pack_children_per_child(
+    lengths: list[int],
+    max_node_repr_length: int
+        ) -> tuple[list[list[int]], list[int], list[int], int]:
+    # The ROIMaker state machine pack_children replaced, one step per
+    # child, per region and at the end.
+    regions: list[list[int]] = []
+    region_lengths: list[int] = []
+    children_to_enqueue: list[int] = []
+    region: list[int] = []
+    region_length: int = 0
+    steps: int = 0
+    for child_idx, length in enumerate(lengths):
+        steps += 1
+        if length >= max_node_repr_length:
+            children_to_enqueue.append(child_idx)
+        else:
+            region.append(child_idx)
+            region_length += length
+            if region_length < max_node_repr_length:
+                continue
+        steps += 1
+        regions.append(region)
+        region_lengths.append(region_length)
+        region, region_length = [], 0
+    steps += 1
+    if region_length > 0 and regions:
+        regions[-1] += region
+        region_lengths[-1] += region_length
+    return regions, region_lengths, children_to_enqueue, steps
+
+
+def get_packing(
+    lengths: list[int],
+    max_node_repr_length: int
+        ) -> tuple[list[list[int]], list[int], list[int], int]:
+    # Children ids are shuffled node ids, as in a compact tree.
+    node_ids: list[int] = random.Random(len(lengths)).sample(
+        range(len(lengths)), len(lengths)
+    )
+    repr_lengths = array.array("q", [0] * len(lengths))
+    for node_id, length in zip(node_ids, lengths):
+        repr_lengths[node_id] = length
+    packing_result = pack_children(
+        repr_lengths=repr_lengths,
+        children_ids=node_ids,
+        max_node_repr_length=max_node_repr_length
+    )
+    return (
+        [
+            [
+                child_idx
+                for start, end in spans
+                for child_idx in range(start, end)
+            ]
+            for spans in packing_result.regions
+        ],
+        packing_result.repr_lengths,
+        packing_result.children_to_enqueue,
+        packing_result.steps
+    )
+
+
+def make_length_lists(seed: int = 0) -> list[tuple[list[int], int]]:
+    rng = random.Random(seed)
+    cases: list[tuple[list[int], int]] = [
+        ([], 10),
+        ([0, 0, 0], 10),
+        ([10], 10),
+        ([3, 0, 0], 10),
+        ([12, 3, 12, 0], 10),
+    ]
+    for _ in range(500):
+        max_node_repr_length: int = rng.randint(1, 50)
+        lengths: list[int] = [
+            rng.choice([
+                0,
+                rng.randint(0, max_node_repr_length),
+                rng.randint(max_node_repr_length, 2 * max_node_repr_length),
+                rng.randint(0, max_node_repr_length // 4),
+            ])
+            for _ in range(rng.randint(0, 600))
+        ]
+        cases.append((lengths, max_node_repr_length))
+    return cases
+
+
+LENGTH_LISTS: list[tuple[list[int], int]] = make_length_lists()
+
+
+def test_pack_children_matches_per_child():
+    for lengths, max_node_repr_length in LENGTH_LISTS:
+        assert get_packing(
+            lengths=lengths, max_node_repr_length=max_node_repr_length
+        ) == pack_children_per_child(
+            lengths=lengths, max_node_repr_length=max_node_repr_length
+        )
+
+
+def test_pack_children_numpy_matches_per_child(monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(packing, "NUMPY_MIN_CHILDREN", 0)
+    for lengths, max_node_repr_length in LENGTH_LISTS:
+        assert get_packing(
+            lengths=lengths, max_node_repr_length=max_node_repr_length
+        ) == pack_children_per_child(
+            lengths=lengths, max_node_repr_length=max_node_repr_length
+        )
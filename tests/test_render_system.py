@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from benchmarks.generators import GENERATORS
+
+from betterhtmlchunking.main import DomRepresentation
+from betterhtmlchunking.render_system import LazyRenderMapping
+from betterhtmlchunking.render_system import RenderMode
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+
+
+DOCUMENT: str = GENERATORS["articles"](20_000, 0)
+
+
+class RecordingRender:
+    # Render of a roi_idx, with every roi_idx it was called on.
+    def __init__(self):
+        self.calls: list[int] = []
+
+    def __call__(self, roi_idx: int) -> str:
+        self.calls.append(roi_idx)
+        return f"chunk {roi_idx}"
+
+
+def make_mapping(cache_size, size: int = 5) -> LazyRenderMapping:
+    return LazyRenderMapping(
+        render_function=RecordingRender(),
+        roi_indices={roi_idx: None for roi_idx in range(size)},
+        cache_size=cache_size
+    )
+
+
+def test_least_recently_used_evicted_and_rendered_again():
+    mapping = make_mapping(cache_size=2)
+    assert mapping[0] == "chunk 0"
+    assert mapping[1] == "chunk 1"
+    assert mapping[0] == "chunk 0"
+    # 1 is the least recently used.
+    assert mapping[2] == "chunk 2"
+    assert list(mapping.cache) == [0, 2]
+    assert mapping[1] == "chunk 1"
+    assert list(mapping.cache) == [2, 1]
+    assert mapping.render_function.calls == [0, 1, 2, 1]
+
+
+@pytest.mark.parametrize("cache_size, calls", [
+    (None, [0, 1]),
+    (0, [0, 1, 0, 1]),
+])
+def test_cache_size_none_and_zero(cache_size, calls):
+    mapping = make_mapping(cache_size=cache_size)
+    for roi_idx in [0, 1, 0, 1]:
+        assert mapping[roi_idx] == f"chunk {roi_idx}"
+    assert mapping.render_function.calls == calls
+
+
+def test_mapping_without_rendering():
+    mapping = make_mapping(cache_size=2)
+    assert len(mapping) == 5
+    assert list(mapping) == [0, 1, 2, 3, 4]
+    assert 4 in mapping and 5 not in mapping
+    with pytest.raises(KeyError):
+        mapping[5]
+    assert mapping.get(5) is None
+    assert mapping.render_function.calls == []
+
+
+def make_dom_representation(render_mode: RenderMode) -> DomRepresentation:
+    dom_representation = DomRepresentation(
+        MAX_NODE_REPR_LENGTH=256,
+        website_code=DOCUMENT,
+        repr_length_compared_by=ReprLengthComparisionBy.TEXT_LENGTH,
+        render_mode=render_mode,
+        render_cache_size=4
+    )
+    dom_representation.start()
+    return dom_representation
+
+
+def test_lazy_renders_equal_eager():
+    eager = make_dom_representation(render_mode=RenderMode.EAGER)
+    lazy = make_dom_representation(render_mode=RenderMode.LAZY)
+    assert "rendered_chunks" not in lazy.stats.counters
+    for name in [
+            "html_render_roi", "text_render_roi",
+            "html_render_with_pos_xpath", "text_render_with_pos_xpath"]:
+        lazy_renders = getattr(lazy.render_system, name)
+        assert isinstance(lazy_renders, LazyRenderMapping)
+        assert dict(lazy_renders) ==\
+            getattr(eager.render_system, name)
+        assert len(lazy_renders.cache) == 4
+
+
+def test_lazy_text_never_renders_html():
+    lazy = make_dom_representation(render_mode=RenderMode.LAZY)
+    text_render_roi = lazy.render_system.text_render_roi
+    for roi_idx in text_render_roi:
+        text_render_roi[roi_idx]
+    assert lazy.stats.counters["rendered_chunks"] == len(text_render_roi)
+    assert len(lazy.render_system.html_render_roi.cache) == 0
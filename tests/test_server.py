@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+import errno
+
+import http.client
+
+import json
+
+import socket
+
+import threading
+
+import time
+
+import pytest
+
+from benchmarks.generators import GENERATORS
+
+from betterhtmlchunking.batch import ChunkingOptions
+from betterhtmlchunking.batch import chunk_document
+from betterhtmlchunking.server import ChunkingService
+from betterhtmlchunking.server import WorkerCrashedError
+from betterhtmlchunking.server import make_server
+
+
+OPTIONS: ChunkingOptions = ChunkingOptions(max_length=256)
+# Takes seconds to chunk.
+LARGE_DOCUMENT: str = GENERATORS["deep_nesting"](3_000_000, 0)
+
+
+@pytest.fixture
+def service():
+    chunking_service = ChunkingService(workers=1, queue_size=4)
+    chunking_service.start()
+    yield chunking_service
+    chunking_service.close()
+
+
+def test_running_timeout_recycles_pool(service):
+    results: list = []
+
+    def chunk_queued() -> None:
+        results.append(
+            service.chunk(website_code="<p>queued</p>", options=OPTIONS)
+        )
+
+    with pytest.raises(TimeoutError):
+        queued = threading.Timer(0.1, chunk_queued)
+        queued.start()
+        service.chunk(
+            website_code=LARGE_DOCUMENT, options=OPTIONS, timeout=0.5
+        )
+    queued.join()
+
+    stats: dict = service.get_stats()
+    assert (stats["timed_out"], stats["recycles"]) == (1, 1)
+    assert stats["in_flight"] == 0
+    # Waited for the worker, and ran on its replacement.
+    assert [result.ok for result in results] == [True]
+    assert service.chunk(website_code="<p>x</p>", options=OPTIONS).ok
+
+
+def test_timeout_releases_slot_at_once(service):
+    with pytest.raises(TimeoutError):
+        service.chunk(
+            website_code=LARGE_DOCUMENT, options=OPTIONS, timeout=0.5
+        )
+    assert service.get_stats()["in_flight"] == 0
+
+
+def test_timeout_leaves_other_workers_running():
+    service = ChunkingService(workers=2, queue_size=0)
+    service.start()
+    try:
+        pids: set[int] = {worker.process.pid for worker in service.pool}
+        results: list = []
+        other = threading.Thread(target=lambda: results.append(
+            service.chunk(
+                website_code=GENERATORS["articles"](300_000, 0),
+                options=OPTIONS
+            )
+        ))
+        other.start()
+        with pytest.raises(TimeoutError):
+            service.chunk(
+                website_code=LARGE_DOCUMENT, options=OPTIONS, timeout=0.5
+            )
+        other.join()
+        assert [result.ok for result in results] == [True]
+        # Only the worker that timed out was replaced.
+        assert len(pids & {
+            worker.process.pid for worker in service.pool
+        }) == 1
+        stats: dict = service.get_stats()
+        assert (stats["accepted"], stats["rejected"]) == (2, 0)
+        assert (stats["completed"], stats["recycles"]) == (1, 1)
+    finally:
+        service.close()
+
+
+def test_crashed_worker_replaced(service):
+    (worker,) = service.pool
+    worker.process.kill()
+    worker.process.join()
+    with pytest.raises(WorkerCrashedError):
+        service.chunk(website_code="<p>x</p>", options=OPTIONS)
+    assert service.chunk(website_code="<p>x</p>", options=OPTIONS).ok
+    stats: dict = service.get_stats()
+    assert (stats["crashed"], stats["restarts"]) == (1, 1)
+
+
+@pytest.fixture
+def make_client():
+    servers: list = []
+
+    def make(**kwargs) -> tuple:
+        chunking_service = ChunkingService(**kwargs)
+        chunking_service.start()
+        server = make_server(service=chunking_service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+
+        def request(method: str, path: str, body=None) -> tuple:
+            if isinstance(body, dict):
+                body = json.dumps(body)
+            connection = http.client.HTTPConnection(
+                *server.server_address[:2], timeout=30
+            )
+            try:
+                connection.request(method, path, body=body)
+                response = connection.getresponse()
+                return (response.status, json.loads(response.read()),
+                        response.getheader("Retry-After"))
+            finally:
+                connection.close()
+
+        return chunking_service, request
+
+    yield make
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+        server.service.close()
+
+
+def test_post_chunk(make_client):
+    _, request = make_client(workers=1)
+    website_code: str = GENERATORS["articles"](20_000, 0)
+    status, payload, _ = request("POST", "/chunk", {
+        "id": "a",
+        "html": website_code,
+        "options": {"max_length": 256, "compared_by": "text_length",
+                    "kinds": ["text"]},
+    })
+    assert status == 200
+    assert payload["id"] == "a"
+    expected = chunk_document(
+        index=0,
+        website_code=website_code,
+        options=ChunkingOptions(
+            max_length=256, compared_by="text_length", kinds=["text"]
+        )
+    )
+    assert len(payload["chunks"]) > 1
+    assert payload["chunks"] == [
+        chunk.as_dict() for chunk in expected.chunks
+    ]
+
+
+@pytest.mark.parametrize("body", [
+    "{",
+    "[]",
+    {"options": {}},
+    {"html": 1},
+    {"html": "<p>x</p>", "options": {"max_length": 0}},
+    {"html": "<p>x</p>", "options": {"max_length": True}},
+    {"html": "<p>x</p>", "options": {"max_length": 1.5}},
+    {"html": "<p>x</p>", "options": {"compared_by": "pixels"}},
+    {"html": "<p>x</p>", "options": {"tokenizer": "gpt2"}},
+    {"html": "<p>x</p>", "timeout": 0},
+])
+def test_bad_requests(make_client, body):
+    service, request = make_client(workers=1)
+    status, payload, _ = request("POST", "/chunk", body)
+    assert status == 400
+    assert payload["error"]
+    assert service.get_stats()["accepted"] == 0
+
+
+def test_backpressure_and_stats(make_client):
+    service, request = make_client(workers=1, queue_size=0)
+    responses: list = []
+    running = threading.Thread(target=lambda: responses.append(request(
+        "POST", "/chunk", {"html": LARGE_DOCUMENT, "timeout": 2}
+    )))
+    running.start()
+    while service.get_stats()["in_flight"] == 0:
+        time.sleep(0.01)
+
+    status, payload, retry_after = request(
+        "POST", "/chunk", {"id": "b", "html": "<p>x</p>"}
+    )
+    assert (status, payload["id"], retry_after) == (503, "b", "1")
+    running.join()
+    assert [response[0] for response in responses] == [504]
+
+    status, stats, _ = request("GET", "/stats")
+    assert status == 200
+    assert (stats["accepted"], stats["rejected"]) == (1, 1)
+    assert (stats["timed_out"], stats["recycles"]) == (1, 1)
+    assert stats["in_flight"] == 0
+    assert request("GET", "/health")[:2] == (200, {"status": "ok"})
+    assert request("GET", "/missing")[0] == 404
+
+
+def test_unix_socket_stale_file_replaced(tmp_path):
+    socket_path = tmp_path / "chunker.sock"
+    # Bound, never listened on: connections are refused.
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(socket_path))
+    stale.close()
+
+    server = make_server(
+        service=ChunkingService(workers=1), socket_path=socket_path
+    )
+    server.server_close()
+    assert not socket_path.exists()
+
+
+def test_unix_socket_in_use_refused(tmp_path):
+    socket_path = tmp_path / "chunker.sock"
+    server = make_server(
+        service=ChunkingService(workers=1), socket_path=socket_path
+    )
+    try:
+        with pytest.raises(OSError) as error:
+            make_server(
+                service=ChunkingService(workers=1), socket_path=socket_path
+            )
+        assert error.value.errno == errno.EADDRINUSE
+        # Still the first server's.
+        assert socket_path.exists()
+    finally:
+        server.server_close()
+    assert not socket_path.exists()
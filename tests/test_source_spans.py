@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import re
+
+import pytest
+
+from betterhtmlchunking.lxml_backend import ParserBackend
+from betterhtmlchunking.main import DomRepresentation
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+
+from tests.corpus import get_documents
+
+
+DOCUMENT: str = (
+    "<!DOCTYPE html>\n<html><body><div id=\"a\">"
+    "<p>café &amp; <b>x</b><br>y</p><ul><li>one<li>two</ul></div>"
+    "<table><tr><td>c</td></tr></table></body></html>"
+)
+SOURCES: dict[str, str] = {
+    "/html/body/div/p": "<p>café &amp; <b>x</b><br>y</p>",
+    "/html/body/div/p/b": "<b>x</b>",
+    # Void: the start tag only.
+    "/html/body/div/p/br": "<br>",
+    # Closed implicitly, by the next <li> and by </ul>.
+    "/html/body/div/ul/li[1]": "<li>one",
+    "/html/body/div/ul/li[2]": "<li>two",
+    "/html/body/table/tr/td": "<td>c</td>",
+}
+# lxml and bs4 may add these, starting at the content they are made for.
+IMPLIED_TAGS: frozenset[str] = frozenset({"html", "head", "body", "tbody"})
+
+
+def make_dom_representation(website_code, **kwargs) -> DomRepresentation:
+    dom_representation = DomRepresentation(
+        MAX_NODE_REPR_LENGTH=40,
+        website_code=website_code,
+        repr_length_compared_by=ReprLengthComparisionBy.HTML_LENGTH,
+        html_unescape=False,
+        record_source_spans=True,
+        tag_list_to_filter_out=[],
+        **kwargs
+    )
+    dom_representation.start()
+    return dom_representation
+
+
+@pytest.mark.parametrize("backend", list(ParserBackend))
+def test_spans_of_str_and_bytes(backend):
+    data: bytes = DOCUMENT.encode("utf-8")
+    text_tree = make_dom_representation(
+        DOCUMENT, backend=backend
+    ).tree_representation
+    bytes_tree = make_dom_representation(
+        data, backend=backend
+    ).tree_representation
+    for pos_xpath, source in SOURCES.items():
+        start, end = text_tree.get_node_source_span(pos_xpath=pos_xpath)
+        assert DOCUMENT[start:end] == source
+        assert text_tree.get_node_source(pos_xpath=pos_xpath) == source
+
+        # Byte offsets.
+        byte_start: int = len(DOCUMENT[:start].encode("utf-8"))
+        assert bytes_tree.get_node_source_span(pos_xpath=pos_xpath) == (
+            byte_start, byte_start + len(source.encode("utf-8"))
+        )
+        view = bytes_tree.get_node_source(pos_xpath=pos_xpath)
+        assert isinstance(view, memoryview)
+        assert bytes(view) == source.encode("utf-8")
+
+
+def test_implied_elements_start_at_content():
+    tree_representation = make_dom_representation(
+        "lead <p>a</p>"
+    ).tree_representation
+    assert tree_representation.get_node_source(pos_xpath="/html") ==\
+        "lead <p>a</p>"
+    assert tree_representation.get_node_source(pos_xpath="/html/body/p") ==\
+        "<p>a</p>"
+
+
+def test_chunk_sources_are_their_nodes():
+    render_system = make_dom_representation(DOCUMENT).render_system
+    for roi_idx in render_system.tree_regions_system.sorted_roi_by_pos_xpath:
+        spans = render_system.get_roi_source_spans(roi_idx=roi_idx)
+        sources = render_system.get_roi_sources(roi_idx=roi_idx)
+        assert list(spans) == list(sources) ==\
+            render_system.get_roi_pos_xpath_list(roi_idx=roi_idx)
+        for pos_xpath, (start, end) in spans.items():
+            assert sources[pos_xpath] == DOCUMENT[start:end]
+
+
+@pytest.mark.parametrize("backend", list(ParserBackend))
+def test_spans_start_at_start_tags(backend):
+    for website_code in get_documents(random_count=30):
+        tree_representation = make_dom_representation(
+            website_code, backend=backend
+        ).tree_representation
+        for pos_xpath in tree_representation.compact_tree.pos_xpaths:
+            tag: str = re.sub(r"\[\d+\]$", "", pos_xpath.rsplit("/", 1)[1])
+            if tag in IMPLIED_TAGS:
+                continue
+            assert tree_representation.get_node_source(
+                pos_xpath=pos_xpath
+            ).lower().startswith("<" + tag)
+
+
+def test_path_keeps_spans_only(tmp_path):
+    path = tmp_path / "page.html"
+    path.write_text(DOCUMENT, encoding="utf-8")
+    tree_representation = make_dom_representation(path).tree_representation
+    start, end = tree_representation.get_node_source_span(
+        pos_xpath="/html/body/div/p/b"
+    )
+    assert path.read_bytes()[start:end] == b"<b>x</b>"
+    with pytest.raises(ValueError):
+        tree_representation.get_node_source(pos_xpath="/html/body/div/p/b")
+
+
+def test_no_spans_without_recording():
+    dom_representation = DomRepresentation(
+        MAX_NODE_REPR_LENGTH=40,
+        website_code=DOCUMENT,
+        repr_length_compared_by=ReprLengthComparisionBy.HTML_LENGTH
+    )
+    dom_representation.start()
+    with pytest.raises(ValueError):
+        dom_representation.tree_representation.get_node_source_span(
+            pos_xpath="/html"
+        )
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import tracemalloc
+
+from betterhtmlchunking.main import DomRepresentation
+from betterhtmlchunking.render_system import ChunkKind
+from betterhtmlchunking.stats import PipelineStats
+from betterhtmlchunking.stats import StageStats
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+
+
+DOCUMENT: str = (
+    "<html><body>"
+    "<div><p>one two three</p><p>four</p></div>"
+    "<ul><li>a</li><li>bbbbbbbbbbbbbbbbbbbbbbbbbbbbbb</li></ul>"
+    "</body></html>"
+)
+STAGE_NAMES: list[str] = [
+    "parse", "metrics", "filter", "tree", "roi", "render",
+]
+
+
+def make_dom_representation(**kwargs) -> DomRepresentation:
+    return DomRepresentation(
+        MAX_NODE_REPR_LENGTH=10,
+        website_code=DOCUMENT,
+        repr_length_compared_by=ReprLengthComparisionBy.TEXT_LENGTH,
+        **kwargs
+    )
+
+
+def test_callbacks_get_stages_and_stats():
+    stages: list[StageStats] = []
+    stats: list[PipelineStats] = []
+    dom_representation = make_dom_representation(
+        stage_callback=stages.append,
+        stats_callback=stats.append
+    )
+    dom_representation.start()
+
+    # In pipeline order; a stage run more than once is reported again.
+    assert list(dict.fromkeys(stage.name for stage in stages)) ==\
+        STAGE_NAMES
+    assert stats == [dom_representation.stats]
+
+    stats_dict: dict = dom_representation.stats.as_dict()
+    assert list(stats_dict["stages"]) == STAGE_NAMES
+    assert all(
+        stage["wall_time"] >= 0 and stage["peak_memory"] is None
+        for stage in stats_dict["stages"].values()
+    )
+    assert stats_dict["counters"]["nodes"] == 8
+    assert stats_dict["counters"]["rois"] ==\
+        len(dom_representation.render_system.text_render_roi)
+
+
+def test_rendered_chunks_counted_per_kind():
+    for kinds in [(ChunkKind.HTML, ChunkKind.TEXT), (ChunkKind.TEXT,)]:
+        dom_representation = make_dom_representation(render_kinds=kinds)
+        dom_representation.start()
+        counters: dict[str, int] = dom_representation.stats.counters
+        assert counters["rendered_chunks"] == counters["rois"] * len(kinds)
+    assert dict(dom_representation.render_system.html_render_roi) == {}
+
+
+def test_trace_memory():
+    dom_representation = make_dom_representation(trace_memory=True)
+    dom_representation.start()
+    assert dom_representation.stats.peak_memory > 0
+    assert all(
+        stage.peak_memory is not None
+        for stage in dom_representation.stats.stages.values()
+    )
+    # Stopped by the recorder that started it.
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import io
+
+import re
+
+import tracemalloc
+
+import pytest
+
+from benchmarks.generators import GENERATORS
+
+from betterhtmlchunking.batch import ChunkingOptions
+from betterhtmlchunking.batch import chunk_many
+from betterhtmlchunking.lxml_backend import ParserBackend
+from betterhtmlchunking.streaming import iter_stream_chunks
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+
+from tests.corpus import get_documents
+
+
+DOCUMENTS: list = get_documents(random_count=10) + [
+    GENERATORS[name](30_000, 0)
+    for name in ["articles", "deep_nesting"]
+]
+LATIN_1_DOCUMENT: bytes = (
+    '<html><head><meta charset="iso-8859-1"></head><body>'
+    "<p>Café crème brûlée</p>"
+    + GENERATORS["articles"](5_000, 0)[len("<html><body>"):]
+).encode("iso-8859-1")
+
+
+def get_chunks(chunks) -> list[tuple]:
+    # Streaming always numbers siblings (div[1]) and emits the chunks
+    # as they are completed.
+    return sorted(
+        (
+            [re.sub(r"\[1\]", "", pos_xpath) for pos_xpath in
+             chunk.pos_xpaths],
+            chunk.repr_length,
+            chunk.html,
+            chunk.text
+        )
+        for chunk in chunks
+    )
+
+
+def get_lxml_chunks(website_code, **kwargs) -> list[tuple]:
+    (document_chunks,) = chunk_many(
+        [website_code], workers=1, backend=ParserBackend.LXML, **kwargs
+    )
+    assert document_chunks.error is None
+    return get_chunks(chunks=document_chunks.chunks)
+
+
+def get_stream_chunks(source, block_size: int = 4096,
+                      **kwargs) -> list[tuple]:
+    return get_chunks(chunks=iter_stream_chunks(
+        source=source,
+        options=ChunkingOptions(**kwargs),
+        block_size=block_size
+    ))
+
+
+@pytest.mark.parametrize("compared_by", [
+    ReprLengthComparisionBy.HTML_LENGTH,
+    ReprLengthComparisionBy.TEXT_LENGTH,
+])
+@pytest.mark.parametrize("max_length", [16, 256, 4096])
+def test_stream_chunks_equal_chunk_many(compared_by, max_length):
+    for website_code in DOCUMENTS:
+        assert get_stream_chunks(
+            website_code, max_length=max_length, compared_by=compared_by
+        ) == get_lxml_chunks(
+            website_code, max_length=max_length, compared_by=compared_by
+        )
+
+
+def test_sources_equal_str(tmp_path):
+    website_code: str = DOCUMENTS[-2]
+    path = tmp_path / "page.html"
+    path.write_text(website_code, encoding="utf-8")
+    data: bytes = website_code.encode("utf-8")
+    expected = get_stream_chunks(website_code, max_length=256)
+    for source in [
+            data, path, io.BytesIO(data), io.StringIO(website_code)]:
+        assert get_stream_chunks(source, max_length=256) == expected,\
+            type(source).__name__
+
+
+def test_str_is_never_a_path(tmp_path):
+    path = tmp_path / "page.html"
+    path.write_text("<p>file</p>", encoding="utf-8")
+    (chunk,) = iter_stream_chunks(
+        source=str(path), options=ChunkingOptions(max_length=256)
+    )
+    assert chunk.text == str(path)
+
+
+def test_encoding_is_detected(tmp_path):
+    path = tmp_path / "page.html"
+    path.write_bytes(LATIN_1_DOCUMENT)
+    expected = get_lxml_chunks(LATIN_1_DOCUMENT, max_length=256)
+    assert any("Café crème brûlée" in chunk[3] for chunk in expected)
+    for source in [
+            LATIN_1_DOCUMENT, path, io.BytesIO(LATIN_1_DOCUMENT)]:
+        assert get_stream_chunks(source, max_length=256) == expected
+    # A given encoding is used as is.
+    text: str = "".join(
+        chunk.text for chunk in iter_stream_chunks(
+            source=LATIN_1_DOCUMENT,
+            options=ChunkingOptions(max_length=256),
+            encoding="utf-8"
+        )
+    )
+    assert "Caf\ufffd cr\ufffdme" in text
+
+
+def test_memory_is_bounded(tmp_path):
+    options = ChunkingOptions(max_length=4096)
+    # Imports and caches filled by the first document.
+    for _ in iter_stream_chunks(
+            source=GENERATORS["articles"](50_000, 1), options=options):
+        ...
+    path = tmp_path / "large.html"
+    path.write_text(GENERATORS["articles"](3_000_000, 0), encoding="utf-8")
+    document_size: int = path.stat().st_size
+
+    with open(path, "rb") as file:
+        tracemalloc.start()
+        try:
+            chunks_count: int = sum(
+                1 for _ in iter_stream_chunks(source=file, options=options)
+            )
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    assert chunks_count > 100
+    assert peak < document_size // 2
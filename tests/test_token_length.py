@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from betterhtmlchunking.batch import ChunkingOptions
+from betterhtmlchunking.batch import chunk_document
+from betterhtmlchunking.lxml_backend import ParserBackend
+from betterhtmlchunking.main import DomRepresentation
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+
+
+# "one two three" is there twice, the " " between the paragraphs is not
+# tokenized.
+DOCUMENT: str = (
+    "<html><body>"
+    "<div><p>one two three</p> <p>four five</p></div>"
+    "<ul><li>six</li><li>seven eight nine ten</li></ul>"
+    "<footer><p>one two three</p></footer>"
+    "</body></html>"
+)
+OTHER_DOCUMENT: str = (
+    "<html><body>"
+    "<div><p>one two three</p><p>eleven</p></div>"
+    "</body></html>"
+)
+
+TOKEN_LENGTHS: dict[str, int] = {
+    "/html": 13,
+    "/html/body": 13,
+    "/html/body/div": 5,
+    "/html/body/div/p[1]": 3,
+    "/html/body/div/p[2]": 2,
+    "/html/body/ul": 5,
+    "/html/body/ul/li[1]": 1,
+    "/html/body/ul/li[2]": 4,
+    "/html/body/footer": 3,
+    "/html/body/footer/p": 3,
+}
+
+
+class SplitTokenizer:
+    # str.split tokens, with every text it was called on.
+    def __init__(self):
+        self.calls: list[str] = []
+
+    def __call__(self, text: str) -> list[str]:
+        self.calls.append(text)
+        return text.split()
+
+
+def make_options(
+    tokenizer: SplitTokenizer,
+    backend: ParserBackend = ParserBackend.BS4
+        ) -> ChunkingOptions:
+    return ChunkingOptions(
+        max_length=5,
+        compared_by=ReprLengthComparisionBy.TOKEN_LENGTH,
+        kinds=(),
+        tag_list_to_filter_out=[],
+        backend=backend,
+        tokenizer=tokenizer
+    )
+
+
+def start(website_code: str, options: ChunkingOptions) -> DomRepresentation:
+    dom_representation: DomRepresentation =\
+        options.make_dom_representation(website_code=website_code)
+    dom_representation.start()
+    return dom_representation
+
+
+@pytest.mark.parametrize("backend", list(ParserBackend))
+def test_token_lengths(backend):
+    dom_representation = start(
+        website_code=DOCUMENT,
+        options=make_options(tokenizer=SplitTokenizer(), backend=backend)
+    )
+    compact_tree = dom_representation.tree_representation.compact_tree
+    assert dict(
+        zip(compact_tree.pos_xpaths, compact_tree.token_lengths)
+    ) == TOKEN_LENGTHS
+
+
+def test_token_length_grouping():
+    result = chunk_document(
+        index=0,
+        website_code=DOCUMENT,
+        options=make_options(tokenizer=SplitTokenizer())
+    )
+    assert [
+        (chunk.pos_xpaths, chunk.repr_length) for chunk in result.chunks
+    ] == [
+        (["/html/body/div"], 5),
+        (["/html/body/ul"], 5),
+        # Hanging after the last region, which was closed by ul.
+        (["/html/body/footer"], 3),
+    ]
+
+
+def test_segments_tokenized_once():
+    tokenizer = SplitTokenizer()
+    dom_representation = start(
+        website_code=DOCUMENT, options=make_options(tokenizer=tokenizer)
+    )
+    assert tokenizer.calls == [
+        "one two three", "four five", "six", "seven eight nine ten",
+    ]
+    assert dom_representation.stats.counters["tokenized_segments"] == 4
+    assert dom_representation.stats.counters["token_cache_hits"] == 1
+
+
+def test_token_counts_shared_across_documents():
+    tokenizer = SplitTokenizer()
+    options = make_options(tokenizer=tokenizer)
+    start(website_code=DOCUMENT, options=options)
+    tokenizer.calls.clear()
+
+    dom_representation = start(website_code=OTHER_DOCUMENT, options=options)
+    assert tokenizer.calls == ["eleven"]
+    assert dom_representation.stats.counters["tokenized_segments"] == 1
+    assert dom_representation.stats.counters["token_cache_hits"] == 1
+
+    start(website_code=DOCUMENT, options=options)
+    assert tokenizer.calls == ["eleven"]
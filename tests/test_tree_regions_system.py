@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from benchmarks.generators import GENERATORS
+
+from betterhtmlchunking import tree_regions_system
+from betterhtmlchunking.main import DomRepresentation
+from betterhtmlchunking.tree_regions_system import CompactROIMaker
+from betterhtmlchunking.tree_regions_system import ROIMaker
+from betterhtmlchunking.tree_regions_system import ROIParsingState
+from betterhtmlchunking.tree_regions_system import ReprLengthComparisionBy
+from betterhtmlchunking.tree_regions_system import explore_subtrees
+from betterhtmlchunking.tree_regions_system import explore_subtrees_in_pool
+from betterhtmlchunking.tree_representation import DOMTreeRepresentation
+
+from tests.corpus import get_documents
+
+
+def get_regions(exploration) -> list[tuple[list[str], int]]:
+    return sorted(
+        (roi.pos_xpath_list, roi.repr_length)
+        for roi in exploration.regions
+    )
+
+
+def test_pool_exploration_matches_serial():
+    # Threads, which also run (without speeding up) with the GIL.
+    compact_tree = DOMTreeRepresentation(
+        website_code=GENERATORS["articles"](200_000, 0)
+    ).compact_tree
+    parameters: dict = {
+        "compact_tree": compact_tree,
+        "max_node_repr_length": 512,
+        "repr_length_compared_by": ReprLengthComparisionBy.HTML_LENGTH,
+    }
+    serial = explore_subtrees(root_ids=[0], **parameters)
+
+    exploration = explore_subtrees(root_ids=[0], max_frontier=16,
+                                   **parameters)
+    assert exploration.frontier
+    for subtrees_exploration in explore_subtrees_in_pool(
+            subtree_ids=exploration.frontier, workers=4, **parameters):
+        exploration.merge(exploration=subtrees_exploration)
+
+    assert get_regions(exploration=exploration) ==\
+        get_regions(exploration=serial)
+    assert exploration.nodes_visited == serial.nodes_visited
+
+
+def get_sorted_regions(
+    website_code: str,
+    max_length: int,
+    discovery_workers: int
+        ) -> list[tuple[list[str], int]]:
+    dom_representation = DomRepresentation(
+        MAX_NODE_REPR_LENGTH=max_length,
+        website_code=website_code,
+        repr_length_compared_by=ReprLengthComparisionBy.TEXT_LENGTH,
+        discovery_workers=discovery_workers
+    )
+    dom_representation.start()
+    return [
+        (roi.pos_xpath_list, roi.repr_length)
+        for roi in dom_representation.tree_regions_system
+        .sorted_roi_by_pos_xpath.values()
+    ]
+
+
+@pytest.mark.parametrize("max_length", [16, 256])
+def test_parallel_discovery_matches_serial(monkeypatch, max_length):
+    # Pretend to run without the GIL, on every document size.
+    monkeypatch.setattr(tree_regions_system, "is_free_threaded",
+                        lambda: True)
+    monkeypatch.setattr(tree_regions_system, "MIN_PARALLEL_NODES", 1)
+    pool_calls: list[int] = []
+
+    def count_pool_calls(**kwargs):
+        pool_calls.append(len(kwargs["subtree_ids"]))
+        return explore_subtrees_in_pool(**kwargs)
+
+    monkeypatch.setattr(tree_regions_system, "explore_subtrees_in_pool",
+                        count_pool_calls)
+    website_codes: list[str] = get_documents(random_count=10) + [
+        GENERATORS[name](50_000, 0)
+        for name in ["articles", "deep_nesting"]
+    ]
+    for website_code in website_codes:
+        assert get_sorted_regions(
+            website_code=website_code,
+            max_length=max_length,
+            discovery_workers=4
+        ) == get_sorted_regions(
+            website_code=website_code,
+            max_length=max_length,
+            discovery_workers=1
+        )
+    assert pool_calls
+
+
+def test_discovery_workers_with_gil_warns(monkeypatch):
+    monkeypatch.setattr(tree_regions_system, "is_free_threaded",
+                        lambda: False)
+    website_code: str = GENERATORS["articles"](5_000, 0)
+    with pytest.warns(RuntimeWarning, match="discovery_workers"):
+        regions = get_sorted_regions(
+            website_code=website_code, max_length=256, discovery_workers=4
+        )
+    assert regions == get_sorted_regions(
+        website_code=website_code, max_length=256, discovery_workers=1
+    )
+
+
+def test_discovery_workers_below_one_raises():
+    with pytest.raises(ValueError, match="discovery_workers"):
+        get_sorted_regions(
+            website_code="<p>text</p>", max_length=256, discovery_workers=0
+        )
+
+
+def test_deprecated_roi_maker_matches_compact():
+    tree_representation = DOMTreeRepresentation(
+        website_code=GENERATORS["articles"](20_000, 0)
+    )
+    compact_tree = tree_representation.compact_tree
+    for node_id, pos_xpath in enumerate(compact_tree.pos_xpaths):
+        children_ids: list[int] = compact_tree.get_children(node_id=node_id)
+        parameters: dict = {
+            "max_node_repr_length": 256,
+            "repr_length_compared_by": ReprLengthComparisionBy.TEXT_LENGTH,
+        }
+        compact_roi_maker = CompactROIMaker(
+            node_id=node_id,
+            children_ids=children_ids,
+            compact_tree=compact_tree,
+            **parameters
+        )
+        with pytest.deprecated_call():
+            roi_maker = ROIMaker(
+                node_xpath=pos_xpath,
+                children_tags=[
+                    compact_tree.pos_xpaths[child_id]
+                    for child_id in children_ids
+                ],
+                tree_representation=tree_representation,
+                **parameters
+            )
+        assert roi_maker.PARSING_STATE == ROIParsingState.EOF
+        assert roi_maker.regions_of_interest_list ==\
+            compact_roi_maker.regions_of_interest_list
+        assert roi_maker.children_to_enqueue == [
+            compact_tree.pos_xpaths[child_id]
+            for child_id in compact_roi_maker.children_to_enqueue
+        ]
+        assert roi_maker.get_node_repr_length(
+            node=tree_representation.tree.get_node(nid=pos_xpath)
+        ) == compact_tree.text_lengths[node_id]
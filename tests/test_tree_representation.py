@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from betterhtmlchunking.tree_representation import DOMTreeRepresentation
+from betterhtmlchunking.tree_representation import\
+    get_pos_xpath_from_bs4_elem
+
+from tests.corpus import get_documents
+
+
+DOCUMENTS: list[str] = get_documents()
+
+
+@pytest.mark.parametrize("tag_list_to_filter_out", [None, []])
+def test_pos_xpaths_match_per_element(tag_list_to_filter_out):
+    for document in DOCUMENTS:
+        dom = DOMTreeRepresentation(
+            website_code=document,
+            tag_list_to_filter_out=tag_list_to_filter_out
+        )
+        assert dom.compact_tree.pos_xpaths == [
+            get_pos_xpath_from_bs4_elem(element=tag)
+            for tag in dom.soup.find_all(True)
+        ]